@@ -0,0 +1,81 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import heapq
+
+# Группа свободных мест: (тип), (тип, парковка) или (тип, парковка, зона)
+GroupKey = Tuple[str, ...]
+
+class FreeSpots:
+    """Свободные места одной группы в порядке предпочтения.
+
+    Куча с ленивым удалением: занятое место не ищется в куче, а
+    выбрасывается, когда оказывается на ее вершине.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[tuple, int]] = []
+        self.queued: Set[int] = set()
+
+    def push(self, rank: tuple, i: int):
+        # Место, запись о котором еще лежит в куче, повторно не добавляется
+        if i not in self.queued:
+            heapq.heappush(self.heap, (rank, i))
+            self.queued.add(i)
+
+    def peek(self, unavailable: Callable[[int], bool]) -> Optional[Tuple[tuple, int]]:
+        while self.heap and unavailable(self.heap[0][1]):
+            _, i = heapq.heappop(self.heap)
+            self.queued.discard(i)
+        return self.heap[0] if self.heap else None
+
+class SpotAllocator:
+    """Выбор лучшего свободного места нужного типа за O(log n).
+
+    Места упорядочены по рангу: порядок парковки, приоритет зоны (ближе к
+    въезду — меньше), номер места. Для каждого типа места ведутся кучи по
+    всем парковкам, по парковке и по зоне, поэтому выбор с предпочтением
+    парковки или зоны не требует перебора мест.
+    """
+
+    def __init__(self):
+        self.groups: Dict[GroupKey, FreeSpots] = {}
+        self.ranks: List[tuple] = []
+        self.keys: List[Tuple[GroupKey, ...]] = []
+        # Места, выбранные для заезда, запись которого еще не завершена
+        self.claimed: Set[int] = set()
+
+    def load(self, ranks: List[tuple], types: List[str], lots: List[str], zones: List[Optional[str]], occupied: bytearray,
+             claimed: Set[int] = frozenset()):
+        """Построение куч; claimed — места, которые держат незавершенные заезды (при перезагрузке состояния)"""
+        self.groups = {}
+        self.ranks = ranks
+        self.keys = [
+            ((spot_type,), (spot_type, lot_id), (spot_type, lot_id, zone_id))
+            for spot_type, lot_id, zone_id in zip(types, lots, zones)
+        ]
+        self.claimed = set(claimed)
+        for i in range(len(ranks)):
+            if not occupied[i]:
+                self.free(i)
+
+    def free(self, i: int):
+        """Место снова доступно для выбора"""
+        for key in self.keys[i]:
+            self.groups.setdefault(key, FreeSpots()).push(self.ranks[i], i)
+
+    def claim(self, key: GroupKey, occupied: bytearray) -> Optional[int]:
+        """Выбор лучшего свободного места группы; место резервируется до release"""
+        group = self.groups.get(key)
+        if group is None:
+            return None
+        top = group.peek(lambda i: occupied[i] or i in self.claimed)
+        if top is None:
+            return None
+        i = top[1]
+        self.claimed.add(i)
+        return i
+
+    def release(self, i: int, occupied: bytearray):
+        """Снятие резерва; незанятое место возвращается в кучи"""
+        self.claimed.discard(i)
+        if not occupied[i]:
+            self.free(i)
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+import asyncio
+import orjson
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число неотправленных сообщений на одного клиента
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "100"))
+
+class Broadcaster:
+    """Рассылка изменений состояния парковки подписчикам (WebSocket/SSE).
+
+    У каждого подписчика своя ограниченная очередь. Публикация никогда не
+    ждет: если клиент не успевает читать и его очередь заполнена, он
+    отключается и при переподключении получает свежий снимок состояния.
+    """
+
+    def __init__(self, queue_size: int = BROADCAST_QUEUE_SIZE):
+        self.queue_size = queue_size
+        # Подписчики по парковкам; None — подписка на все парковки
+        self.subscribers: Dict[Optional[str], Set[asyncio.Queue]] = {}
+
+    def publish(self, message: dict, lot_ids: List[Optional[str]]):
+        """Отправка сообщения подписчикам указанных парковок"""
+        queues = [queue for lot_id in lot_ids for queue in self.subscribers.get(lot_id, ())]
+        if not queues:
+            return
+        # Сообщение сериализуется один раз для всех подписчиков
+        text = orjson.dumps(message).decode()
+        for queue in queues:
+            try:
+                queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        """Отключение отстающего подписчика"""
+        for queues in self.subscribers.values():
+            queues.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        # None сообщает обработчику соединения, что его нужно закрыть
+        queue.put_nowait(None)
+        logger.warning("Подписчик не успевает получать обновления и отключен")
+
+    @contextmanager
+    def subscribe(self, lot_id: Optional[str] = None):
+        queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(lot_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[lot_id].discard(queue)
+
+broadcaster = Broadcaster()
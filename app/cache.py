@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import os
+import time
+
+# Время жизни и максимальное число закэшированных ответов
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+class ResponseCache:
+    """LRU-кэш ответов с ограниченным временем жизни.
+
+    Ключ — эндпоинт и параметры запроса. Кэш очищается событиями, которые
+    меняют результат (заезды и выезды), а TTL ограничивает устаревание
+    данных, которые меняются без участия этого процесса.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, size: int = RESPONSE_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+response_cache = ResponseCache()
@@ -1,5 +1,8 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, OperationFailure
+from typing import Optional
+from metrics import mongo_listener
+import asyncio
 import os
 import logging
 
@@ -8,11 +11,129 @@ logger = logging.getLogger(__name__)
 
 mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 
-logger.info(f"Connecting to MongoDB at {mongodb_uri}")
+# Настройки пула соединений и таймаутов
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Многодокументные транзакции требуют replica set, поэтому включаются явно
+MONGO_USE_TRANSACTIONS = os.getenv("MONGO_USE_TRANSACTIONS", "false").lower() in ("1", "true", "yes")
+# Число документов в одном ответе курсора при чтении больших выборок
+MONGO_CURSOR_BATCH_SIZE = int(os.getenv("MONGO_CURSOR_BATCH_SIZE", "5000"))
+# Срок хранения сырой истории в днях (0 — бессрочно); статистика за более
+# длительный срок читается из агрегатов stats_rollups
+LOAD_HISTORY_TTL_DAYS = int(os.getenv("LOAD_HISTORY_TTL_DAYS", "30"))
+PARKING_HISTORY_TTL_DAYS = int(os.getenv("PARKING_HISTORY_TTL_DAYS", "0"))
 
-try:
-    client = MongoClient(mongodb_uri)
-    smart_parking_db = client.smart_parking
-    logger.info("Подключение к базе данных установлено")
-except ConnectionFailure as e:
-    logger.error(f"Could not connect to MongoDB: {e}")
+_client: Optional[AsyncMongoClient] = None
+
+def get_client() -> AsyncMongoClient:
+    """Клиент MongoDB, создаваемый при первом обращении, а не при импорте модуля"""
+    global _client
+    if _client is None:
+        logger.info(f"Connecting to MongoDB at {mongodb_uri}")
+        # Асинхронный клиент не блокирует цикл событий uvicorn;
+        # само подключение устанавливается при первом запросе
+        _client = AsyncMongoClient(
+            mongodb_uri,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            # Число и длительность команд по коллекциям для /metrics
+            event_listeners=[mongo_listener],
+        )
+    return _client
+
+def get_db():
+    return get_client().smart_parking
+
+def __getattr__(name: str):
+    # database.client и database.smart_parking_db создают клиент при первом обращении
+    if name == "client":
+        return get_client()
+    if name == "smart_parking_db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def connect_db(mongo_client: Optional[AsyncMongoClient] = None):
+    """Проверка подключения к базе данных при старте приложения"""
+    try:
+        await (mongo_client or get_client()).admin.command("ping")
+        logger.info("Подключение к базе данных установлено")
+    except ConnectionFailure as e:
+        logger.error(f"Could not connect to MongoDB: {e}")
+        raise
+
+async def close_db(mongo_client: Optional[AsyncMongoClient] = None):
+    """Закрытие пула соединений при остановке приложения (если клиент создавался)"""
+    mongo_client = mongo_client or _client
+    if mongo_client is not None:
+        await mongo_client.close()
+        logger.info("Подключение к базе данных закрыто")
+
+async def create_unique_indexes(db=None):
+    """Уникальные индексы, которые нужны до начального заполнения и первых заездов"""
+    db = db if db is not None else get_db()
+    # Уникальные индексы делают начальное заполнение безопасным при одновременном старте нескольких экземпляров
+    await asyncio.gather(
+        db.spots.create_index([("spot_id", ASCENDING)], unique=True),
+        db.lots.create_index([("lot_id", ASCENDING)], unique=True),
+        # Одно ТС может иметь только одну активную (неоплаченную) запись
+        db.vehicles.create_index(
+            [("id", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"paid": False},
+            name="active_vehicle_id",
+        ),
+    )
+
+async def create_indexes(db=None):
+    """Индексы для выборок; создаются параллельно, пока сервис прогревается"""
+    db = db if db is not None else get_db()
+    await asyncio.gather(
+        # Индексы для выборок статистики по времени, они же удаляют устаревшую историю
+        create_ttl_index(db.parking_load_history, "timestamp", LOAD_HISTORY_TTL_DAYS),
+        create_ttl_index(db.parking_history, "exit_time", PARKING_HISTORY_TTL_DAYS),
+        db.vehicles.create_index([("entry_time", ASCENDING)]),
+        # Поиск записи ТС по номеру (в том числе закрытой — для ответа на повторный выезд)
+        db.vehicles.create_index([("id", ASCENDING), ("entry_time", DESCENDING)]),
+        # Стоянки в момент времени и стоянки ТС со страницами по (exit_time, _id), см. sessions.py
+        db.parking_history.create_index([("exit_time", ASCENDING), ("_id", ASCENDING), ("entry_time", ASCENDING)]),
+        db.parking_history.create_index([("vehicle_id", ASCENDING), ("exit_time", DESCENDING), ("_id", DESCENDING)]),
+        db.parking_history.create_index([("duration_minutes", DESCENDING)]),
+        # Журнал событий читается при восстановлении в порядке времени, при равном времени — в порядке записи
+        db.events.create_index([("timestamp", ASCENDING), ("_id", ASCENDING)]),
+        # Брони: отмена по идентификатору, загрузка текущих и будущих броней места при старте
+        db.reservations.create_index([("reservation_id", ASCENDING)], unique=True),
+        db.reservations.create_index([("spot_id", ASCENDING), ("end", ASCENDING)]),
+    )
+
+async def create_ttl_index(collection, field: str, days: int):
+    """Индекс по времени с удалением документов старше days дней (0 — без удаления)"""
+    options = {"expireAfterSeconds": days * 86400} if days else {}
+    try:
+        await collection.create_index([(field, ASCENDING)], **options)
+    except OperationFailure as e:
+        # 85 IndexOptionsConflict: индекс уже есть с другим сроком хранения
+        if e.code != 85:
+            raise
+        if days:
+            await collection.database.command(
+                "collMod", collection.name,
+                index={"keyPattern": {field: 1}, "expireAfterSeconds": days * 86400}
+            )
+        else:
+            await collection.drop_index([(field, ASCENDING)])
+            await collection.create_index([(field, ASCENDING)])
+
+async def run_in_transaction(callback):
+    """Выполнение callback(session) в транзакции, если они включены, иначе без сессии"""
+    if not MONGO_USE_TRANSACTIONS:
+        return await callback(None)
+    async with get_client().start_session() as session:
+        return await session.with_transaction(callback)
@@ -0,0 +1,298 @@
+"""Журнал событий парковки и восстановление состояния по нему.
+
+Каждый заезд, выезд и сброс добавляет документ в коллекцию events
+(только добавление, документы не изменяются):
+
+    {"timestamp": ..., "event": "arrive", "vehicle_id": "A123", "isEv": false,
+     "type": "car", "spot_id": 3, "lot_id": "main"}
+    {"timestamp": ..., "event": "depart", "vehicle_id": "A123", "isEv": false,
+     "type": "car", "spot_id": 3, "lot_id": "main", "entry_time": ...,
+     "cost": 42.5, "duration_minutes": 28.3}
+    {"timestamp": ..., "event": "reset"}
+
+Запись идет в фоне пачками, вне пути запроса. Запуск как скрипта
+восстанавливает по журналу места, записи ТС, историю стоянок, историю
+загруженности и агрегаты (сервис должен быть остановлен):
+    python app/events.py --until 2025-03-01T12:00 --dry-run
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database import MONGO_CURSOR_BATCH_SIZE
+from layout import ALL_LOTS, DEFAULT_LOT_ID
+from load_recorder import LoadRecorder, LOAD_TICK_SECONDS
+import asyncio
+import logging
+import os
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Период записи накопленных событий в базу (секунды)
+EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", "1"))
+
+def arrival(vehicle: dict) -> dict:
+    """Событие заезда по записи ТС"""
+    return {
+        "_id": ObjectId(), "timestamp": vehicle["entry_time"], "event": "arrive",
+        "vehicle_id": vehicle["id"], "isEv": vehicle["isEv"], "type": vehicle["type"],
+        "spot_id": vehicle["spot_id"], "lot_id": vehicle["lot_id"]
+    }
+
+def departure(is_ev: bool, entry: dict) -> dict:
+    """Событие выезда по записи истории стоянок: событие содержит всю стоянку"""
+    return {
+        "_id": ObjectId(), "timestamp": entry["exit_time"], "event": "depart",
+        "vehicle_id": entry["vehicle_id"], "isEv": is_ev, "type": entry["vehicle_type"],
+        "spot_id": entry["spot_id"], "lot_id": entry["lot_id"], "entry_time": entry["entry_time"],
+        "cost": entry["cost"], "duration_minutes": entry["duration_minutes"]
+    }
+
+def reset() -> dict:
+    return {"_id": ObjectId(), "timestamp": datetime.now(), "event": "reset"}
+
+class EventLog:
+    """Фоновая запись журнала событий.
+
+    Событие получает _id при создании, поэтому повторная запись пачки после
+    частичной ошибки не создает дублей, а события с одинаковым временем
+    упорядочиваются по _id. Несохраненные события записываются при остановке.
+    """
+
+    def __init__(self, flush_interval: float = EVENTS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.pending: List[dict] = []
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def record(self, *events: dict):
+        """Учет событий без обращения к базе; журнал ведется, только если запись запущена (MongoDB)"""
+        if self.db is not None:
+            self.pending += events
+
+    async def flush(self):
+        if not self.pending:
+            return
+        documents, self.pending = self.pending, []
+        try:
+            await self.db.events.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # 11000: событие уже записано предыдущей попыткой
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                logger.error(f"Не удалось записать журнал событий: {e}")
+                self.pending = documents + self.pending
+        except Exception as e:
+            # Возвращаем события в очередь, чтобы повторить запись при следующем сбросе
+            logger.error(f"Не удалось записать журнал событий: {e}")
+            self.pending = documents + self.pending
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self, db):
+        self.db = db
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи с записью всех накопленных событий"""
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+event_log = EventLog()
+
+async def replay(db, until: Optional[datetime] = None, ignore_resets: bool = False,
+                 batch_size: int = MONGO_CURSOR_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Восстановление состояния по журналу событий до момента until.
+
+    События применяются по порядку к состоянию в памяти; документы ТС,
+    истории стоянок и загруженности пишутся пакетными вставками, места —
+    одним пакетом в конце, агрегаты пересобираются за затронутые сутки.
+    Выезд содержит всю стоянку, поэтому попадает в историю, даже если
+    заезд был раньше начала журнала; ТС, стоявшие на парковке в начале
+    журнала, берутся из коллекции vehicles. Записи истории, ТС и загруженности за
+    период журнала заменяются, более ранние сохраняются. Сброс освобождает
+    все места, а с ignore_resets пропускается — так отменяется ошибочный
+    /api/reset. События, противоречащие состоянию (заезд на занятое место,
+    выезд ТС, которого нет на этом месте), состояние не меняют.
+    """
+    window = {"$lt": until} if until else {}
+    result = {"events": 0, "arrivals": 0, "departures": 0, "resets": 0, "skipped": 0, "active": 0}
+    first = await db.events.find_one({"timestamp": window} if window else {}, sort=[("timestamp", 1), ("_id", 1)])
+    if first is None:
+        return result
+    start = first["timestamp"]
+    replayed = {"$gte": start, **window}
+
+    spot_lots = {
+        spot["spot_id"]: spot.get("lot_id", DEFAULT_LOT_ID)
+        async for spot in db.spots.find({}, {"_id": 0, "spot_id": 1, "lot_id": 1})
+    }
+    lot_total: Dict[str, int] = {}
+    for lot_id in spot_lots.values():
+        lot_total[lot_id] = lot_total.get(lot_id, 0) + 1
+    lot_total[ALL_LOTS] = len(spot_lots)
+    lot_occupied = dict.fromkeys(lot_total, 0)
+    spots: Dict[int, str] = {}
+    active: Dict[str, dict] = {}
+
+    # ТС, заехавшие до начала журнала и стоявшие на парковке в его начале: их заездов в журнале нет
+    parked = []
+    async for vehicle in db.vehicles.find(
+        {"entry_time": {"$lt": start}, "$or": [{"paid": False}, {"exit_time": {"$gte": start}}]}
+    ).sort("entry_time", 1):
+        spot_id, vehicle_id = vehicle["spot_id"], vehicle["id"]
+        if spot_id not in spot_lots or spot_id in spots or vehicle_id in active:
+            continue
+        parked.append(vehicle["_id"])
+        spots[spot_id] = vehicle_id
+        active[vehicle_id] = {
+            "id": vehicle_id, "isEv": vehicle.get("isEv", False), "type": vehicle.get("type"),
+            "entry_time": vehicle["entry_time"], "exit_time": None,
+            "spot_id": spot_id, "lot_id": vehicle.get("lot_id", spot_lots[spot_id]), "paid": False
+        }
+        lot_occupied[spot_lots[spot_id]] += 1
+        lot_occupied[ALL_LOTS] += 1
+
+    if not dry_run:
+        tick_start = rollups.floor_time(start, LOAD_TICK_SECONDS)
+        await asyncio.gather(
+            db.parking_history.delete_many({"exit_time": replayed}),
+            db.parking_load_history.delete_many({"timestamp": {**replayed, "$gte": tick_start}}),
+            # Записи ТС, стоявших до начала журнала, тоже заменяются: их заново записывает воспроизведение
+            db.vehicles.delete_many({"$or": [
+                {"entry_time": replayed}, {"exit_time": replayed}, {"paid": False}, {"_id": {"$in": parked}}
+            ]}),
+        )
+
+    recorder = LoadRecorder()
+    vehicles, history, load = [], [], []
+
+    async def flush(everything: bool = False):
+        nonlocal vehicles, history, load
+        if not everything and len(vehicles) + len(history) + len(load) < batch_size:
+            return
+        writes = [
+            collection.insert_many(documents, ordered=False)
+            for collection, documents in ((db.vehicles, vehicles), (db.parking_history, history), (db.parking_load_history, load))
+            if documents and not dry_run
+        ]
+        vehicles, history, load = [], [], []
+        await asyncio.gather(*writes)
+
+    def occupancy(spot_id: int, delta: int):
+        lot_id = spot_lots[spot_id]
+        lot_occupied[lot_id] += delta
+        lot_occupied[ALL_LOTS] += delta
+
+    cursor = db.events.find({"timestamp": replayed}).sort([("timestamp", 1), ("_id", 1)]).batch_size(batch_size)
+    current_tick = None
+    last = start
+    async for event in cursor:
+        result["events"] += 1
+        last = event["timestamp"]
+        kind = event["event"]
+        if kind == "reset":
+            result["resets"] += 1
+            if not ignore_resets:
+                spots.clear()
+                active.clear()
+                lot_occupied.update(dict.fromkeys(lot_total, 0))
+            continue
+        spot_id, vehicle_id = event["spot_id"], event["vehicle_id"]
+        if kind == "arrive":
+            if spot_id not in spot_lots or spot_id in spots or vehicle_id in active:
+                result["skipped"] += 1
+                continue
+            spots[spot_id] = vehicle_id
+            active[vehicle_id] = {
+                "id": vehicle_id, "isEv": event["isEv"], "type": event["type"],
+                "entry_time": event["timestamp"], "exit_time": None,
+                "spot_id": spot_id, "lot_id": event["lot_id"], "paid": False
+            }
+            occupancy(spot_id, 1)
+            result["arrivals"] += 1
+        else:
+            vehicle = active.get(vehicle_id)
+            if vehicle is not None and vehicle["spot_id"] == spot_id:
+                del active[vehicle_id]
+                del spots[spot_id]
+                occupancy(spot_id, -1)
+            else:
+                result["skipped"] += 1
+            vehicles.append({
+                "id": vehicle_id, "isEv": event["isEv"], "type": event["type"],
+                "entry_time": event["entry_time"], "exit_time": event["timestamp"],
+                "spot_id": spot_id, "lot_id": event["lot_id"], "paid": True, "cost": event["cost"]
+            })
+            history.append({
+                "vehicle_id": vehicle_id,
+                "vehicle_type": event["type"],
+                "spot_id": spot_id,
+                "lot_id": event["lot_id"],
+                "entry_time": event["entry_time"],
+                "exit_time": event["timestamp"],
+                "duration_minutes": event["duration_minutes"],
+                "cost": event["cost"]
+            })
+            result["departures"] += 1
+
+        # Замеры загруженности — как при обработке события сервисом
+        tick = rollups.floor_time(event["timestamp"], recorder.tick_seconds)
+        if tick != current_tick:
+            load += recorder.documents(recorder.take(tick))
+            current_tick = tick
+        for lot_id in (spot_lots.get(spot_id), ALL_LOTS):
+            if lot_id in lot_total:
+                recorder.record(event["timestamp"], lot_id, lot_occupied[lot_id], lot_total[lot_id])
+        await flush()
+
+    load += recorder.documents(recorder.take(datetime.max))
+    vehicles += active.values()
+    await flush(everything=True)
+    result["active"] = len(active)
+    if dry_run:
+        return result
+
+    await db.spots.update_many({}, {"$set": {"status": "free", "current_vehicle": None}})
+    if spots:
+        await db.spots.bulk_write([
+            UpdateOne({"spot_id": spot_id}, {"$set": {"status": "occupied", "current_vehicle": vehicle_id}})
+            for spot_id, vehicle_id in spots.items()
+        ], ordered=False)
+    first_day = rollups.bucket_start(start, "1d")
+    await rollups.rebuild(db, first_day, rollups.bucket_start(last, "1d") + timedelta(days=1))
+    return result
+
+async def _main(args):
+    from database import smart_parking_db, connect_db, close_db
+    await connect_db()
+    try:
+        started = asyncio.get_running_loop().time()
+        result = await replay(smart_parking_db, args.until, args.ignore_resets, args.batch_size, args.dry_run)
+        elapsed = asyncio.get_running_loop().time() - started
+        print(f"Событий: {result['events']} за {elapsed:.1f} с ({result['events'] / max(elapsed, 1e-9):.0f}/с), "
+              f"заездов: {result['arrivals']}, выездов: {result['departures']}, сбросов: {result['resets']}, "
+              f"пропущено: {result['skipped']}, на парковке: {result['active']}")
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--until", type=datetime.fromisoformat, help="Применить события раньше этого момента")
+    parser.add_argument("--ignore-resets", action="store_true", help="Не применять сбросы (отмена ошибочного /api/reset)")
+    parser.add_argument("--batch-size", type=int, default=MONGO_CURSOR_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Только проверить журнал, не изменяя данные")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,95 @@
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+import asyncio
+import csv
+import io
+import json
+import os
+
+# Число документов, запрашиваемых у MongoDB за раз и отправляемых клиенту одним блоком
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Каталог для файлов Parquet
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+FIELDS = ["vehicle_id", "vehicle_type", "spot_id", "lot_id", "entry_time", "exit_time", "duration_minutes", "cost"]
+
+def history_filter(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   spot_id: Optional[int] = None, vehicle_type: Optional[str] = None) -> dict:
+    """Условие выборки истории стоянок; период — по времени выезда [start, end)"""
+    query = {}
+    if start is not None or end is not None:
+        query["exit_time"] = {}
+        if start is not None:
+            query["exit_time"]["$gte"] = start
+        if end is not None:
+            query["exit_time"]["$lt"] = end
+    if spot_id is not None:
+        query["spot_id"] = spot_id
+    if vehicle_type is not None:
+        query["vehicle_type"] = vehicle_type
+    return query
+
+async def batches(db, query: dict, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Документы истории пачками; в памяти одновременно находится не больше одной пачки"""
+    cursor = db.parking_history.find(
+        query, {"_id": 0, **{field: 1 for field in FIELDS}}
+    ).sort("exit_time", 1).batch_size(batch_size)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def ndjson(db, query: dict, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[str]:
+    async for batch in batches(db, query, batch_size):
+        yield "".join(
+            json.dumps({field: _plain(doc.get(field)) for field in FIELDS}, ensure_ascii=False) + "\n"
+            for doc in batch
+        )
+
+async def csv_rows(db, query: dict, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    async for batch in batches(db, query, batch_size):
+        writer.writerows([_plain(doc.get(field)) for field in FIELDS] for doc in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок отдается и для пустой выборки
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def parquet(db, query: dict, path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Запись выборки в файл Parquet по пачкам (нужен pyarrow); возвращает число строк"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("vehicle_id", pa.string()),
+        ("vehicle_type", pa.string()),
+        ("spot_id", pa.int64()),
+        ("lot_id", pa.string()),
+        ("entry_time", pa.timestamp("ms")),
+        ("exit_time", pa.timestamp("ms")),
+        ("duration_minutes", pa.float64()),
+        ("cost", pa.float64()),
+    ])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows = 0
+    writer = pq.ParquetWriter(path, schema)
+    try:
+        async for batch in batches(db, query, batch_size):
+            table = pa.Table.from_pylist([{field: doc.get(field) for field in FIELDS} for doc in batch], schema=schema)
+            # Сжатие и запись выполняются вне цикла событий
+            await asyncio.to_thread(writer.write_table, table)
+            rows += len(batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return rows
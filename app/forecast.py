@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from database import MONGO_CURSOR_BATCH_SIZE
+from stats import LABEL_FORMATS
+import asyncio
+import logging
+import numpy as np
+import orjson
+import os
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Горизонт прогноза (часы)
+FORECAST_HORIZON_HOURS = int(os.getenv("FORECAST_HORIZON_HOURS", "48"))
+# Глубина истории для обучения (недели)
+FORECAST_HISTORY_WEEKS = int(os.getenv("FORECAST_HISTORY_WEEKS", "8"))
+# Период переобучения модели (секунды)
+FORECAST_INTERVAL = float(os.getenv("FORECAST_INTERVAL", "900"))
+
+HOURS_IN_WEEK = 7 * 24
+# Вес последней недели в профиле часа недели
+SEASON_ALPHA = 0.3
+# Вес последнего часа в текущем отклонении от профиля и число учитываемых часов
+LEVEL_ALPHA = 0.5
+LEVEL_WINDOW = 24
+# Затухание отклонения за каждый час прогноза
+LEVEL_DAMPING = 0.8
+
+# Прогнозируемые ряды и знаки после запятой
+SERIES = {"load_percentage": 2, "occupied_spots": 2, "departures": 1}
+DEPARTURES = list(SERIES).index("departures")
+
+def smoothed(values: np.ndarray, alpha: float, axis: int) -> np.ndarray:
+    """Экспоненциально взвешенное среднее вдоль оси: последние значения весомее, пропуски (NaN) не учитываются"""
+    count = values.shape[axis]
+    shape = [1] * values.ndim
+    shape[axis] = count
+    weights = ((1 - alpha) ** np.arange(count - 1, -1, -1)).reshape(shape)
+    present = ~np.isnan(values)
+    total = (np.where(present, values, 0) * weights).sum(axis)
+    norm = (present * weights).sum(axis)
+    return np.divide(total, norm, out=np.full(total.shape, np.nan), where=norm > 0)
+
+def fit(history: np.ndarray, horizon: int) -> np.ndarray:
+    """Прогноз рядов на horizon часов, следующих за историей.
+
+    history — матрица (ряды, часы) с пропусками NaN по завершенным часам;
+    первый час — начало недели. Модель: профиль часа недели, сглаженный по неделям, плюс
+    текущее отклонение от профиля, затухающее с горизонтом.
+    """
+    series, hours = history.shape
+    weeks = -(-hours // HOURS_IN_WEEK)
+    padded = np.full((series, weeks * HOURS_IN_WEEK), np.nan)
+    padded[:, :hours] = history
+    profile = smoothed(padded.reshape(series, weeks, HOURS_IN_WEEK), SEASON_ALPHA, axis=1)
+    # Часы недели без данных заполняются средним по ряду, ряды без данных — нулем
+    known = (~np.isnan(profile)).sum(axis=1, keepdims=True)
+    fallback = np.divide(np.nansum(profile, axis=1, keepdims=True), known, out=np.zeros(known.shape), where=known > 0)
+    profile = np.where(np.isnan(profile), fallback, profile)
+
+    recent = np.arange(max(0, hours - LEVEL_WINDOW), hours)
+    deviation = history[:, recent] - profile[:, recent % HOURS_IN_WEEK]
+    level = np.nan_to_num(smoothed(deviation, LEVEL_ALPHA, axis=1))
+
+    ahead = np.arange(horizon)
+    slots = (hours + ahead) % HOURS_IN_WEEK
+    return np.maximum(profile[:, slots] + level[:, None] * LEVEL_DAMPING ** (ahead + 1), 0)
+
+def build_history(rows: list, lots: int, hours: int) -> np.ndarray:
+    """Матрица (парковки, ряды, часы) по строкам (парковка, час, значения рядов).
+
+    Час без агрегата для загруженности — пропуск (NaN), а для выездов — ноль
+    выездов: иначе часы, когда парковка закрыта, прогнозировались бы средним
+    числом выездов. Нули ставятся с первого часа, за который у парковки есть
+    агрегат, — раньше ее могло не быть.
+    """
+    history = np.full((lots, len(SERIES), hours), np.nan)
+    if not rows:
+        return history
+    data = np.array(rows)
+    lot_rows, offsets = data[:, 0].astype(np.int64), data[:, 1].astype(np.int64)
+    first = np.full(lots, hours)
+    np.minimum.at(first, lot_rows, offsets)
+    history[:, DEPARTURES] = np.where(np.arange(hours) >= first[:, None], 0.0, np.nan)
+    for series in range(len(SERIES)):
+        history[lot_rows, series, offsets] = data[:, 2 + series]
+    return history
+
+class ForecastJob:
+    """Фоновое обучение прогноза загруженности по часовым агрегатам.
+
+    Часовые агрегаты уже содержат и замеры загруженности, и выезды, и
+    хранятся дольше сырой истории. Модель для всех парковок пересчитывается
+    каждые FORECAST_INTERVAL секунд, готовые ответы сериализуются один раз
+    на обучение, поэтому запрос прогноза не обращается к базе.
+    """
+
+    def __init__(self, interval: float = FORECAST_INTERVAL, horizon: int = FORECAST_HORIZON_HOURS,
+                 weeks: int = FORECAST_HISTORY_WEEKS):
+        self.interval = interval
+        self.horizon = horizon
+        self.weeks = weeks
+        self.db = None
+        self.generated_at: Optional[datetime] = None
+        self.forecasts: Dict[str, list] = {}
+        self._encoded: Dict[Tuple[str, int], bytes] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def train(self, now: datetime = None):
+        now = now or datetime.now()
+        current = rollups.bucket_start(now, "1h")
+        # История начинается с понедельника, чтобы час недели определялся номером часа;
+        # текущий час еще не завершен (выезды учтены не все) и только прогнозируется
+        monday = rollups.bucket_start(current, "1d") - timedelta(days=current.weekday())
+        start = monday - timedelta(weeks=self.weeks)
+        hours = int((current - start) / timedelta(hours=1))
+
+        cursor = self.db.stats_rollups.find(
+            {"interval": "1h", "bucket": {"$gte": start, "$lt": current}},
+            {"_id": 0, "lot_id": 1, "bucket": 1, "load_sum": 1, "load_count": 1, "occupied_sum": 1, "departures": 1}
+        ).batch_size(MONGO_CURSOR_BATCH_SIZE)
+        lot_index: Dict[str, int] = {}
+        rows = []
+        async for doc in cursor:
+            samples = doc.get("load_count") or 0
+            rows.append((
+                lot_index.setdefault(doc["lot_id"], len(lot_index)),
+                int((doc["bucket"] - start) / timedelta(hours=1)),
+                doc.get("load_sum", 0) / samples if samples else np.nan,
+                doc.get("occupied_sum", 0) / samples if samples else np.nan,
+                doc.get("departures", 0),
+            ))
+
+        # Ряды всех парковок независимы и обучаются одной матрицей (парковки * ряды, часы)
+        history = build_history(rows, len(lot_index), hours)
+        predicted = fit(history.reshape(-1, hours), self.horizon).reshape(len(lot_index), len(SERIES), self.horizon)
+        predicted[:, 0] = np.minimum(predicted[:, 0], 100)
+
+        labels = [(current + timedelta(hours=h)).strftime(LABEL_FORMATS["1h"]) for h in range(self.horizon)]
+        forecasts = {}
+        for lot_id, i in lot_index.items():
+            columns = [np.round(values, places).tolist() for values, places in zip(predicted[i], SERIES.values())]
+            forecasts[lot_id] = [
+                {"timestamp": label, **dict(zip(SERIES, values))}
+                for label, *values in zip(labels, *columns)
+            ]
+        self.forecasts = forecasts
+        self.generated_at = now
+        self._encoded = {}
+
+    def body(self, lot_id: str, hours: int) -> Optional[bytes]:
+        """Готовый ответ с прогнозом парковки; None, пока модель не обучена"""
+        if self.generated_at is None:
+            return None
+        key = (lot_id, hours)
+        if key not in self._encoded:
+            self._encoded[key] = orjson.dumps({
+                "status": "success",
+                "interval": "1h",
+                "generated_at": self.generated_at.strftime(LABEL_FORMATS["10s"]),
+                "data": self.forecasts.get(lot_id, [])[:hours]
+            })
+        return self._encoded[key]
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.train()
+            except Exception as e:
+                logger.error(f"Не удалось обучить прогноз загруженности: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, db):
+        self.db = db
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+forecast_job = ForecastJob()
@@ -0,0 +1,119 @@
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
+from typing import List, Optional
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Путь к JSON-файлу с описанием парковок; если не задан, используется коллекция lots
+PARKING_LAYOUT = os.getenv("PARKING_LAYOUT")
+
+DEFAULT_LOT_ID = "main"
+# Идентификатор агрегатов по всем парковкам сразу
+ALL_LOTS = "*"
+
+# Тип места -> предназначено ли оно для электромобилей
+SPOT_TYPES = {
+    "regular": False,
+    "ev": True,
+}
+
+def lot_match(lot_id: Optional[str]) -> dict:
+    """Условие отбора записей парковки; записи без lot_id относятся к основной"""
+    if lot_id is None:
+        return {}
+    if lot_id == DEFAULT_LOT_ID:
+        return {"lot_id": {"$in": [lot_id, None]}}
+    return {"lot_id": lot_id}
+
+def spot_type_for(is_ev: bool) -> str:
+    """Тип места для транспортного средства"""
+    return next(spot_type for spot_type, for_ev in SPOT_TYPES.items() if for_ev == is_ev)
+
+# Исходная конфигурация: 16 мест, из них 14 и 15 — для электромобилей.
+# Необязательный priority зоны задает порядок автоматического выбора мест
+# (меньше — ближе к въезду), по умолчанию это порядок зон в описании
+DEFAULT_LAYOUT = [{
+    "lot_id": DEFAULT_LOT_ID,
+    "name": "Основная парковка",
+    "zones": [{
+        "zone_id": "A",
+        "first_spot_id": 0,
+        "spots": {"regular": 14, "ev": 2}
+    }]
+}]
+
+def validate(lots: List[dict]):
+    """Проверка описания парковок: типы мест известны, номера мест не пересекаются"""
+    lot_ids = set()
+    for lot in lots:
+        if lot["lot_id"] in lot_ids or lot["lot_id"] == ALL_LOTS:
+            raise ValueError(f"Некорректный или повторяющийся lot_id: {lot['lot_id']}")
+        lot_ids.add(lot["lot_id"])
+        for zone in lot["zones"]:
+            for spot_type in zone["spots"]:
+                if spot_type not in SPOT_TYPES:
+                    raise ValueError(f"Неизвестный тип места: {spot_type}")
+    spot_ids = [spot["spot_id"] for spot in expand_spots(lots)]
+    if len(spot_ids) != len(set(spot_ids)):
+        raise ValueError("Номера мест в разных зонах пересекаются")
+
+def expand_spots(lots: List[dict]) -> List[dict]:
+    """Документы мест для коллекции spots.
+
+    Номера мест сквозные для всех парковок: зона начинается с first_spot_id,
+    а без него — сразу после последнего места предыдущей зоны.
+    """
+    spots = []
+    next_spot_id = 0
+    for lot in lots:
+        for zone in lot["zones"]:
+            spot_id = zone.get("first_spot_id", next_spot_id)
+            for spot_type, count in zone["spots"].items():
+                for _ in range(count):
+                    spots.append({
+                        "spot_id": spot_id,
+                        "lot_id": lot["lot_id"],
+                        "zone_id": zone["zone_id"],
+                        "spot_type": spot_type,
+                        "status": "free",
+                        "current_vehicle": None
+                    })
+                    spot_id += 1
+            next_spot_id = max(next_spot_id, spot_id)
+    return spots
+
+def layout_file() -> Optional[List[dict]]:
+    """Описание парковок из файла PARKING_LAYOUT, если он задан"""
+    if not PARKING_LAYOUT:
+        return None
+    with open(PARKING_LAYOUT, encoding="utf-8") as f:
+        lots = json.load(f)
+    validate(lots)
+    return lots
+
+async def load_layout(db) -> List[dict]:
+    """Описание парковок: из файла PARKING_LAYOUT, коллекции lots или по умолчанию"""
+    lots = layout_file()
+    if lots is not None:
+        # Сохраняем конфигурацию из файла, чтобы ее видели все экземпляры сервиса
+        await db.lots.bulk_write([
+            ReplaceOne({"lot_id": lot["lot_id"]}, lot, upsert=True) for lot in lots
+        ])
+        return lots
+
+    # Порядок парковок важен для сквозной нумерации мест
+    lots = await db.lots.find({}, {"_id": 0}).sort("_id", ASCENDING).to_list()
+    if lots:
+        validate(lots)
+        return lots
+
+    try:
+        await db.lots.insert_many([dict(lot) for lot in DEFAULT_LAYOUT], ordered=False)
+    except BulkWriteError as e:
+        # Описание по умолчанию уже записал другой экземпляр, стартовавший одновременно
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+    return DEFAULT_LAYOUT
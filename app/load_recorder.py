@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import rollups
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Длительность тика, в который объединяются замеры (секунды, должна делить час;
+# для точной статистики с интервалом 10s — не больше 10)
+LOAD_TICK_SECONDS = int(os.getenv("LOAD_TICK_SECONDS", "10"))
+# Период записи накопленных тиков в базу (секунды)
+LOAD_FLUSH_INTERVAL = float(os.getenv("LOAD_FLUSH_INTERVAL", "10"))
+
+class LoadRecorder:
+    """Фоновая запись истории загруженности.
+
+    Заезды и выезды только добавляют замер в тик в памяти (без обращения к
+    базе). Фоновая задача периодически записывает завершенные тики одной
+    пакетной вставкой в историю загруженности вместе с обновлением агрегатов:
+    один документ на тик со средним, минимумом и максимумом занятости.
+    При ошибке неудавшаяся запись (документы или агрегаты) остается в очереди
+    и повторяется при следующем сбросе; повтор не создает дублей замеров и
+    не применяет уже учтенные обновления агрегатов.
+    """
+
+    def __init__(self, tick_seconds: int = LOAD_TICK_SECONDS, flush_interval: float = LOAD_FLUSH_INTERVAL):
+        self.tick_seconds = tick_seconds
+        self.flush_interval = flush_interval
+        self.ticks: Dict[Tuple[str, datetime], dict] = {}
+        # Записи, которые еще не удалось сохранить; история и агрегаты повторяются
+        # независимо, чтобы успешная половина не записалась повторно
+        self.pending_documents: List[dict] = []
+        self.pending_rollups: List[UpdateOne] = []
+        self.storage = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def record(self, timestamp: datetime, lot_id: str, occupied_spots: int, total_spots: int):
+        """Учет замера загруженности парковки на момент события"""
+        load_percentage = (occupied_spots / total_spots) * 100 if total_spots else 0
+        self._merge((lot_id, rollups.floor_time(timestamp, self.tick_seconds)), {
+            "samples": 1,
+            "occupied_sum": occupied_spots,
+            "occupied_min": occupied_spots,
+            "occupied_max": occupied_spots,
+            "load_sum": load_percentage,
+            "total_spots": total_spots
+        })
+
+    def _merge(self, key: Tuple[str, datetime], sample: dict):
+        stat = self.ticks.get(key)
+        if stat is None:
+            self.ticks[key] = sample
+            return
+        stat["samples"] += sample["samples"]
+        stat["occupied_sum"] += sample["occupied_sum"]
+        stat["occupied_min"] = min(stat["occupied_min"], sample["occupied_min"])
+        stat["occupied_max"] = max(stat["occupied_max"], sample["occupied_max"])
+        stat["load_sum"] += sample["load_sum"]
+        stat["total_spots"] = sample["total_spots"]
+
+    def take(self, boundary: datetime) -> Dict[Tuple[str, datetime], dict]:
+        """Извлечение тиков, начавшихся раньше boundary"""
+        ready = {key: stat for key, stat in self.ticks.items() if key[1] < boundary}
+        for key in ready:
+            del self.ticks[key]
+        return ready
+
+    @staticmethod
+    def documents(ready: Dict[Tuple[str, datetime], dict]) -> List[dict]:
+        """Документы parking_load_history по тикам"""
+        documents = []
+        for (lot_id, tick), stat in sorted(ready.items(), key=lambda item: item[0][1]):
+            samples = stat["samples"]
+            documents.append({
+                "timestamp": tick,
+                "lot_id": lot_id,
+                "occupied_spots": round(stat["occupied_sum"] / samples, 2),
+                "occupied_min": stat["occupied_min"],
+                "occupied_max": stat["occupied_max"],
+                "total_spots": stat["total_spots"],
+                "load_percentage": round(stat["load_sum"] / samples, 2),
+                "samples": samples
+            })
+        return documents
+
+    async def flush(self, everything: bool = False):
+        """Запись завершенных тиков (или всех накопленных при остановке)"""
+        ready = self.take(datetime.max if everything else datetime.now() - timedelta(seconds=self.tick_seconds))
+        self.pending_documents += self.documents(ready)
+        for (lot_id, tick), stat in ready.items():
+            self.pending_rollups += rollups.load_ops(
+                tick, lot_id, stat["samples"], stat["occupied_sum"], stat["load_sum"]
+            )
+        # Агрегаты статистики есть только в MongoDB
+        if self.storage.db is None:
+            self.pending_rollups = []
+        await asyncio.gather(self._write_documents(), self._write_rollups())
+
+    async def _write_documents(self):
+        documents, self.pending_documents = self.pending_documents, []
+        if not documents:
+            return
+        try:
+            await self.storage.insert_load(documents)
+        except Exception as e:
+            # Оставляем документы в очереди, чтобы повторить запись при следующем сбросе
+            logger.error(f"Не удалось записать историю загруженности: {e}")
+            self.pending_documents = documents + self.pending_documents
+
+    async def _write_rollups(self):
+        ops, self.pending_rollups = self.pending_rollups, []
+        if not ops:
+            return
+        try:
+            await rollups.apply(self.storage.db, ops)
+        except BulkWriteError as e:
+            # Операции без ошибки уже применены: повторяем только неудавшиеся
+            logger.error(f"Не удалось обновить агрегаты загруженности: {e}")
+            self.pending_rollups = [ops[error["index"]] for error in e.details["writeErrors"]] + self.pending_rollups
+        except ServerSelectionTimeoutError as e:
+            # Сервер не выбран, запрос не отправлялся
+            logger.error(f"Не удалось обновить агрегаты загруженности: {e}")
+            self.pending_rollups = ops + self.pending_rollups
+        except Exception as e:
+            # Неизвестно, какие $inc применились, и повтор мог бы учесть замеры дважды;
+            # сутки пересоберет из истории загруженности архивация (retention.ArchiveJob)
+            logger.error(f"Не удалось обновить агрегаты загруженности, они будут пересобраны из истории: {e}")
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # При остановке записываются все тики, включая незавершенный
+            await self.flush(everything=self._stopping.is_set())
+
+    def start(self, storage):
+        self.storage = storage
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи с записью всех накопленных замеров"""
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+load_recorder = LoadRecorder()
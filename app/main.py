@@ -1,14 +1,107 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Response, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from database import smart_parking_db
-from models import VehicleArrival
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import orjson
+import os
+from database import create_indexes
+from storage import parking_storage, VehicleNotFound, VehicleAlreadyPaid, VehicleAlreadyParked, StateConflict
+from models import VehicleArrival, VehicleAutoArrival, EventBatch, TariffConfig, RepriceRequest, ReservationRequest, local_time
+from occupancy import parking_state
+from broadcaster import broadcaster
+from load_recorder import load_recorder
+from events import event_log
+from cache import response_cache
+from revenue import revenue_counter
+from retention import archive_job
+from tariffs import tariff_book
+from forecast import forecast_job, FORECAST_HORIZON_HOURS
+from sync import state_sync
+from reservations import reservation_book
+from startup import warmup, Warmup, ReadinessMiddleware
+import metrics
+import rollups
+import stats
+import export
+import sessions
+import tariffs
+import events
 from datetime import datetime, timedelta
-from typing import List
+from typing import Optional
+from layout import SPOT_TYPES, ALL_LOTS, DEFAULT_LOT_ID, lot_match
+import layout
+
+logger = logging.getLogger(__name__)
+
+class OrjsonResponse(Response):
+    """Ответ JSON, сериализованный orjson, как готовые тела состояния парковки"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+async def warm_up(warmup: Warmup):
+    """Подключение к хранилищу, затем параллельно индексы, состояние парковки и агрегаты"""
+    await warmup.phase("connect", parking_storage.connect())
+    db = parking_storage.db
+
+    async def load_state():
+        await initialize_parking()
+        await parking_state.load(parking_storage)
+        tariff_book.load(parking_state.lots.values())
+        if db is not None:
+            await reservation_book.load(db)
+
+    async def load_rollups():
+        await rollups.create_indexes(db)
+        await rollups.ensure_built(db)
+        # Выручка MongoDB считается по агрегатам, поэтому после их построения
+        await revenue_counter.load(parking_storage)
+
+    # Статистика, журнал событий, брони и синхронизация экземпляров работают только с MongoDB
+    steps = [warmup.phase("state", load_state())]
+    if db is not None:
+        steps += [warmup.phase("indexes", create_indexes(db)), warmup.phase("rollups", load_rollups())]
+    else:
+        steps.append(warmup.phase("revenue", revenue_counter.load(parking_storage)))
+    await warmup.parallel(*steps)
+
+    if db is not None:
+        event_log.start(db)
+        archive_job.start(db)
+        forecast_job.start(db)
+        state_sync.start(db)
+    load_recorder.start(parking_storage)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Прогрев в фоне при старте (процесс сразу принимает /healthz), закрытие при остановке"""
+    metrics.loop_lag_monitor.start()
+    warmup.start(warm_up)
+    yield
+    await warmup.stop()
+    await metrics.loop_lag_monitor.stop()
+    await state_sync.stop()
+    await forecast_job.stop()
+    await archive_job.stop()
+    await event_log.stop()
+    await load_recorder.stop()
+    await parking_storage.close()
 
 app = FastAPI(
     title="Smart Parking Management System API",
     description="FastAPI-приложение для автоматизации работы парковки",
-    version="1.0.0")
+    version="1.0.0",
+    # Ответы сериализуются orjson
+    default_response_class=OrjsonResponse,
+    lifespan=lifespan)
+
+# До окончания прогрева запросы к API отвечают 503
+app.add_middleware(ReadinessMiddleware)
 
 # Настройка CORS
 app.add_middleware(
@@ -19,234 +112,609 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Конфигурация
-PARKING_CAPACITY = 16  # Общее количество мест
-TARIFFS = {  # Тарифы в рублях/минуту
-    "car": 1.5,
-    "evCar": 2.5
-}
-
-# Инициализация парковочных мест при первом запуске
-def initialize_parking(parkingCapacity = PARKING_CAPACITY):
-    if smart_parking_db.spots.count_documents({}) == 0:
-        spots = []
-        for i in range(parkingCapacity):
-            spot_type = "regular"
-            if 13 < i <= 15: spot_type = "ev"
-            
-            spots.append({
-                "spot_id": i,
-                "spot_type": spot_type,
-                "status": "free",
-                "current_vehicle": None
-            })
-        smart_parking_db.spots.insert_many(spots)
-
-initialize_parking()
-
-def record_parking_load():
-    """Запись текущей загруженности парковки"""
-    total_spots = PARKING_CAPACITY
-    occupied_spots = smart_parking_db.spots.count_documents({"status": "occupied"})
-    load_percentage = (occupied_spots / total_spots) * 100
-
-    load_history = {
-        "timestamp": datetime.now(),
-        "occupied_spots": occupied_spots,
-        "total_spots": total_spots,
-        "load_percentage": round(load_percentage, 2)
-    }
-    
-    smart_parking_db.parking_load_history.insert_one(load_history)
+# Задержки запросов по маршрутам для /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
-@app.post("/api/vehicle/arrive")
-async def vehicle_arrive(vehicle: VehicleArrival):
-    """Регистрация заезда на определенное место"""
-    # Проверяем соответствие типа места и типа транспортного средства
-    spot = smart_parking_db.spots.find_one({"spot_id": vehicle.spot_id})
-    
-    if not spot:
+# Изменения состояния парковки рассылаются подписчикам WebSocket/SSE,
+# а освободившиеся места возвращаются в поиск мест под ближайшие брони
+parking_state.listeners.append(broadcaster.publish)
+parking_state.listeners.append(reservation_book.spot_changed)
+metrics.register_state(parking_state)
+
+# Инициализация парковочных мест по описанию парковок
+async def initialize_parking():
+    lots = await parking_storage.load_layout()
+    await parking_storage.init_spots(layout.expand_spots(lots))
+
+def mongo():
+    """База MongoDB для статистики, броней и выгрузок; у встроенных хранилищ ее нет"""
+    if parking_storage.db is None:
+        raise HTTPException(
+            status_code=501,
+            detail=f"Недоступно с хранилищем {parking_storage.name}, нужен STORAGE_BACKEND=mongo"
+        )
+    return parking_storage.db
+
+async def fulfil_reservations(reservations: list):
+    """Отметка броней после записанного заезда: ошибка базы не отменяет заезд и не дает повторить его"""
+    try:
+        await reservation_book.fulfil(mongo(), reservations)
+    except Exception as e:
+        logger.error(f"Не удалось отметить выполненные брони: {e}")
+
+def parking_load_samples(lot_id: str, timestamp: datetime = None) -> list:
+    """Замеры загруженности парковки и всех парковок на момент события"""
+    timestamp = timestamp or datetime.now()
+    return [(timestamp, lot, *parking_state.load_counts(lot)) for lot in (lot_id, ALL_LOTS)]
+
+def record_parking_load(lot_id: str, timestamp: datetime = None):
+    """Учет загруженности парковки и всех парковок на момент события"""
+    # Занятость берется из состояния в памяти, а запись в базу идет в фоне
+    for sample in parking_load_samples(lot_id, timestamp):
+        load_recorder.record(*sample)
+
+def check_spot_type(vehicle: VehicleArrival):
+    """Проверка существования места и соответствия его типа типу транспортного средства"""
+    spot_type = parking_state.spot_type(vehicle.spot_id)
+    if spot_type is None:
         raise HTTPException(
             status_code=400,
             detail=f"Парковочное место {vehicle.spot_id} не существует"
         )
     
     # Проверяем, что электромобиль паркуется только на специальных местах
-    if vehicle.isEv and vehicle.spot_id not in [14, 15]:
+    if vehicle.isEv and not SPOT_TYPES[spot_type]:
         raise HTTPException(
             status_code=400,
-            detail="Электромобиль может парковаться только на местах 14 и 15"
+            detail="Электромобиль может парковаться только на местах для электромобилей"
         )
     
     # Проверяем, что обычный автомобиль не паркуется на местах для электромобилей
-    if not vehicle.isEv and vehicle.spot_id in [14, 15]:
+    if not vehicle.isEv and SPOT_TYPES[spot_type]:
         raise HTTPException(
             status_code=400,
-            detail="Обычный автомобиль не может парковаться на местах для электромобилей (14 и 15)"
+            detail=f"Обычный автомобиль не может парковаться на местах для электромобилей ({vehicle.spot_id})"
         )
-    
-    # Проверяем, не занято ли место
-    if spot["status"] == "occupied":
-        raise HTTPException(
-            status_code=400,
-            detail=f"Парковочное место {vehicle.spot_id} уже занято"
-        )
-    
-    # Проверяем, нет ли уже такого транспортного средства в базе
-    existing_vehicle = smart_parking_db.vehicles.find_one({
-        "id": vehicle.vehicle_id,
-        "exit_time": None  # Ищем только активные записи
-    })
-    
-    if existing_vehicle:
+
+def check_lot(lot_id: Optional[str]):
+    if lot_id is not None and not parking_state.has_lot(lot_id):
+        raise HTTPException(status_code=404, detail=f"Парковка {lot_id} не найдена")
+
+def check_zone(lot_id: Optional[str], zone_id: Optional[str]):
+    if zone_id is not None and (lot_id is None or not parking_state.has_zone(lot_id, zone_id)):
+        raise HTTPException(status_code=404, detail=f"Зона {zone_id} не найдена")
+
+def check_reservations(spot_id: int, vehicle_id: str, at: datetime) -> list:
+    """Брони места на момент заезда; место, которое держит бронь другого ТС, занимать нельзя"""
+    held = reservation_book.holding(spot_id, at)
+    for reservation in held:
+        if reservation["vehicle_id"] != vehicle_id:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Парковочное место {spot_id} забронировано с {reservation['start']:%Y-%m-%d %H:%M}"
+            )
+    return held
+
+def calculate_cost(vehicle: dict, exit_time: datetime):
+    """Расчет времени стоянки (в минутах) и стоимости по тарифу парковки"""
+    tariff = tariff_book.get(vehicle.get("lot_id"))
+    duration = (exit_time - vehicle["entry_time"]).total_seconds() / 60  # в минутах
+    return duration, tariff.cost(vehicle["isEv"], vehicle["entry_time"], exit_time)
+
+async def register_arrival(vehicle_data: dict) -> bool:
+    """Запись заезда в хранилище; False, если место уже занято или не существует"""
+    try:
+        if not await parking_storage.occupy(vehicle_data):
+            return False
+    except VehicleAlreadyParked:
         raise HTTPException(
             status_code=400,
-            detail=f"Транспортное средство {vehicle.vehicle_id} уже находится на парковке"
+            detail=f"Транспортное средство {vehicle_data['id']} уже находится на парковке"
         )
+    parking_state.occupy(vehicle_data["spot_id"], vehicle_data)
+    event_log.record(events.arrival(vehicle_data))
+    response_cache.clear()
+    metrics.ARRIVALS.labels(vehicle_data["lot_id"]).inc()
     
-    # Создаем запись о ТС
-    vehicle_data = {
+    # Записываем загруженность
+    record_parking_load(vehicle_data["lot_id"])
+    return True
+
+def new_vehicle(vehicle, spot_id: int) -> dict:
+    return {
         "id": vehicle.vehicle_id,
         "isEv": vehicle.isEv,
         "type": vehicle.type,
         "entry_time": datetime.now(),
         "exit_time": None,
-        "spot_id": vehicle.spot_id,
+        "spot_id": spot_id,
+        "lot_id": parking_state.spot_lot(spot_id),
         "paid": False
     }
-    
-    # Обновляем место
-    update_result = smart_parking_db.spots.update_one(
-        {"spot_id": vehicle_data["spot_id"]},
-        {"$set": {"current_vehicle": vehicle_data["id"], "status": "occupied"}}
-    )
-    
-    # Проверяем, что обновление прошло успешно
-    if update_result.modified_count == 0:
+
+@app.post("/api/vehicle/arrive")
+async def vehicle_arrive(vehicle: VehicleArrival):
+    """Регистрация заезда на определенное место"""
+    check_spot_type(vehicle)
+    held = check_reservations(vehicle.spot_id, vehicle.vehicle_id, datetime.now())
+    
+    if not await register_arrival(new_vehicle(vehicle, vehicle.spot_id)):
+        # Разбираемся в причине только на пути ошибки
+        if not await parking_storage.spot_exists(vehicle.spot_id):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Парковочное место {vehicle.spot_id} не существует"
+            )
         raise HTTPException(
             status_code=400,
-            detail=f"Не удалось занять парковочное место {vehicle.spot_id}"
+            detail=f"Парковочное место {vehicle.spot_id} уже занято"
         )
-    
-    # Создаем запись о транспортном средстве
-    smart_parking_db.vehicles.insert_one(vehicle_data)
-    
-    # Записываем загруженность
-    record_parking_load()
+    if held:
+        await fulfil_reservations(held)
         
     return {"status": "success"}
 
-@app.post("/api/vehicle/depart/{vehicle_id}")
-async def vehicle_depart(vehicle_id: str):
-    """Обработка выезда и расчет оплаты"""
-    vehicle = smart_parking_db.vehicles.find_one({"id": vehicle_id})
-    
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
+# Сколько мест пробовать, если выбранное место заняли параллельным запросом
+AUTO_ASSIGN_ATTEMPTS = 3
+
+@app.post("/api/vehicle/arrive/auto")
+async def vehicle_arrive_auto(vehicle: VehicleAutoArrival):
+    """Регистрация заезда с автоматическим выбором ближайшего к въезду свободного места"""
+    check_lot(vehicle.lot_id)
+    check_zone(vehicle.lot_id, vehicle.zone_id)
+    if vehicle.vehicle_id in parking_state.vehicles:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Транспортное средство {vehicle.vehicle_id} уже находится на парковке"
+        )
     
-    if vehicle.get("paid", False):
-        raise HTTPException(status_code=400, detail="Already paid")
+    def assigned(spot_id: int) -> dict:
+        return {
+            "status": "success",
+            "spot_id": spot_id,
+            "lot_id": parking_state.spot_lot(spot_id),
+            "zone_id": parking_state.spot_zone(spot_id)
+        }
     
-    # Расчет времени и стоимости
-    if vehicle["isEv"]:
-        tariff = TARIFFS["evCar"]
-    else:
-        tariff = TARIFFS["car"]
+    now = datetime.now()
+    # ТС с бронью заезжает на забронированное место
+    reservation = reservation_book.current(vehicle.vehicle_id, now)
+    if reservation is not None:
+        if not await register_arrival(new_vehicle(vehicle, reservation["spot_id"])):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Забронированное место {reservation['spot_id']} занято"
+            )
+        await fulfil_reservations([reservation])
+        return assigned(reservation["spot_id"])
+    
+    spot_type = layout.spot_type_for(vehicle.isEv)
+    # Выбранные места резервируются в памяти, чтобы параллельные заезды не выбрали то же место
+    claimed = []
+    attempts = 0
+    try:
+        while attempts < AUTO_ASSIGN_ATTEMPTS:
+            spot_id = parking_state.claim_spot(spot_type, vehicle.lot_id, vehicle.zone_id)
+            if spot_id is None:
+                raise HTTPException(status_code=409, detail="Нет свободных мест нужного типа")
+            claimed.append(spot_id)
+            # Места, которые держит чужая бронь, пропускаются и остаются выбранными до конца запроса
+            if reservation_book.holding(spot_id, now):
+                continue
+            
+            if await register_arrival(new_vehicle(vehicle, spot_id)):
+                return assigned(spot_id)
+            attempts += 1
+    finally:
+        for spot_id in claimed:
+            parking_state.unclaim(spot_id)
+    
+    raise HTTPException(status_code=409, detail="Не удалось занять свободное место, повторите запрос")
 
+@app.post("/api/vehicle/depart/{vehicle_id}")
+async def vehicle_depart(vehicle_id: str):
+    """Обработка выезда и расчет оплаты"""
     exit_time = datetime.now()
-    entry_time = vehicle["entry_time"]
-    duration = (exit_time - entry_time).total_seconds() / 60  # в минутах
-    cost = duration * tariff
     
-    # Создаем запись в истории
-    history_entry = {
-        "vehicle_id": vehicle_id,
-        "vehicle_type": vehicle["type"],
-        "spot_id": vehicle["spot_id"],
-        "entry_time": entry_time,
-        "exit_time": exit_time,
-        "duration_minutes": round(duration, 1),
-        "cost": round(cost, 2)
-    }
-    smart_parking_db.parking_history.insert_one(history_entry)
-    
-    # Обновляем запись ТС
-    smart_parking_db.vehicles.update_one(
-        {"id": vehicle_id},
-        {"$set": {
+    def close(vehicle: dict) -> dict:
+        # Расчет времени и стоимости, запись в истории
+        duration, cost = calculate_cost(vehicle, exit_time)
+        return {
+            "vehicle_id": vehicle_id,
+            "vehicle_type": vehicle["type"],
+            "spot_id": vehicle["spot_id"],
+            "lot_id": vehicle.get("lot_id", DEFAULT_LOT_ID),
+            "entry_time": vehicle["entry_time"],
             "exit_time": exit_time,
-            "cost": round(cost, 2),
-            "paid": True
-        }}
-    )
+            "duration_minutes": round(duration, 1),
+            "cost": round(cost, 2)
+        }
     
-    # Освобождаем место
-    smart_parking_db.spots.update_one(
-        {"spot_id": vehicle["spot_id"]},
-        {"$set": {"status": "free", "current_vehicle": None}}
-    )
+    # Закрывается только активная запись: повторный выезд не пройдет
+    try:
+        vehicle, history_entry = await parking_storage.depart(vehicle_id, exit_time, close)
+    except VehicleNotFound:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    except VehicleAlreadyPaid:
+        raise HTTPException(status_code=400, detail="Already paid")
+    cost, duration = history_entry["cost"], history_entry["duration_minutes"]
+    lot_id = vehicle.get("lot_id", DEFAULT_LOT_ID)
+    parking_state.release(vehicle["spot_id"], vehicle_id)
+    event_log.record(events.departure(vehicle["isEv"], history_entry))
+    revenue_counter.add(lot_id, cost)
+    response_cache.clear()
+    metrics.DEPARTURES.labels(lot_id).inc()
+    if parking_storage.db is not None:
+        try:
+            await rollups.record_departure(parking_storage.db, exit_time, lot_id, cost, duration)
+        except Exception as e:
+            # Выезд уже записан и оплачен; пропущенное обновление агрегатов пересоберет архивация
+            logger.error(f"Не удалось обновить агрегаты выезда {vehicle_id}: {e}")
     
     # Записываем загруженность
-    record_parking_load()
+    record_parking_load(lot_id)
+        
+    return {
+        "status": "success",
+        "cost": cost,
+        "duration_minutes": duration
+    }
+
+@app.post("/api/events/batch")
+async def ingest_events(batch: EventBatch):
+    """Пакетная регистрация заездов и выездов с учетом реального времени событий"""
+    results = []
+    changes, history_entries, rollup_ops = [], [], []
+    # События журнала записываются и брони отмечаются, только если пакет применен
+    logged, fulfilled = [], []
+    arrival_lots = []
+    # Замеры загруженности берутся после каждого события, а учитываются после записи пакета
+    load_samples = []
+    
+    # События проверяются по состоянию в памяти по порядку и сразу применяются к нему,
+    # поэтому каждое следующее событие пакета видит результат предыдущих
+    for index, event in enumerate(batch.events):
+        result = {"index": index, "event": event.event, "vehicle_id": event.vehicle_id}
+        try:
+            if event.event == "arrive":
+                check_spot_type(event)
+                if parking_state.occupied[parking_state.spot_index[event.spot_id]]:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Парковочное место {event.spot_id} уже занято"
+                    )
+                if event.vehicle_id in parking_state.vehicles:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Транспортное средство {event.vehicle_id} уже находится на парковке"
+                    )
+                fulfilled += check_reservations(event.spot_id, event.vehicle_id, event.timestamp)
+                
+                vehicle_data = {
+                    "id": event.vehicle_id,
+                    "isEv": event.isEv,
+                    "type": event.type,
+                    "entry_time": event.timestamp,
+                    "exit_time": None,
+                    "spot_id": event.spot_id,
+                    "lot_id": parking_state.spot_lot(event.spot_id),
+                    "paid": False
+                }
+                lot_id = vehicle_data["lot_id"]
+                arrival_lots.append(lot_id)
+                parking_state.occupy(event.spot_id, vehicle_data)
+                changes.append(("arrive", vehicle_data))
+                logged.append(events.arrival(vehicle_data))
+            else:
+                vehicle = parking_state.vehicles.get(event.vehicle_id)
+                if not vehicle:
+                    raise HTTPException(status_code=404, detail="Vehicle not found")
+                if event.timestamp < vehicle["entry_time"]:
+                    raise HTTPException(status_code=400, detail="Время выезда раньше времени заезда")
+                
+                duration, cost = calculate_cost(vehicle, event.timestamp)
+                lot_id = vehicle.get("lot_id", DEFAULT_LOT_ID)
+                parking_state.release(vehicle["spot_id"], event.vehicle_id)
+                history_entries.append({
+                    "vehicle_id": event.vehicle_id,
+                    "vehicle_type": vehicle["type"],
+                    "spot_id": vehicle["spot_id"],
+                    "lot_id": lot_id,
+                    "entry_time": vehicle["entry_time"],
+                    "exit_time": event.timestamp,
+                    "duration_minutes": round(duration, 1),
+                    "cost": round(cost, 2)
+                })
+                changes.append(("depart", vehicle, history_entries[-1]))
+                logged.append(events.departure(vehicle["isEv"], history_entries[-1]))
+                rollup_ops += rollups.departure_ops(event.timestamp, lot_id, round(cost, 2), round(duration, 1))
+                result.update({"cost": round(cost, 2), "duration_minutes": round(duration, 1)})
+        except HTTPException as e:
+            result.update({"status": "error", "status_code": e.status_code, "detail": e.detail})
+            results.append(result)
+            continue
         
+        load_samples += parking_load_samples(lot_id, event.timestamp)
+        result["status"] = "success"
+        results.append(result)
+    
+    try:
+        await parking_storage.apply_batch(changes)
+    except Exception as e:
+        # Пакет не записан: состояние в памяти уже изменено, перечитываем его из хранилища
+        await parking_state.load(parking_storage)
+        response_cache.clear()
+        if isinstance(e, StateConflict):
+            raise HTTPException(status_code=409, detail=str(e))
+        raise
+    for sample in load_samples:
+        load_recorder.record(*sample)
+    event_log.record(*logged)
+    if fulfilled:
+        await fulfil_reservations(fulfilled)
+    for entry in history_entries:
+        revenue_counter.add(entry["lot_id"], entry["cost"])
+        metrics.DEPARTURES.labels(entry["lot_id"]).inc()
+    for lot_id in arrival_lots:
+        metrics.ARRIVALS.labels(lot_id).inc()
+    response_cache.clear()
+    if parking_storage.db is not None:
+        try:
+            await rollups.apply(parking_storage.db, rollup_ops)
+        except Exception as e:
+            logger.error(f"Не удалось обновить агрегаты выездов пакета: {e}")
+    
+    return {"status": "success", "data": results}
+
+@app.get("/api/lots")
+async def get_lots():
+    """Список парковок с зонами и текущей занятостью"""
+    data = []
+    for lot_id, lot in parking_state.lots.items():
+        occupied, total = parking_state.load_counts(lot_id)
+        data.append({
+            "lot_id": lot_id,
+            "name": lot.get("name", lot_id),
+            "zones": lot["zones"],
+            "tariff": tariff_book.get(lot_id).spec,
+            "total_spots": total,
+            "occupied_spots": occupied
+        })
+    return {"status": "success", "data": data}
+
+@app.put("/api/lots/{lot_id}/tariff")
+async def set_tariff(lot_id: str, tariff: TariffConfig):
+    """Изменение тарифа парковки; действует для следующих выездов"""
+    check_lot(lot_id)
+    spec = tariff.model_dump()
+    try:
+        tariffs.Tariff(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await parking_storage.update_lot(lot_id, {"tariff": spec})
+    parking_state.lots[lot_id]["tariff"] = spec
+    tariff_book.set(lot_id, spec)
+    return {"status": "success", "data": spec}
+
+@app.post("/api/admin/reprice")
+async def reprice_history(request: RepriceRequest):
+    """Пересчет стоимости завершенных стоянок по текущим тарифам"""
+    check_lot(request.lot_id)
+    result = await tariffs.reprice(
+        mongo(), tariff_book,
+        tariffs.history_query(request.lot_id, request.start, request.end),
+        dry_run=request.dry_run
+    )
+    if not request.dry_run and result["changed"]:
+        # Выручка изменилась в истории и агрегатах
+        await revenue_counter.load(parking_storage)
+        response_cache.clear()
+    return {"status": "success", "data": result}
+
+def check_period(start: datetime, end: datetime):
+    if end <= start:
+        raise HTTPException(status_code=400, detail="Конец брони должен быть позже начала")
+    if end <= datetime.now():
+        raise HTTPException(status_code=400, detail="Период брони уже прошел")
+
+@app.post("/api/reservations")
+async def create_reservation(request: ReservationRequest):
+    """Бронь места на период: заданного или лучшего свободного весь период на парковке и в зоне"""
+    db = mongo()
+    check_period(request.start, request.end)
+    if request.spot_id is not None:
+        check_spot_type(request)
+        reservation = await reservation_book.create(
+            db, request.spot_id, request.vehicle_id, request.isEv, request.start, request.end
+        )
+        if reservation is None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Парковочное место {request.spot_id} занято или забронировано на этот период"
+            )
+        return {"status": "success", "data": reservation}
+    
+    check_lot(request.lot_id)
+    check_zone(request.lot_id, request.zone_id)
+    spot_type = layout.spot_type_for(request.isEv)
+    for _ in range(AUTO_ASSIGN_ATTEMPTS):
+        spot_id = reservation_book.find_spot(spot_type, request.start, request.end, request.lot_id, request.zone_id)
+        if spot_id is None:
+            break
+        # Место могли забронировать параллельным запросом — тогда ищем следующее
+        reservation = await reservation_book.create(
+            db, spot_id, request.vehicle_id, request.isEv, request.start, request.end
+        )
+        if reservation is not None:
+            return {"status": "success", "data": reservation}
+    raise HTTPException(status_code=409, detail="Нет мест нужного типа, свободных весь период")
+
+@app.get("/api/reservations/available")
+async def get_available_spot(
+    isEv: bool,
+    start: datetime,
+    end: datetime,
+    lot_id: Optional[str] = None,
+    zone_id: Optional[str] = None
+):
+    """Лучшее место нужного типа, свободное весь период"""
+    start, end = local_time(start), local_time(end)
+    check_period(start, end)
+    check_lot(lot_id)
+    check_zone(lot_id, zone_id)
+    spot_id = reservation_book.find_spot(layout.spot_type_for(isEv), start, end, lot_id, zone_id)
+    if spot_id is None:
+        raise HTTPException(status_code=409, detail="Нет мест нужного типа, свободных весь период")
     return {
         "status": "success",
-        "cost": round(cost, 2),
-        "duration_minutes": round(duration, 1)
+        "spot_id": spot_id,
+        "lot_id": parking_state.spot_lot(spot_id),
+        "zone_id": parking_state.spot_zone(spot_id)
     }
 
+@app.get("/api/reservations")
+async def get_reservations(
+    lot_id: Optional[str] = None,
+    spot_id: Optional[int] = None,
+    vehicle_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Текущие и будущие брони, пересекающиеся с периодом"""
+    check_lot(lot_id)
+    data = reservation_book.find(spot_id, lot_id, vehicle_id, local_time(start), local_time(end))
+    return {"status": "success", "data": data}
+
+@app.delete("/api/reservations/{reservation_id}")
+async def cancel_reservation(reservation_id: str):
+    """Отмена брони, по которой еще не заехали"""
+    db = mongo()
+    if await reservation_book.cancel(db, reservation_id) is None:
+        if not await db.reservations.find_one({"reservation_id": reservation_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Бронь не найдена")
+        raise HTTPException(status_code=400, detail="Бронь уже отменена или использована")
+    return {"status": "success"}
+
 @app.get("/api/parking/status")
-async def get_status():
-    """Текущее состояние парковки"""
-    spots = list(smart_parking_db.spots.find({}, {"_id": 0}))
-    return {"status": "success", "data": spots}
+async def get_status(lot_id: Optional[str] = None, if_none_match: str = Header(None)):
+    """Текущее состояние парковки (всех или одной)"""
+    check_lot(lot_id)
+    # Клиенты, опрашивающие статус, получают 304, пока ничего не изменилось
+    if if_none_match == parking_state.etag:
+        return Response(status_code=304, headers={"ETag": parking_state.etag})
+    # Тело сериализуется один раз на версию состояния и отдается без jsonable_encoder
+    return Response(parking_state.status_body(lot_id), media_type="application/json",
+                    headers={"ETag": parking_state.etag})
+
+# Интервал отправки пустых сообщений, по которым обнаруживается отключение клиента
+KEEPALIVE_INTERVAL = 15
+
+@app.websocket("/ws/parking")
+async def parking_updates_ws(websocket: WebSocket, lot_id: Optional[str] = None):
+    """Снимок мест при подключении, затем только изменения"""
+    if lot_id is not None and not parking_state.has_lot(lot_id):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    with broadcaster.subscribe(lot_id) as queue:
+        # Подписка оформлена до снимка, поэтому ни одно изменение не теряется
+        await websocket.send_text(parking_state.snapshot_text(lot_id))
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await websocket.send_text(json.dumps({"type": "ping"}))
+                    continue
+                if message is None:
+                    # Клиент отстал: закрываем соединение, при переподключении он получит снимок
+                    await websocket.close(code=1013)
+                    return
+                await websocket.send_text(message)
+        except WebSocketDisconnect:
+            pass
+
+@app.get("/api/parking/events")
+async def parking_updates_sse(request: Request, lot_id: Optional[str] = None):
+    """Те же обновления через Server-Sent Events для клиентов без WebSocket"""
+    check_lot(lot_id)
+    
+    async def stream():
+        with broadcaster.subscribe(lot_id) as queue:
+            yield f"data: {parking_state.snapshot_text(lot_id)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                yield f"data: {message}\n\n"
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/api/stats")
-async def get_stats(days: int = 1):
+async def get_stats(days: int = 1, lot_id: Optional[str] = None):
     """Получение статистики"""
+    check_lot(lot_id)
+    # Результат меняется только при заездах и выездах, которые очищают кэш
+    key = ("stats", days, lot_id)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
     # Расчет временного диапазона
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
-    # Агрегация данных
-    pipeline = [
-        {"$match": {"entry_time": {"$gte": start_date}}},
-        {"$group": {
-            "_id": {"$hour": "$entry_time"},
-            "total_vehicles": {"$sum": 1},
-            "total_revenue": {"$sum": "$cost"}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    
-    hourly_stats = list(smart_parking_db.vehicles.aggregate(pipeline))
+    # Агрегация данных в хранилище (работает со всеми реализациями)
+    hourly_stats = await parking_storage.arrivals_by_hour(start_date, lot_id)
     
-    # Форматирование результата
-    formatted_stats = [{
-        "hour": stat["_id"],
-        "vehicles": stat["total_vehicles"],
-        "revenue": stat.get("total_revenue", 0)
-    } for stat in hourly_stats]
-    
-    return {"status": "success", "data": formatted_stats}
+    result = {"status": "success", "data": hourly_stats}
+    response_cache.set(key, result)
+    return result
 
 @app.get("/api/vehicles")
-async def get_active_vehicles():
-    vehicles = list(smart_parking_db.vehicles.find({"exit_time": None}, {"_id": 0}))
-    return {"status": "success", "data": vehicles}
+async def get_active_vehicles(lot_id: Optional[str] = None, if_none_match: str = Header(None)):
+    check_lot(lot_id)
+    etag = parking_state.vehicles_etag(lot_id)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(parking_state.vehicles_body(lot_id), media_type="application/json",
+                    headers={"ETag": etag})
+
+@app.get("/api/vehicles/{vehicle_id}/sessions")
+async def get_vehicle_sessions(
+    vehicle_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(sessions.SESSIONS_PAGE_SIZE, ge=1, le=sessions.SESSIONS_MAX_PAGE_SIZE)
+):
+    """Стоянки ТС от последней к первой; следующая страница — по next_cursor"""
+    try:
+        data, next_cursor = await sessions.of_vehicle(mongo(), vehicle_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Текущая стоянка берется из состояния в памяти и отдается с первой страницей
+    active = parking_state.vehicles.get(vehicle_id)
+    return {
+        "status": "success",
+        "active": active if cursor is None else None,
+        "data": data,
+        "next_cursor": next_cursor
+    }
 
 @app.post("/api/reset")
 async def reset_collections():
     """Сброс коллекций vehicles и spots"""
     try:
-        # Удаляем все документы из коллекции vehicles
-        smart_parking_db.vehicles.delete_many({})
-        
-        # Удаляем все документы из коллекции spots
-        smart_parking_db.spots.delete_many({})
+        # Удаляем все записи ТС и места
+        await parking_storage.reset()
         
         # Переинициализируем парковочные места
-        initialize_parking()
+        await initialize_parking()
+        await parking_state.load(parking_storage)
+        event_log.record(events.reset())
+        response_cache.clear()
         
         return {
             "status": "success",
@@ -258,321 +726,146 @@ async def reset_collections():
             detail=f"Ошибка при сбросе коллекций: {str(e)}"
         )
 
-def generate_time_intervals(start_time: datetime, end_time: datetime, interval: str) -> List[datetime]:
-    """Генерация временных интервалов"""
-    intervals = []
-    current = start_time
-    
-    if interval == "10s":
-        delta = timedelta(seconds=10)
-    elif interval == "1m":
-        delta = timedelta(minutes=1)
-    elif interval == "5m":
-        delta = timedelta(minutes=5)
-    elif interval == "15m":
-        delta = timedelta(minutes=15)
-    else:  # 1h
-        delta = timedelta(hours=1)
-    
-    while current <= end_time:
-        intervals.append(current)
-        current += delta
-    
-    return intervals
-
-def format_timestamp(dt: datetime, interval: str) -> str:
-    """Форматирование временной метки в зависимости от интервала"""
-    if interval == "10s":
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-    elif interval == "1m":
-        return dt.strftime("%Y-%m-%d %H:%M")
-    elif interval == "5m":
-        # Округляем до ближайших 5 минут
-        minutes = (dt.minute // 5) * 5
-        return dt.replace(minute=minutes, second=0, microsecond=0).strftime("%Y-%m-%d %H:%M")
-    elif interval == "15m":
-        # Округляем до ближайших 15 минут
-        minutes = (dt.minute // 15) * 15
-        return dt.replace(minute=minutes, second=0, microsecond=0).strftime("%Y-%m-%d %H:%M")
-    else:  # 1h
-        return dt.strftime("%Y-%m-%d %H:00")
-
 @app.get("/api/stats/vehicles")
 async def get_vehicles_stats(
-    time_range: str = Query("1h", enum=["1m", "10m", "1h", "1d"]),
-    interval: str = Query("1m", enum=["10s", "1m", "5m", "15m", "1h"])
+    time_range: str = Query("1h", enum=list(stats.TIME_RANGES)),
+    interval: str = Query("1m", enum=list(stats.LABEL_FORMATS)),
+    lot_id: Optional[str] = None
 ):
     """Статистика по количеству машин"""
-    end_time = datetime.now()
-    
-    # Определяем начальное время в зависимости от выбранного диапазона
-    if time_range == "1m":
-        start_time = end_time - timedelta(minutes=1)
-    elif time_range == "10m":
-        start_time = end_time - timedelta(minutes=10)
-    elif time_range == "1h":
-        start_time = end_time - timedelta(hours=1)
-    else:  # 1d
-        start_time = end_time - timedelta(days=1)
-
-    # Генерируем все интервалы
-    intervals = generate_time_intervals(start_time, end_time, interval)
-    
-    # Получаем данные из базы
-    pipeline = [
-        {
-            "$match": {
-                "timestamp": {"$gte": start_time, "$lte": end_time}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d %H:%M:%S",
-                        "date": "$timestamp"
-                    }
-                },
-                "count": {"$sum": 1},
-                "occupied_spots": {"$avg": "$occupied_spots"},
-                "load_percentage": {"$avg": "$load_percentage"}
-            }
-        }
-    ]
-    
-    stats = list(smart_parking_db.parking_load_history.aggregate(pipeline))
-    
-    # Создаем словарь с данными
-    stats_dict = {}
-    for stat in stats:
-        dt = datetime.strptime(stat["_id"], "%Y-%m-%d %H:%M:%S")
-        timestamp = format_timestamp(dt, interval)
-        if timestamp not in stats_dict:
-            stats_dict[timestamp] = {
-                "count": 0,
-                "occupied_spots": 0,
-                "load_percentage": 0,
-                "total_count": 0
-            }
-        stats_dict[timestamp]["count"] += stat["count"]
-        stats_dict[timestamp]["occupied_spots"] += stat["occupied_spots"]
-        stats_dict[timestamp]["load_percentage"] += stat["load_percentage"]
-        stats_dict[timestamp]["total_count"] += 1
-    
-    # Формируем результат со всеми интервалами
-    result = []
-    for dt in intervals:
-        timestamp = format_timestamp(dt, interval)
-        if timestamp in stats_dict:
-            stat = stats_dict[timestamp]
-            result.append({
-                "timestamp": timestamp,
-                "count": stat["count"],
-                "occupied_spots": round(stat["occupied_spots"] / stat["total_count"], 2),
-                "load_percentage": round(stat["load_percentage"] / stat["total_count"], 2)
-            })
-        else:
-            result.append({
-                "timestamp": timestamp,
-                "count": 0,
-                "occupied_spots": 0,
-                "load_percentage": 0
-            })
-    
-    return {
-        "status": "success",
-        "data": result
-    }
+    check_lot(lot_id)
+    interval, data = await stats.time_series(mongo(), "vehicles", time_range, interval, lot_id or ALL_LOTS)
+    # Ряд состоит из строк и чисел, поэтому отдается orjson напрямую, минуя jsonable_encoder
+    return OrjsonResponse({"status": "success", "interval": interval, "data": data})
 
 @app.get("/api/stats/revenue")
 async def get_revenue_stats(
-    time_range: str = Query("1h", enum=["1m", "10m", "1h", "1d"]),
-    interval: str = Query("1m", enum=["10s", "1m", "5m", "15m", "1h"])
+    time_range: str = Query("1h", enum=list(stats.TIME_RANGES)),
+    interval: str = Query("1m", enum=list(stats.LABEL_FORMATS)),
+    lot_id: Optional[str] = None
 ):
     """Статистика по выручке"""
-    end_time = datetime.now()
-    
-    if time_range == "1m":
-        start_time = end_time - timedelta(minutes=1)
-    elif time_range == "10m":
-        start_time = end_time - timedelta(minutes=10)
-    elif time_range == "1h":
-        start_time = end_time - timedelta(hours=1)
-    else:  # 1d
-        start_time = end_time - timedelta(days=1)
-
-    # Генерируем все интервалы
-    intervals = generate_time_intervals(start_time, end_time, interval)
-    
-    pipeline = [
-        {
-            "$match": {
-                "exit_time": {"$gte": start_time, "$lte": end_time}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d %H:%M:%S",
-                        "date": "$exit_time"
-                    }
-                },
-                "revenue": {"$sum": "$cost"},
-                "count": {"$sum": 1}
-            }
-        }
-    ]
-    
-    stats = list(smart_parking_db.parking_history.aggregate(pipeline))
-    
-    # Создаем словарь с данными
-    stats_dict = {}
-    for stat in stats:
-        dt = datetime.strptime(stat["_id"], "%Y-%m-%d %H:%M:%S")
-        timestamp = format_timestamp(dt, interval)
-        if timestamp not in stats_dict:
-            stats_dict[timestamp] = {
-                "revenue": 0,
-                "count": 0
-            }
-        stats_dict[timestamp]["revenue"] += stat["revenue"]
-        stats_dict[timestamp]["count"] += stat["count"]
-    
-    # Формируем результат со всеми интервалами
-    result = []
-    for dt in intervals:
-        timestamp = format_timestamp(dt, interval)
-        if timestamp in stats_dict:
-            stat = stats_dict[timestamp]
-            result.append({
-                "timestamp": timestamp,
-                "revenue": round(stat["revenue"], 2),
-                "count": stat["count"]
-            })
-        else:
-            result.append({
-                "timestamp": timestamp,
-                "revenue": 0,
-                "count": 0
-            })
-    
-    return {
-        "status": "success",
-        "data": result
-    }
+    check_lot(lot_id)
+    interval, data = await stats.time_series(mongo(), "revenue", time_range, interval, lot_id or ALL_LOTS)
+    # Ряд состоит из строк и чисел, поэтому отдается orjson напрямую, минуя jsonable_encoder
+    return OrjsonResponse({"status": "success", "interval": interval, "data": data})
 
 @app.get("/api/stats/duration")
 async def get_duration_stats(
-    time_range: str = Query("1h", enum=["1m", "10m", "1h", "1d"]),
-    interval: str = Query("1m", enum=["10s", "1m", "5m", "15m", "1h"])
+    time_range: str = Query("1h", enum=list(stats.TIME_RANGES)),
+    interval: str = Query("1m", enum=list(stats.LABEL_FORMATS)),
+    lot_id: Optional[str] = None
 ):
     """Статистика по времени стоянки"""
-    end_time = datetime.now()
-    
-    if time_range == "1m":
-        start_time = end_time - timedelta(minutes=1)
-    elif time_range == "10m":
-        start_time = end_time - timedelta(minutes=10)
-    elif time_range == "1h":
-        start_time = end_time - timedelta(hours=1)
-    else:  # 1d
-        start_time = end_time - timedelta(days=1)
-
-    # Генерируем все интервалы
-    intervals = generate_time_intervals(start_time, end_time, interval)
-    
-    pipeline = [
-        {
-            "$match": {
-                "exit_time": {"$gte": start_time, "$lte": end_time}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d %H:%M:%S",
-                        "date": "$exit_time"
-                    }
-                },
-                "avg_duration": {"$avg": "$duration_minutes"},
-                "min_duration": {"$min": "$duration_minutes"},
-                "max_duration": {"$max": "$duration_minutes"},
-                "count": {"$sum": 1}
-            }
-        }
-    ]
-    
-    stats = list(smart_parking_db.parking_history.aggregate(pipeline))
-    
-    # Создаем словарь с данными
-    stats_dict = {}
-    for stat in stats:
-        dt = datetime.strptime(stat["_id"], "%Y-%m-%d %H:%M:%S")
-        timestamp = format_timestamp(dt, interval)
-        if timestamp not in stats_dict:
-            stats_dict[timestamp] = {
-                "avg_duration": 0,
-                "min_duration": float('inf'),
-                "max_duration": 0,
-                "count": 0,
-                "total_duration": 0
-            }
-        stats_dict[timestamp]["total_duration"] += stat["avg_duration"] * stat["count"]
-        stats_dict[timestamp]["min_duration"] = min(stats_dict[timestamp]["min_duration"], stat["min_duration"])
-        stats_dict[timestamp]["max_duration"] = max(stats_dict[timestamp]["max_duration"], stat["max_duration"])
-        stats_dict[timestamp]["count"] += stat["count"]
-    
-    # Формируем результат со всеми интервалами
-    result = []
-    for dt in intervals:
-        timestamp = format_timestamp(dt, interval)
-        if timestamp in stats_dict:
-            stat = stats_dict[timestamp]
-            result.append({
-                "timestamp": timestamp,
-                "avg_duration": round(stat["total_duration"] / stat["count"], 2) if stat["count"] > 0 else 0,
-                "min_duration": round(stat["min_duration"], 2) if stat["min_duration"] != float('inf') else 0,
-                "max_duration": round(stat["max_duration"], 2),
-                "count": stat["count"]
-            })
-        else:
-            result.append({
-                "timestamp": timestamp,
-                "avg_duration": 0,
-                "min_duration": 0,
-                "max_duration": 0,
-                "count": 0
-            })
-    
-    return {
-        "status": "success",
-        "data": result
-    }
+    check_lot(lot_id)
+    interval, data = await stats.time_series(mongo(), "duration", time_range, interval, lot_id or ALL_LOTS)
+    # Ряд состоит из строк и чисел, поэтому отдается orjson напрямую, минуя jsonable_encoder
+    return OrjsonResponse({"status": "success", "interval": interval, "data": data})
 
 @app.get("/api/stats/total-revenue")
-async def get_total_revenue():
+async def get_total_revenue(lot_id: Optional[str] = None):
     """Общая выручка"""
-    pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "total_revenue": {"$sum": "$cost"}
-            }
-        }
-    ]
-    
-    result = list(smart_parking_db.parking_history.aggregate(pipeline))
-    total_revenue = result[0]["total_revenue"] if result else 0
-    
+    check_lot(lot_id)
+    # Счетчик в памяти загружается при старте и растет с каждым выездом
     return {
         "status": "success",
         "data": {
-            "total_revenue": round(total_revenue, 2)
+            "total_revenue": revenue_counter.total(lot_id)
         }
     }
 
+@app.get("/api/forecast/occupancy")
+async def get_occupancy_forecast(
+    lot_id: Optional[str] = None,
+    hours: int = Query(min(24, FORECAST_HORIZON_HOURS), ge=1, le=FORECAST_HORIZON_HOURS)
+):
+    """Прогноз загруженности и выездов по часам, начиная с текущего часа"""
+    check_lot(lot_id)
+    # Модель обучается в фоне, ответ готов заранее
+    body = forecast_job.body(lot_id or ALL_LOTS, hours)
+    if body is None:
+        raise HTTPException(status_code=503, detail="Прогноз еще не построен")
+    return Response(body, media_type="application/json")
+
+@app.get("/api/export/history")
+async def export_history(
+    format: str = Query("ndjson", enum=["ndjson", "csv", "parquet"]),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    spot_id: Optional[int] = None,
+    vehicle_type: Optional[str] = None,
+    lot_id: Optional[str] = None,
+    batch_size: int = Query(export.EXPORT_BATCH_SIZE, ge=1, le=10000)
+):
+    """Выгрузка истории стоянок потоком из курсора с постоянным расходом памяти"""
+    check_lot(lot_id)
+    query = export.history_filter(
+        start and local_time(start), end and local_time(end), spot_id, vehicle_type
+    )
+    query.update(lot_match(lot_id))
+    
+    if format == "parquet":
+        # Parquet не пишется потоком в ответ: файл собирается по пачкам в EXPORT_DIR
+        path = os.path.join(export.EXPORT_DIR, f"history-{datetime.now():%Y%m%d-%H%M%S-%f}.parquet")
+        try:
+            rows = await export.parquet(mongo(), query, path, batch_size)
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Для выгрузки в Parquet установите pyarrow")
+        return {"status": "success", "data": {"path": path, "rows": rows}}
+    
+    if format == "csv":
+        return StreamingResponse(
+            export.csv_rows(mongo(), query, batch_size),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="parking_history.csv"'}
+        )
+    return StreamingResponse(
+        export.ndjson(mongo(), query, batch_size),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="parking_history.ndjson"'}
+    )
+
+@app.get("/api/history/at")
+async def get_history_at(
+    ts: datetime,
+    lot_id: Optional[str] = None,
+    spot_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(sessions.SESSIONS_PAGE_SIZE, ge=1, le=sessions.SESSIONS_MAX_PAGE_SIZE)
+):
+    """Какие ТС стояли на каких местах в момент ts; следующая страница — по next_cursor"""
+    check_lot(lot_id)
+    ts = local_time(ts)
+    match = lot_match(lot_id)
+    if spot_id is not None:
+        match["spot_id"] = spot_id
+    try:
+        data, next_cursor = await sessions.at(mongo(), ts, match, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # ТС, которые еще на парковке и заехали до ts, стояли и в момент ts
+    active = [
+        vehicle for vehicle in parking_state.active_vehicles(lot_id)
+        if vehicle["entry_time"] <= ts and (spot_id is None or vehicle["spot_id"] == spot_id)
+    ] if cursor is None else []
+    return {"status": "success", "active": active, "data": data, "next_cursor": next_cursor}
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Проверка живости: процесс запущен и цикл событий отвечает"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Проверка готовности: хранилище подключено, индексы созданы, состояние загружено"""
+    return OrjsonResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в формате Prometheus"""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8008)
\ No newline at end of file
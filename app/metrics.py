@@ -0,0 +1,147 @@
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+from typing import Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+# Период проверки задержки цикла событий (секунды)
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+REQUEST_LATENCY = Histogram(
+    "parking_http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+MONGO_LATENCY = Histogram(
+    "parking_mongo_command_duration_seconds",
+    "Время выполнения команды MongoDB",
+    ["collection", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+MONGO_FAILURES = Counter(
+    "parking_mongo_command_failures_total",
+    "Команды MongoDB, завершившиеся ошибкой",
+    ["collection", "command"],
+)
+LOOP_LAG = Histogram(
+    "parking_event_loop_lag_seconds",
+    "Задержка срабатывания таймера в цикле событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+ARRIVALS = Counter("parking_arrivals_total", "Зарегистрированные заезды", ["lot_id"])
+DEPARTURES = Counter("parking_departures_total", "Зарегистрированные выезды", ["lot_id"])
+STARTUP_PHASE = Gauge("parking_startup_phase_seconds", "Длительность этапов прогрева при старте (total — весь старт)", ["phase"])
+
+class MetricsMiddleware:
+    """ASGI-middleware с гистограммой задержек по шаблону маршрута.
+
+    Шаблон маршрута (например, /api/vehicle/depart/{vehicle_id}) берется
+    после обработки запроса, поэтому число рядов не зависит от параметров.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "unmatched"), status
+            ).observe(time.perf_counter() - started)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Число и длительность команд MongoDB по коллекциям (command monitoring PyMongo)"""
+
+    def __init__(self):
+        self.collections: Dict[Tuple[object, int], str] = {}
+
+    def started(self, event):
+        # В событии завершения нет имени коллекции, поэтому запоминаем его при старте
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self.collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(collection, event.command_name).inc()
+
+mongo_listener = MongoCommandListener()
+
+class ParkingCollector:
+    """Занятость по парковкам и типам мест, вычисляемая из состояния в памяти при сборе метрик"""
+
+    def __init__(self, state):
+        self.state = state
+
+    def collect(self):
+        occupied = GaugeMetricFamily("parking_spots_occupied", "Занятые места", labels=["lot_id", "spot_type"])
+        total = GaugeMetricFamily("parking_spots_total", "Все места", labels=["lot_id", "spot_type"])
+        counts: Dict[Tuple[str, str], list] = {}
+        for lot_id, spot_type, busy in zip(self.state.spot_lots, self.state.spot_types, self.state.occupied):
+            count = counts.setdefault((lot_id, spot_type), [0, 0])
+            count[0] += busy
+            count[1] += 1
+        for (lot_id, spot_type), (busy, spots) in sorted(counts.items()):
+            occupied.add_metric([lot_id, spot_type], busy)
+            total.add_metric([lot_id, spot_type], spots)
+        yield occupied
+        yield total
+
+def register_state(state):
+    REGISTRY.register(ParkingCollector(state))
+
+def render() -> Tuple[bytes, str]:
+    """Текущие метрики в текстовом формате Prometheus"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+class LoopLagMonitor:
+    """Фоновая задача, замеряющая, насколько позже срока просыпается таймер"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+loop_lag_monitor = LoopLagMonitor()
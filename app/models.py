@@ -1,12 +1,75 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
+from typing import Annotated, Dict, List, Literal, Optional, Union
+
+def local_time(value: Optional[datetime]) -> Optional[datetime]:
+    """Приведение времени события к локальному времени без часового пояса, как в базе"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
 
 class VehicleArrival(BaseModel):
     isEv: bool
     type: str
     spot_id: int
     vehicle_id: str
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = Field(default_factory=datetime.now)
+
+    _local_timestamp = field_validator("timestamp")(local_time)
+
+class VehicleAutoArrival(BaseModel):
+    """Заезд без номера места: место выбирает сервер (при необходимости на заданной парковке и в зоне)"""
+    isEv: bool
+    type: str
+    vehicle_id: str
+    lot_id: Optional[str] = None
+    zone_id: Optional[str] = None
+
+class ArrivalEvent(VehicleArrival):
+    event: Literal["arrive"]
+
+class DepartureEvent(BaseModel):
+    event: Literal["depart"]
+    vehicle_id: str
+    timestamp: datetime = Field(default_factory=datetime.now)
+
+    _local_timestamp = field_validator("timestamp")(local_time)
+
+class EventBatch(BaseModel):
+    events: List[Annotated[Union[ArrivalEvent, DepartureEvent], Field(discriminator="event")]]
+
+class TariffPeriod(BaseModel):
+    start: str  # "ЧЧ:ММ"
+    end: str
+    rates: Dict[str, float]
+
+class TariffConfig(BaseModel):
+    """Тариф парковки: ставки руб/мин по классам ТС ("car", "evCar"), периоды суток, бесплатное время и суточный максимум"""
+    rates: Dict[str, float]
+    periods: List[TariffPeriod] = []
+    grace_minutes: float = 0
+    daily_cap: Dict[str, float] = {}
+
+class RepriceRequest(BaseModel):
+    """Пересчет стоимости стоянок, завершенных в период [start, end)"""
+    lot_id: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    dry_run: bool = False
+
+    _local_period = field_validator("start", "end")(local_time)
+
+class ReservationRequest(BaseModel):
+    """Бронь на период [start, end): места spot_id или лучшего свободного (на парковке и в зоне, если заданы)"""
+    vehicle_id: str
+    isEv: bool
+    start: datetime
+    end: datetime
+    spot_id: Optional[int] = None
+    lot_id: Optional[str] = None
+    zone_id: Optional[str] = None
+
+    _local_period = field_validator("start", "end")(local_time)
 
 class ParkingSpot(BaseModel):
     spot_id: int
@@ -0,0 +1,340 @@
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from layout import DEFAULT_LOT_ID, ALL_LOTS
+from allocator import SpotAllocator
+import hashlib
+import orjson
+
+# Поля, которые читаются из базы при загрузке состояния
+SPOT_FIELDS = {"_id": 0, "spot_id": 1, "lot_id": 1, "zone_id": 1, "spot_type": 1, "status": 1, "current_vehicle": 1}
+VEHICLE_FIELDS = {"_id": 0, "id": 1, "isEv": 1, "type": 1, "entry_time": 1, "exit_time": 1, "spot_id": 1, "lot_id": 1, "paid": 1}
+
+def _ms(value: datetime) -> datetime:
+    """Время с точностью хранения в MongoDB (миллисекунды)"""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def _same_vehicle(current: dict, record: dict) -> bool:
+    """Совпадение записи ТС в памяти с записью из базы с точностью хранения времени"""
+    for field, value in record.items():
+        other = current.get(field)
+        if isinstance(value, datetime) and isinstance(other, datetime):
+            value, other = _ms(value), _ms(other)
+        if value != other:
+            return False
+    return True
+
+class ParkingState:
+    """Состояние занятости парковок в памяти процесса.
+
+    Места хранятся компактно: позиция места в массивах определяется по spot_id,
+    занятость — байтовой маской. Состояние загружается из хранилища (мест и
+    записей ТС) при старте и обновляется после каждой успешной записи в него
+    (write-through), поэтому чтение статуса не обращается к базе. Изменения,
+    сделанные другими экземплярами сервиса, применяются через sync_spot,
+    sync_vehicle и refresh (см. sync.py).
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._etag: Optional[str] = None
+        # ETag списка ТС по парковкам: тело ответа зависит от записей ТС, а не только от мест
+        self._vehicle_etags: Dict[Optional[str], str] = {}
+        self.lots: Dict[str, dict] = {}
+        self.spot_index: Dict[int, int] = {}
+        self.spot_ids: List[int] = []
+        self.spot_lots: List[str] = []
+        self.spot_zones: List[str] = []
+        self.spot_types: List[str] = []
+        self.occupied = bytearray()
+        self.current_vehicle: List[Optional[str]] = []
+        self.vehicles: Dict[str, dict] = {}
+        self.occupied_count = 0
+        # Занятые и все места по парковкам
+        self.lot_occupied: Dict[str, int] = {}
+        self.lot_total: Dict[str, int] = {}
+        self._spots_cache: Dict[Optional[str], List[dict]] = {}
+        self._vehicles_cache: Dict[Optional[str], List[dict]] = {}
+        # Готовые к отправке ответы, сериализованные один раз на версию состояния
+        self._encoded: Dict[tuple, bytes] = {}
+        # Номера мест групп в порядке выбора (меняется только при загрузке)
+        self._order_cache: Dict[tuple, List[int]] = {}
+        # Свободные места по типам для автоматического выбора
+        self.allocator = SpotAllocator()
+        # Подписчики на изменения: получают снимок после загрузки и дельты по местам
+        # вместе со списком парковок, к которым относится сообщение
+        self.listeners: List[Callable[[dict, List[Optional[str]]], None]] = []
+
+    async def load(self, storage):
+        """Загрузка состояния из хранилища"""
+        self._apply(*await storage.fetch_state())
+
+    async def refresh(self, storage) -> bool:
+        """Сверка с базой без полной перезагрузки: подписчики получают только изменившиеся места.
+
+        Если изменились парковки или набор мест, состояние загружается заново.
+        Возвращает True, если что-то изменилось.
+        """
+        lots, spots, vehicles = await storage.fetch_state()
+        if lots != list(self.lots.values()) or [spot["spot_id"] for spot in spots] != self.spot_ids:
+            self._apply(lots, spots, vehicles)
+            return True
+        changed = False
+        for spot in spots:
+            changed |= self.sync_spot(spot)
+        active = {vehicle["id"] for vehicle in vehicles}
+        for vehicle_id in [vehicle_id for vehicle_id in self.vehicles if vehicle_id not in active]:
+            del self.vehicles[vehicle_id]
+            changed = True
+        for vehicle in vehicles:
+            changed |= self.sync_vehicle(vehicle)
+        if changed:
+            self._changed()
+        return changed
+
+    def _apply(self, lots: List[dict], spots: List[dict], vehicles: List[dict]):
+        # Резервы параллельных автоматических заездов переносятся по номерам мест:
+        # иначе после перезагрузки то же место выдадут второму запросу
+        claimed = [self.spot_ids[i] for i in self.allocator.claimed]
+        self.lots = {lot["lot_id"]: lot for lot in lots}
+        self.spot_index = {spot["spot_id"]: i for i, spot in enumerate(spots)}
+        self.spot_ids = [spot["spot_id"] for spot in spots]
+        self.spot_lots = [spot.get("lot_id", DEFAULT_LOT_ID) for spot in spots]
+        self.spot_zones = [spot.get("zone_id") for spot in spots]
+        self.spot_types = [spot["spot_type"] for spot in spots]
+        self.occupied = bytearray(spot["status"] == "occupied" for spot in spots)
+        self.current_vehicle = [spot.get("current_vehicle") for spot in spots]
+        self.vehicles = {vehicle["id"]: vehicle for vehicle in vehicles}
+        self.occupied_count = sum(self.occupied)
+        self.lot_occupied = {lot_id: 0 for lot_id in self.lots}
+        self.lot_total = {lot_id: 0 for lot_id in self.lots}
+        for i, lot_id in enumerate(self.spot_lots):
+            self.lot_total[lot_id] = self.lot_total.get(lot_id, 0) + 1
+            self.lot_occupied[lot_id] = self.lot_occupied.get(lot_id, 0) + self.occupied[i]
+        self.allocator.load(
+            self._ranks(), self.spot_types, self.spot_lots, self.spot_zones, self.occupied,
+            {self.spot_index[spot_id] for spot_id in claimed if spot_id in self.spot_index}
+        )
+        self._order_cache = {}
+        self._changed()
+        self._notify(self.snapshot(), [None])
+        for lot_id in self.lot_total:
+            self._notify(self.snapshot(lot_id), [lot_id])
+
+    def _ranks(self) -> List[tuple]:
+        """Порядок выбора мест: парковка, приоритет зоны (по умолчанию порядок в описании), номер места"""
+        zone_ranks = {}
+        for lot_rank, lot in enumerate(self.lots.values()):
+            for zone_rank, zone in enumerate(lot["zones"]):
+                zone_ranks[(lot["lot_id"], zone["zone_id"])] = (lot_rank, zone.get("priority", zone_rank))
+        unknown = (len(self.lots), 0)
+        return [
+            (*zone_ranks.get((lot_id, zone_id), unknown), spot_id)
+            for lot_id, zone_id, spot_id in zip(self.spot_lots, self.spot_zones, self.spot_ids)
+        ]
+
+    def _changed(self):
+        self.version += 1
+        self._etag = None
+        self._vehicle_etags = {}
+        self._spots_cache = {}
+        self._vehicles_cache = {}
+        self._encoded = {}
+
+    def _notify(self, message: dict, lot_ids: List[Optional[str]]):
+        for listener in self.listeners:
+            listener(message, lot_ids)
+
+    def _notify_spot(self, i: int):
+        # Изменение места получают подписчики всех парковок и его собственной
+        self._notify({"type": "spot", "version": self.version, "data": self._spot(i)}, [None, self.spot_lots[i]])
+
+    def _spot(self, i: int) -> dict:
+        return {
+            "spot_id": self.spot_ids[i],
+            "lot_id": self.spot_lots[i],
+            "zone_id": self.spot_zones[i],
+            "spot_type": self.spot_types[i],
+            "status": "occupied" if self.occupied[i] else "free",
+            "current_vehicle": self.current_vehicle[i]
+        }
+
+    def snapshot(self, lot_id: Optional[str] = None) -> dict:
+        """Полный снимок мест (всех или одной парковки) с текущей версией"""
+        return {"type": "snapshot", "version": self.version, "data": self.spots(lot_id)}
+
+    def _encode(self, key: tuple, build: Callable[[], dict]) -> bytes:
+        body = self._encoded.get(key)
+        if body is None:
+            body = self._encoded[key] = orjson.dumps(build())
+        return body
+
+    def snapshot_text(self, lot_id: Optional[str] = None) -> str:
+        return self._encode(("snapshot", lot_id), lambda: self.snapshot(lot_id)).decode()
+
+    def status_body(self, lot_id: Optional[str] = None) -> bytes:
+        """Тело ответа /api/parking/status"""
+        return self._encode(("spots", lot_id), lambda: {"status": "success", "data": self.spots(lot_id)})
+
+    def vehicles_body(self, lot_id: Optional[str] = None) -> bytes:
+        """Тело ответа /api/vehicles"""
+        return self._encode(("vehicles", lot_id), lambda: {"status": "success", "data": self.active_vehicles(lot_id)})
+
+    @property
+    def etag(self) -> str:
+        """ETag по содержимому: одинаковый у всех экземпляров сервиса с одним состоянием"""
+        if self._etag is None:
+            digest = hashlib.blake2b(self.occupied, digest_size=8)
+            digest.update("\0".join(vehicle_id or "" for vehicle_id in self.current_vehicle).encode())
+            self._etag = f'"{digest.hexdigest()}"'
+        return self._etag
+
+    def vehicles_etag(self, lot_id: Optional[str] = None) -> str:
+        """ETag списка ТС по содержимому тела ответа /api/vehicles"""
+        etag = self._vehicle_etags.get(lot_id)
+        if etag is None:
+            digest = hashlib.blake2b(self.vehicles_body(lot_id), digest_size=8)
+            etag = self._vehicle_etags[lot_id] = f'"{digest.hexdigest()}"'
+        return etag
+
+    @property
+    def total_spots(self) -> int:
+        return len(self.spot_ids)
+
+    def has_lot(self, lot_id: str) -> bool:
+        return lot_id in self.lot_total
+
+    def spot_lot(self, spot_id: int) -> Optional[str]:
+        i = self.spot_index.get(spot_id)
+        return None if i is None else self.spot_lots[i]
+
+    def spot_type(self, spot_id: int) -> Optional[str]:
+        i = self.spot_index.get(spot_id)
+        return None if i is None else self.spot_types[i]
+
+    def load_counts(self, lot_id: str):
+        """Занятые и все места парковки (или всех парковок для ALL_LOTS)"""
+        if lot_id == ALL_LOTS:
+            return self.occupied_count, self.total_spots
+        return self.lot_occupied.get(lot_id, 0), self.lot_total.get(lot_id, 0)
+
+    def occupy(self, spot_id: int, vehicle: dict):
+        """Отметка заезда ТС на место"""
+        i = self.spot_index[spot_id]
+        if not self.occupied[i]:
+            self.occupied[i] = 1
+            self.occupied_count += 1
+            self.lot_occupied[self.spot_lots[i]] += 1
+        self.current_vehicle[i] = vehicle["id"]
+        self.vehicles[vehicle["id"]] = {k: v for k, v in vehicle.items() if k != "_id"}
+        self._changed()
+        self._notify_spot(i)
+
+    def release(self, spot_id: int, vehicle_id: str):
+        """Отметка выезда ТС с места"""
+        i = self.spot_index.get(spot_id)
+        if i is not None and self.current_vehicle[i] == vehicle_id:
+            if self.occupied[i]:
+                self.occupied[i] = 0
+                self.occupied_count -= 1
+                self.lot_occupied[self.spot_lots[i]] -= 1
+            self.current_vehicle[i] = None
+            self.allocator.free(i)
+        self.vehicles.pop(vehicle_id, None)
+        self._changed()
+        if i is not None:
+            self._notify_spot(i)
+
+    def sync_spot(self, spot: dict) -> bool:
+        """Применение состояния места из базы (изменение другим экземпляром сервиса).
+
+        Повторное применение уже известного состояния ничего не меняет.
+        Возвращает True, если место изменилось.
+        """
+        i = self.spot_index.get(spot["spot_id"])
+        if i is None:
+            return False
+        occupied = spot["status"] == "occupied"
+        vehicle_id = spot.get("current_vehicle")
+        if bool(self.occupied[i]) == occupied and self.current_vehicle[i] == vehicle_id:
+            return False
+        if bool(self.occupied[i]) != occupied:
+            delta = 1 if occupied else -1
+            self.occupied[i] = occupied
+            self.occupied_count += delta
+            self.lot_occupied[self.spot_lots[i]] += delta
+            if not occupied:
+                self.allocator.free(i)
+        self.current_vehicle[i] = vehicle_id
+        self._changed()
+        self._notify_spot(i)
+        return True
+
+    def sync_vehicle(self, vehicle: dict) -> bool:
+        """Применение записи ТС из базы; возвращает True, если список ТС на парковке или их записи изменились"""
+        current = self.vehicles.get(vehicle["id"])
+        if vehicle.get("exit_time") is None:
+            record = {field: vehicle.get(field) for field in VEHICLE_FIELDS if VEHICLE_FIELDS[field]}
+            # Изменение любого поля записи (не только места) меняет ответ /api/vehicles
+            if current is not None and _same_vehicle(current, record):
+                return False
+            self.vehicles[vehicle["id"]] = record
+        elif current is not None and _ms(current["entry_time"]) == _ms(vehicle["entry_time"]):
+            # Закрытая запись удаляет ТС, только если это та же стоянка, а не новый заезд
+            del self.vehicles[vehicle["id"]]
+        else:
+            return False
+        self._changed()
+        return True
+
+    def claim_spot(self, spot_type: str, lot_id: Optional[str] = None, zone_id: Optional[str] = None) -> Optional[int]:
+        """Резерв лучшего свободного места типа (на парковке и в зоне, если заданы)"""
+        key = (spot_type,) if lot_id is None else (spot_type, lot_id) if zone_id is None else (spot_type, lot_id, zone_id)
+        i = self.allocator.claim(key, self.occupied)
+        return None if i is None else self.spot_ids[i]
+
+    def spots_in_order(self, spot_type: str, lot_id: Optional[str] = None, zone_id: Optional[str] = None) -> List[int]:
+        """Номера всех мест типа (на парковке и в зоне, если заданы) в порядке автоматического выбора"""
+        key = (spot_type, lot_id, zone_id)
+        if key not in self._order_cache:
+            ranks = self.allocator.ranks
+            self._order_cache[key] = [
+                self.spot_ids[i] for i in sorted(range(len(self.spot_ids)), key=ranks.__getitem__)
+                if self.spot_types[i] == spot_type
+                and (lot_id is None or self.spot_lots[i] == lot_id)
+                and (zone_id is None or self.spot_zones[i] == zone_id)
+            ]
+        return self._order_cache[key]
+
+    def unclaim(self, spot_id: int):
+        """Снятие резерва после записи заезда (успешной или нет)"""
+        i = self.spot_index.get(spot_id)
+        if i is not None:
+            self.allocator.release(i, self.occupied)
+
+    def spot_zone(self, spot_id: int) -> Optional[str]:
+        i = self.spot_index.get(spot_id)
+        return None if i is None else self.spot_zones[i]
+
+    def has_zone(self, lot_id: str, zone_id: str) -> bool:
+        lot = self.lots.get(lot_id)
+        return lot is not None and any(zone["zone_id"] == zone_id for zone in lot["zones"])
+
+    def spots(self, lot_id: Optional[str] = None) -> List[dict]:
+        """Список мест (всех или одной парковки) в формате коллекции spots"""
+        if lot_id not in self._spots_cache:
+            self._spots_cache[lot_id] = [
+                self._spot(i) for i in range(len(self.spot_ids))
+                if lot_id is None or self.spot_lots[i] == lot_id
+            ]
+        return self._spots_cache[lot_id]
+
+    def active_vehicles(self, lot_id: Optional[str] = None) -> List[dict]:
+        """Список ТС, находящихся на парковке"""
+        if lot_id not in self._vehicles_cache:
+            self._vehicles_cache[lot_id] = [
+                vehicle for vehicle in self.vehicles.values()
+                if lot_id is None or vehicle.get("lot_id", DEFAULT_LOT_ID) == lot_id
+            ]
+        return self._vehicles_cache[lot_id]
+
+parking_state = ParkingState()
@@ -0,0 +1,332 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from bson import ObjectId
+from occupancy import parking_state
+from allocator import FreeSpots
+import asyncio
+import os
+
+# За сколько минут до начала брони место закрывается для заезда других ТС
+RESERVATION_LEAD_MINUTES = float(os.getenv("RESERVATION_LEAD_MINUTES", "30"))
+# Попытки записи брони, если брони места одновременно изменил другой экземпляр сервиса
+RESERVATION_ATTEMPTS = 3
+
+# Брони, которые держат место: еще не начавшиеся или с уже заехавшим ТС
+HOLDING = ["active", "fulfilled"]
+
+class SpotSchedule:
+    """Брони одного места: непересекающиеся интервалы [start, end), упорядоченные по началу.
+
+    Пересекающиеся брони на одно место не допускаются, поэтому концы
+    упорядочены так же, как начала, и поиск пересечений с любым периодом —
+    два двоичных поиска, O(log n).
+    """
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+        self.items: List[dict] = []
+
+    def overlapping(self, start: datetime, end: datetime) -> List[dict]:
+        """Брони, пересекающиеся с [start, end)"""
+        return self.items[bisect_right(self.ends, start):bisect_left(self.starts, end)]
+
+    def add(self, reservation: dict):
+        i = bisect_left(self.starts, reservation["start"])
+        self.starts.insert(i, reservation["start"])
+        self.ends.insert(i, reservation["end"])
+        self.items.insert(i, reservation)
+
+    def remove(self, reservation: dict):
+        i = bisect_left(self.starts, reservation["start"])
+        if i < len(self.items) and self.items[i]["reservation_id"] == reservation["reservation_id"]:
+            del self.starts[i], self.ends[i], self.items[i]
+
+    def prune(self, now: datetime) -> List[dict]:
+        """Удаление завершившихся броней"""
+        count = bisect_right(self.ends, now)
+        expired = self.items[:count]
+        del self.starts[:count], self.ends[:count], self.items[:count]
+        return expired
+
+class SpotGroup:
+    """Места одной группы (тип, парковка, зона) для поиска места под бронь.
+
+    Места с бронями упорядочены по рангу и проверяются по одному, а лучшее
+    место без броней берется с вершины кучи: для периода в будущем — любое,
+    для периода, который вот-вот начнется, — еще и свободное физически.
+    Кучи с ленивым удалением, как в SpotAllocator.
+    """
+
+    def __init__(self, order: List[int], scheduled: Callable[[int], bool]):
+        # Порядок мест, по которому построена группа: новый список — места перезагружены
+        self.order = order
+        self.scheduled: List[Tuple[tuple, int]] = []
+        self.unscheduled = FreeSpots()
+        self.free = FreeSpots()
+        ranks = parking_state.allocator.ranks
+        for spot_id in order:
+            i = parking_state.spot_index[spot_id]
+            if scheduled(i):
+                self.scheduled.append((ranks[i], i))
+            else:
+                self.unscheduled.push(ranks[i], i)
+                if not parking_state.occupied[i]:
+                    self.free.push(ranks[i], i)
+
+    def contains(self, key: tuple, i: int) -> bool:
+        spot_type, lot_id, zone_id = key
+        return parking_state.spot_types[i] == spot_type \
+            and (lot_id is None or parking_state.spot_lots[i] == lot_id) \
+            and (zone_id is None or parking_state.spot_zones[i] == zone_id)
+
+    def add_scheduled(self, i: int):
+        entry = (parking_state.allocator.ranks[i], i)
+        at = bisect_left(self.scheduled, entry)
+        if at == len(self.scheduled) or self.scheduled[at] != entry:
+            self.scheduled.insert(at, entry)
+
+    def remove_scheduled(self, i: int):
+        entry = (parking_state.allocator.ranks[i], i)
+        at = bisect_left(self.scheduled, entry)
+        if at < len(self.scheduled) and self.scheduled[at] == entry:
+            del self.scheduled[at]
+        self.unscheduled.push(entry[0], i)
+        self.free.push(entry[0], i)
+
+    def freed(self, i: int):
+        self.free.push(parking_state.allocator.ranks[i], i)
+
+class ReservationBook:
+    """Брони мест в памяти процесса.
+
+    Загружаются из коллекции reservations при старте (только текущие и
+    будущие) и обновляются при каждой записи, поэтому проверка брони при
+    заезде и поиск места, свободного на период, не обращаются к базе.
+    Одновременные брони одного места сериализуются: в процессе — блокировкой
+    места, между экземплярами — счетчиком reservation_rev в документе
+    места, который увеличивается условным обновлением перед записью брони.
+    Поиск места под бронь не перебирает все места группы (см. SpotGroup).
+    """
+
+    def __init__(self, lead_minutes: float = RESERVATION_LEAD_MINUTES):
+        self.lead = timedelta(minutes=lead_minutes)
+        self.schedules: Dict[int, SpotSchedule] = {}
+        self.reservations: Dict[str, dict] = {}
+        # Брони по ТС: заезд без номера места ищет бронь своего ТС
+        self.by_vehicle: Dict[str, Dict[str, dict]] = {}
+        # Последнее известное значение reservation_rev по местам
+        self.revisions: Dict[int, int] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._groups: Dict[tuple, SpotGroup] = {}
+
+    async def load(self, db):
+        now = datetime.now()
+        self.schedules = {}
+        self.reservations = {}
+        self.by_vehicle = {}
+        self._groups = {}
+        cursor = db.reservations.find({"status": {"$in": HOLDING}, "end": {"$gt": now}}, {"_id": 0})
+        async for reservation in cursor:
+            self._add(reservation)
+        self.revisions = {
+            spot["spot_id"]: spot["reservation_rev"]
+            async for spot in db.spots.find({"reservation_rev": {"$gt": 0}}, {"_id": 0, "spot_id": 1, "reservation_rev": 1})
+        }
+
+    async def _reload_spot(self, db, spot_id: int):
+        """Перечитывание броней места, измененных другим экземпляром"""
+        for reservation in list(self.schedules.get(spot_id, SpotSchedule()).items):
+            self._remove(reservation)
+        cursor = db.reservations.find(
+            {"spot_id": spot_id, "status": {"$in": HOLDING}, "end": {"$gt": datetime.now()}}, {"_id": 0}
+        )
+        async for reservation in cursor:
+            self._add(reservation)
+        spot = await db.spots.find_one({"spot_id": spot_id}, {"_id": 0, "reservation_rev": 1})
+        self.revisions[spot_id] = (spot or {}).get("reservation_rev", 0)
+
+    def _add(self, reservation: dict):
+        schedule = self.schedules.setdefault(reservation["spot_id"], SpotSchedule())
+        newly_scheduled = not schedule.items
+        for expired in schedule.prune(datetime.now()):
+            self._forget(expired)
+        schedule.add(reservation)
+        if newly_scheduled:
+            self._regroup(reservation["spot_id"], SpotGroup.add_scheduled)
+        self.reservations[reservation["reservation_id"]] = reservation
+        self.by_vehicle.setdefault(reservation["vehicle_id"], {})[reservation["reservation_id"]] = reservation
+
+    def _forget(self, reservation: dict):
+        self.reservations.pop(reservation["reservation_id"], None)
+        own = self.by_vehicle.get(reservation["vehicle_id"], {})
+        own.pop(reservation["reservation_id"], None)
+        if not own:
+            self.by_vehicle.pop(reservation["vehicle_id"], None)
+
+    def _remove(self, reservation: dict):
+        self._forget(reservation)
+        schedule = self.schedules.get(reservation["spot_id"])
+        if schedule is not None:
+            schedule.remove(reservation)
+            if not schedule.items:
+                self._regroup(reservation["spot_id"], SpotGroup.remove_scheduled)
+
+    def _regroup(self, spot_id: int, change: Callable[[SpotGroup, int], None]):
+        """Изменение места во всех построенных группах, в которые оно входит"""
+        i = parking_state.spot_index.get(spot_id)
+        if i is None:
+            return
+        for key, group in self._groups.items():
+            if group.contains(key, i):
+                change(group, i)
+
+    def spot_changed(self, message: dict, lot_ids: List[Optional[str]]):
+        """Подписчик изменений состояния парковки: освободившееся место снова подходит для ближайших броней"""
+        if message["type"] == "spot" and message["data"]["status"] == "free" and None in lot_ids:
+            self._regroup(message["data"]["spot_id"], SpotGroup.freed)
+
+    def _scheduled(self, i: int) -> bool:
+        schedule = self.schedules.get(parking_state.spot_ids[i])
+        return schedule is not None and bool(schedule.items)
+
+    def _group(self, key: tuple) -> SpotGroup:
+        order = parking_state.spots_in_order(*key)
+        group = self._groups.get(key)
+        if group is None or group.order is not order:
+            group = self._groups[key] = SpotGroup(order, self._scheduled)
+        return group
+
+    def overlapping(self, spot_id: int, start: datetime, end: datetime) -> List[dict]:
+        schedule = self.schedules.get(spot_id)
+        return schedule.overlapping(start, end) if schedule else []
+
+    def holding(self, spot_id: int, at: datetime) -> List[dict]:
+        """Брони, которые держат место на момент заезда: идущие или начинающиеся в ближайшие lead минут"""
+        return self.overlapping(spot_id, at, at + self.lead)
+
+    def current(self, vehicle_id: str, at: datetime) -> Optional[dict]:
+        """Активная бронь ТС, по которой оно может заехать сейчас"""
+        for reservation in self.by_vehicle.get(vehicle_id, {}).values():
+            if reservation["status"] == "active" and reservation["start"] - self.lead <= at < reservation["end"]:
+                return reservation
+        return None
+
+    def reservable(self, spot_id: int, start: datetime, end: datetime) -> bool:
+        """Место свободно от броней в [start, end), а если бронь вот-вот начнется — и физически"""
+        if self.overlapping(spot_id, start, end):
+            return False
+        i = parking_state.spot_index[spot_id]
+        return start - self.lead > datetime.now() or not (parking_state.occupied[i] or i in parking_state.allocator.claimed)
+
+    def find_spot(self, spot_type: str, start: datetime, end: datetime,
+                  lot_id: Optional[str] = None, zone_id: Optional[str] = None) -> Optional[int]:
+        """Лучшее место типа, свободное весь период (в порядке автоматического выбора мест).
+
+        Кандидат без броней берется с вершины кучи группы, а места с бронями
+        проверяются двоичным поиском, только пока стоят раньше кандидата:
+        O(k log r + log n), где k — места с бронями, стоящие раньше кандидата и не
+        подходящие на этот период; от общего числа мест поиск не зависит.
+        """
+        group = self._group((spot_type, lot_id, zone_id))
+        if start - self.lead > datetime.now():
+            candidate = group.unscheduled.peek(self._scheduled)
+        else:
+            # Бронь вот-вот начнется: подходит только место, свободное и сейчас
+            candidate = group.free.peek(lambda i: self._scheduled(i) or parking_state.occupied[i])
+            if candidate is not None and candidate[1] in parking_state.allocator.claimed:
+                # Место выбрано для заезда, который еще записывается: редкий случай, перебор по порядку
+                for spot_id in group.order:
+                    if self.reservable(spot_id, start, end):
+                        return spot_id
+                return None
+        for rank, i in group.scheduled:
+            if candidate is not None and rank > candidate[0]:
+                break
+            if self.reservable(parking_state.spot_ids[i], start, end):
+                return parking_state.spot_ids[i]
+        return None if candidate is None else parking_state.spot_ids[candidate[1]]
+
+    def find(self, spot_id: Optional[int] = None, lot_id: Optional[str] = None, vehicle_id: Optional[str] = None,
+             start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+        """Текущие и будущие брони с отбором по месту, парковке, ТС и пересечению с периодом"""
+        start, end = start or datetime.min, end or datetime.max
+        if spot_id is not None:
+            candidates = self.overlapping(spot_id, start, end)
+        else:
+            candidates = sorted(
+                (r for r in self.reservations.values() if r["start"] < end and r["end"] > start),
+                key=lambda r: (r["start"], r["spot_id"])
+            )
+        return [
+            r for r in candidates
+            if (lot_id is None or r["lot_id"] == lot_id) and (vehicle_id is None or r["vehicle_id"] == vehicle_id)
+        ]
+
+    async def create(self, db, spot_id: int, vehicle_id: str, is_ev: bool,
+                     start: datetime, end: datetime) -> Optional[dict]:
+        """Бронь места на период; None, если место уже забронировано или занято"""
+        async with self._locks.setdefault(spot_id, asyncio.Lock()):
+            for _ in range(RESERVATION_ATTEMPTS):
+                if not self.reservable(spot_id, start, end):
+                    return None
+                revision = self.revisions.get(spot_id, 0)
+                # Счетчик, не изменившийся с последнего чтения, значит, что других броней места нет
+                updated = await db.spots.update_one(
+                    {"spot_id": spot_id, "reservation_rev": {"$in": [revision, None]} if revision == 0 else revision},
+                    {"$inc": {"reservation_rev": 1}}
+                )
+                if updated.modified_count:
+                    break
+                await self._reload_spot(db, spot_id)
+            else:
+                return None
+            self.revisions[spot_id] = revision + 1
+            reservation = {
+                "reservation_id": str(ObjectId()),
+                "spot_id": spot_id,
+                "lot_id": parking_state.spot_lot(spot_id),
+                "zone_id": parking_state.spot_zone(spot_id),
+                "vehicle_id": vehicle_id,
+                "isEv": is_ev,
+                "start": start,
+                "end": end,
+                "status": "active",
+                "created_at": datetime.now()
+            }
+            await db.reservations.insert_one(dict(reservation))
+            self._add(reservation)
+            return reservation
+
+    async def cancel(self, db, reservation_id: str) -> Optional[dict]:
+        """Отмена брони, по которой еще не заехали; None, если такой брони нет"""
+        reservation = await db.reservations.find_one_and_update(
+            {"reservation_id": reservation_id, "status": "active"},
+            {"$set": {"status": "cancelled"}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if reservation is not None:
+            self._remove(reservation)
+        return reservation
+
+    async def fulfil(self, db, reservations: List[dict]):
+        """Отметка броней, по которым ТС заехало; место остается за ним до конца брони"""
+        ids = [r["reservation_id"] for r in reservations if r["status"] == "active"]
+        if not ids:
+            return
+        for reservation in reservations:
+            reservation["status"] = "fulfilled"
+        await db.reservations.update_many({"reservation_id": {"$in": ids}}, {"$set": {"status": "fulfilled"}})
+
+    def sync(self, reservation: dict):
+        """Применение брони из базы (изменение другим экземпляром сервиса)"""
+        known = self.reservations.get(reservation["reservation_id"])
+        if known is not None:
+            self._remove(known)
+        if reservation["status"] in HOLDING and reservation["end"] > datetime.now():
+            self._add({key: value for key, value in reservation.items() if key != "_id"})
+
+reservation_book = ReservationBook()
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from database import LOAD_HISTORY_TTL_DAYS, PARKING_HISTORY_TTL_DAYS
+import asyncio
+import logging
+import os
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Период проверки завершенных суток для архивации (секунды)
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_DELAY = timedelta(hours=1)
+
+class ArchiveJob:
+    """Архивация сырой истории в агрегаты до ее удаления по TTL.
+
+    Агрегаты обновляются при каждом событии, но отдельные обновления могут
+    потеряться (ошибка записи, остановка процесса). Поэтому каждые
+    завершенные сутки, пока сырая история еще хранится, один раз
+    пересобираются из нее целиком: после удаления сырых данных часовые и
+    суточные агрегаты остаются точными. Отметка последних обработанных
+    суток хранится в коллекции retention_state.
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL):
+        self.interval = interval
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def archive(self, now: datetime = None) -> int:
+        """Пересборка агрегатов за завершенные необработанные сутки; возвращает их число"""
+        # Сутки считаются завершенными с запасом на запоздавшую запись тиков загруженности
+        today = rollups.bucket_start((now or datetime.now()) - ARCHIVE_DELAY, "1d")
+        state = await self.db.retention_state.find_one({"_id": "rollups"})
+        day = state["archived_until"] if state else today - timedelta(days=1)
+        # Сутки, сырые данные которых уже начали удаляться, пересобрать точно нельзя
+        ttls = [days for days in (LOAD_HISTORY_TTL_DAYS, PARKING_HISTORY_TTL_DAYS) if days]
+        if ttls:
+            day = max(day, today - timedelta(days=min(ttls) - 1))
+
+        archived = 0
+        while day < today:
+            await rollups.rebuild(self.db, day, day + timedelta(days=1))
+            day += timedelta(days=1)
+            archived += 1
+            await self.db.retention_state.update_one(
+                {"_id": "rollups"}, {"$set": {"archived_until": day}}, upsert=True
+            )
+        return archived
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                archived = await self.archive()
+                if archived:
+                    logger.info(f"Агрегаты пересобраны из сырой истории за {archived} сут.")
+            except Exception as e:
+                logger.error(f"Не удалось архивировать историю: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, db):
+        self.db = db
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+archive_job = ArchiveJob()
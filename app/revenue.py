@@ -0,0 +1,27 @@
+from typing import Dict, Optional
+
+class RevenueCounter:
+    """Накопленная выручка по парковкам.
+
+    Загружается при старте из хранилища (у MongoDB — из суточных агрегатов,
+    которые хранятся бессрочно, у встроенных хранилищ — из истории стоянок)
+    и увеличивается при каждом выезде, поэтому общая выручка отдается без
+    обращения к базе.
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+
+    async def load(self, storage):
+        self.totals = await storage.total_revenue()
+
+    def add(self, lot_id: str, cost: float):
+        self.totals[lot_id] = self.totals.get(lot_id, 0) + cost
+
+    def total(self, lot_id: Optional[str] = None) -> float:
+        """Выручка парковки или всех парковок"""
+        if lot_id is None:
+            return round(sum(self.totals.values()), 2)
+        return round(self.totals.get(lot_id, 0), 2)
+
+revenue_counter = RevenueCounter()
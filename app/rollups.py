@@ -0,0 +1,241 @@
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+from typing import Dict, List, Optional, Tuple
+from layout import ALL_LOTS, DEFAULT_LOT_ID
+import os
+
+# Интервалы агрегации и их длительность в секундах
+INTERVALS = {
+    "10s": 10,
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Параметры $dateTrunc для пересборки агрегатов из сырых данных
+DATE_TRUNC = {
+    "10s": {"unit": "second", "binSize": 10},
+    "1m": {"unit": "minute", "binSize": 1},
+    "5m": {"unit": "minute", "binSize": 5},
+    "15m": {"unit": "minute", "binSize": 15},
+    "1h": {"unit": "hour", "binSize": 1},
+    "1d": {"unit": "day", "binSize": 1},
+}
+
+def _retention(value: str) -> Dict[str, int]:
+    """Разбор ROLLUP_RETENTION_DAYS вида "10s=1,1m=7" поверх значений по умолчанию"""
+    retention = {"10s": 2, "1m": 7, "5m": 31, "15m": 31, "1h": 400, "1d": 0}
+    for item in filter(None, value.split(",")):
+        interval, days = item.split("=")
+        if interval.strip() not in INTERVALS:
+            raise ValueError(f"Неизвестный интервал в ROLLUP_RETENTION_DAYS: {interval}")
+        retention[interval.strip()] = int(days)
+    return retention
+
+# Срок хранения агрегатов каждого интервала в днях (0 — бессрочно)
+RETENTION_DAYS = _retention(os.getenv("ROLLUP_RETENTION_DAYS", ""))
+
+def floor_time(dt: datetime, step: int) -> datetime:
+    """Округление вниз до шага в секундах (шаг должен делить сутки)"""
+    seconds_in_day = dt.hour * 3600 + dt.minute * 60 + dt.second
+    return dt.replace(microsecond=0) - timedelta(seconds=seconds_in_day % step)
+
+def bucket_start(dt: datetime, interval: str) -> datetime:
+    """Начало интервала, в который попадает временная метка"""
+    return floor_time(dt, INTERVALS[interval])
+
+def _expiry(bucket: datetime, interval: str) -> dict:
+    """Срок удаления агрегата для TTL-индекса; бессрочные агрегаты его не получают"""
+    days = RETENTION_DAYS[interval]
+    return {"$setOnInsert": {"expires_at": bucket + timedelta(days=days)}} if days else {}
+
+def _expiry_expr(bucket: str, interval: str) -> dict:
+    """То же выражением агрегации для пересборки"""
+    days = RETENTION_DAYS[interval]
+    if not days:
+        return {}
+    return {"expires_at": {"$dateAdd": {"startDate": bucket, "unit": "day", "amount": days}}}
+
+async def create_indexes(db):
+    # Агрегаты, созданные до появления нескольких парковок, относятся ко всем парковкам
+    await db.stats_rollups.update_many({"lot_id": {"$exists": False}}, {"$set": {"lot_id": ALL_LOTS}})
+    try:
+        await db.stats_rollups.drop_index("interval_1_bucket_1")
+    except OperationFailure:
+        pass
+    await db.stats_rollups.create_index(
+        [("lot_id", ASCENDING), ("interval", ASCENDING), ("bucket", ASCENDING)],
+        unique=True
+    )
+    # Агрегаты мелких интервалов удаляются по сроку хранения, крупные остаются дольше
+    for interval in INTERVALS:
+        await db.stats_rollups.update_many(
+            {"interval": interval, "expires_at": {"$exists": not RETENTION_DAYS[interval]}},
+            [{"$set": _expiry_expr("$bucket", interval)}] if RETENTION_DAYS[interval]
+            else {"$unset": {"expires_at": ""}}
+        )
+    await db.stats_rollups.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+def load_ops(timestamp: datetime, lot_id: str, samples: int, occupied_sum: float, load_sum: float) -> List[UpdateOne]:
+    """Операции учета замеров загруженности парковки во всех интервалах"""
+    ops = []
+    for interval in INTERVALS:
+        bucket = bucket_start(timestamp, interval)
+        ops.append(UpdateOne(
+            {"lot_id": lot_id, "interval": interval, "bucket": bucket},
+            {
+                "$inc": {
+                    "load_count": samples,
+                    "occupied_sum": occupied_sum,
+                    "load_sum": load_sum
+                },
+                **_expiry(bucket, interval)
+            },
+            upsert=True
+        ))
+    return ops
+
+def departure_ops(exit_time: datetime, lot_id: str, cost: float, duration: float) -> List[UpdateOne]:
+    """Операции учета выезда (выручка и время стоянки) во всех интервалах парковки и общих"""
+    ops = []
+    for interval in INTERVALS:
+        bucket = bucket_start(exit_time, interval)
+        for lot in (lot_id, ALL_LOTS):
+            ops.append(UpdateOne(
+                {"lot_id": lot, "interval": interval, "bucket": bucket},
+                {
+                    "$inc": {"departures": 1, "revenue": cost, "duration_sum": duration},
+                    "$min": {"duration_min": duration},
+                    "$max": {"duration_max": duration},
+                    **_expiry(bucket, interval)
+                },
+                upsert=True
+            ))
+    return ops
+
+def revenue_ops(changes: List[Tuple[datetime, str, float]]) -> List[UpdateOne]:
+    """Поправки выручки после пересчета стоимости: (время выезда, парковка, разница).
+
+    Поправки суммируются по агрегатам; удаленные по сроку хранения агрегаты не создаются заново.
+    """
+    deltas: Dict[Tuple[str, str, datetime], float] = {}
+    for exit_time, lot_id, delta in changes:
+        for interval in INTERVALS:
+            bucket = bucket_start(exit_time, interval)
+            for lot in (lot_id, ALL_LOTS):
+                deltas[(lot, interval, bucket)] = deltas.get((lot, interval, bucket), 0) + delta
+    return [
+        UpdateOne({"lot_id": lot, "interval": interval, "bucket": bucket}, {"$inc": {"revenue": delta}})
+        for (lot, interval, bucket), delta in deltas.items()
+    ]
+
+async def apply(db, ops: List[UpdateOne]):
+    """Применение накопленных операций одним запросом"""
+    if ops:
+        await db.stats_rollups.bulk_write(ops, ordered=False)
+
+async def record_departure(db, exit_time: datetime, lot_id: str, cost: float, duration: float):
+    """Учет выезда (выручка и время стоянки) во всех интервалах одним запросом"""
+    await apply(db, departure_ops(exit_time, lot_id, cost, duration))
+
+async def read(db, start_time: datetime, end_time: datetime, interval: str,
+               lot_id: str = ALL_LOTS) -> Dict[datetime, dict]:
+    """Агрегаты за период, ключ — начало интервала"""
+    cursor = db.stats_rollups.find(
+        {
+            "lot_id": lot_id,
+            "interval": interval,
+            "bucket": {"$gte": bucket_start(start_time, interval), "$lte": end_time}
+        },
+        {"_id": 0, "lot_id": 0, "interval": 0}
+    )
+    return {doc["bucket"]: doc async for doc in cursor}
+
+async def rebuild(db, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Пересборка агрегатов из parking_load_history и parking_history.
+
+    Без границ пересобирается все; с границами — только интервалы внутри
+    [start, end), поэтому границы должны быть выровнены по суткам.
+    """
+    window = {}
+    if start is not None:
+        window = {"$gte": start, "$lt": end}
+        await db.stats_rollups.delete_many({"bucket": window})
+    else:
+        await db.stats_rollups.delete_many({})
+    load_match = [{"$match": {"timestamp": window}}] if window else []
+    history_match = [{"$match": {"exit_time": window}}] if window else []
+    for interval, trunc in DATE_TRUNC.items():
+        merge = {
+            "$merge": {
+                "into": "stats_rollups",
+                "on": ["lot_id", "interval", "bucket"],
+                "whenMatched": "merge",
+                "whenNotMatched": "insert"
+            }
+        }
+        await (await db.parking_load_history.aggregate(load_match + [
+            # Замеры, объединенные по тикам, учитываются с весом числа исходных замеров
+            {"$set": {"samples": {"$ifNull": ["$samples", 1]}}},
+            {"$group": {
+                # Замеры без lot_id записаны до появления нескольких парковок и относятся ко всем
+                "_id": {
+                    "lot_id": {"$ifNull": ["$lot_id", ALL_LOTS]},
+                    "bucket": {"$dateTrunc": {"date": "$timestamp", **trunc}}
+                },
+                "load_count": {"$sum": "$samples"},
+                "occupied_sum": {"$sum": {"$multiply": ["$occupied_spots", "$samples"]}},
+                "load_sum": {"$sum": {"$multiply": ["$load_percentage", "$samples"]}}
+            }},
+            {"$project": {
+                "_id": 0,
+                "lot_id": "$_id.lot_id",
+                "interval": interval,
+                "bucket": "$_id.bucket",
+                "load_count": 1,
+                "occupied_sum": 1,
+                "load_sum": 1,
+                **_expiry_expr("$_id.bucket", interval)
+            }},
+            merge
+        ])).to_list()
+        # Выезды учитываются и по своей парковке, и в общих агрегатах
+        for lot_key in ({"$ifNull": ["$lot_id", DEFAULT_LOT_ID]}, {"$literal": ALL_LOTS}):
+            await (await db.parking_history.aggregate(history_match + [
+                {"$group": {
+                    "_id": {
+                        "lot_id": lot_key,
+                        "bucket": {"$dateTrunc": {"date": "$exit_time", **trunc}}
+                    },
+                    "departures": {"$sum": 1},
+                    "revenue": {"$sum": "$cost"},
+                    "duration_sum": {"$sum": "$duration_minutes"},
+                    "duration_min": {"$min": "$duration_minutes"},
+                    "duration_max": {"$max": "$duration_minutes"}
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "lot_id": "$_id.lot_id",
+                    "interval": interval,
+                    "bucket": "$_id.bucket",
+                    "departures": 1,
+                    "revenue": 1,
+                    "duration_sum": 1,
+                    "duration_min": 1,
+                    "duration_max": 1,
+                    **_expiry_expr("$_id.bucket", interval)
+                }},
+                merge
+            ])).to_list()
+
+async def ensure_built(db):
+    """Первичное построение агрегатов, если они еще не создавались"""
+    # Суточные агрегаты появились позже остальных: без них пересобираем все
+    if await db.stats_rollups.count_documents({"interval": "1d"}, limit=1) > 0:
+        return
+    if await db.parking_load_history.estimated_document_count() > 0 \
+            or await db.parking_history.estimated_document_count() > 0:
+        await rebuild(db)
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Размер страницы по умолчанию и наибольший допустимый
+SESSIONS_PAGE_SIZE = 100
+SESSIONS_MAX_PAGE_SIZE = 1000
+
+FIELDS = {"vehicle_id": 1, "vehicle_type": 1, "spot_id": 1, "lot_id": 1,
+          "entry_time": 1, "exit_time": 1, "duration_minutes": 1, "cost": 1}
+
+EPOCH = datetime(1970, 1, 1)
+# Длительность в истории округлена до 0.1 минуты
+DURATION_MARGIN = timedelta(minutes=1)
+
+def encode_cursor(doc: dict) -> str:
+    """Курсор страницы: время выезда (мс) и _id последней записи"""
+    return f"{(doc['exit_time'] - EPOCH) // timedelta(milliseconds=1)}-{doc['_id']}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        ms, _, oid = cursor.partition("-")
+        return EPOCH + timedelta(milliseconds=int(ms)), ObjectId(oid)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Неверный курсор: {cursor}")
+
+def _after(cursor: Optional[str], direction: int) -> dict:
+    """Условие продолжения после курсора в порядке (exit_time, _id)"""
+    if cursor is None:
+        return {}
+    exit_time, oid = decode_cursor(cursor)
+    op = "$gt" if direction > 0 else "$lt"
+    return {"$or": [{"exit_time": {op: exit_time}}, {"exit_time": exit_time, "_id": {op: oid}}]}
+
+async def _page(db, query: dict, direction: int, limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Страница истории и курсор следующей; лишняя запись показывает, есть ли продолжение"""
+    docs = await db.parking_history.find(query, {"_id": 1, **FIELDS}).sort(
+        [("exit_time", direction), ("_id", direction)]
+    ).limit(limit + 1).to_list()
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+    for doc in docs:
+        del doc["_id"]
+    return docs, next_cursor
+
+async def longest_session(db) -> timedelta:
+    """Наибольшая длительность завершенной стоянки (по индексу duration_minutes)"""
+    doc = await db.parking_history.find_one({}, {"_id": 0, "duration_minutes": 1}, sort=[("duration_minutes", -1)])
+    return timedelta(minutes=doc["duration_minutes"] if doc else 0) + DURATION_MARGIN
+
+async def at(db, ts: datetime, match: dict, cursor: Optional[str] = None,
+             limit: int = SESSIONS_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """Завершенные стоянки, шедшие в момент ts: entry_time <= ts < exit_time.
+
+    Стоянка не длиннее самой длинной в истории, поэтому ее выезд лежит в
+    (ts, ts + наибольшая длительность] — это диапазон индекса
+    (exit_time, _id, entry_time), а entry_time проверяется по ключам индекса
+    без чтения документов. Страницы идут по времени выезда.
+    """
+    query = {
+        "exit_time": {"$gt": ts, "$lte": ts + await longest_session(db)},
+        "entry_time": {"$lte": ts},
+        **match,
+        **_after(cursor, 1)
+    }
+    return await _page(db, query, 1, limit)
+
+async def of_vehicle(db, vehicle_id: str, cursor: Optional[str] = None,
+                     limit: int = SESSIONS_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """Завершенные стоянки ТС, начиная с последней (индекс vehicle_id, exit_time, _id)"""
+    return await _page(db, {"vehicle_id": vehicle_id, **_after(cursor, -1)}, -1, limit)
@@ -0,0 +1,136 @@
+from typing import Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторным прогревом после ошибки (секунды)
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+# Пути, которые отвечают 503 до окончания прогрева: без загруженного состояния их ответы неверны
+GATED_PREFIXES = ("/api/", "/ws")
+
+class Warmup:
+    """Прогрев сервиса в фоне после старта процесса.
+
+    Процесс начинает принимать соединения сразу (/healthz отвечает 200),
+    а подключение к хранилищу, индексы и загрузка состояния идут в фоновой
+    задаче. Пока она не завершилась, /readyz и запросы к API отвечают 503,
+    поэтому балансировщик не отправляет трафик на непрогретый экземпляр.
+    При ошибке (например, недоступна MongoDB) прогрев повторяется через
+    STARTUP_RETRY_INTERVAL секунд, а процесс не падает.
+    """
+
+    def __init__(self, retry_interval: float = STARTUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self.ready = False
+        self.attempts = 0
+        self.error: Optional[str] = None
+        # Длительность этапов последней попытки и всего старта (секунды)
+        self.phases: Dict[str, float] = {}
+        self.seconds: Optional[float] = None
+        self._started = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def phase(self, name: str, step: Awaitable):
+        """Выполнение этапа прогрева с замером его длительности"""
+        started = time.perf_counter()
+        result = await step
+        self.phases[name] = round(time.perf_counter() - started, 4)
+        metrics.STARTUP_PHASE.labels(name).set(self.phases[name])
+        return result
+
+    async def parallel(self, *steps: Awaitable):
+        """Параллельные этапы; при ошибке одного остальные отменяются, чтобы не мешать повторной попытке"""
+        tasks = [asyncio.ensure_future(step) for step in steps]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _run(self, steps: Callable[["Warmup"], Awaitable]):
+        while not self._stopping.is_set():
+            self.attempts += 1
+            self.phases = {}
+            try:
+                await steps(self)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                logger.error(f"Прогрев не удался (попытка {self.attempts}): {self.error}")
+            else:
+                self.error = None
+                self.seconds = round(time.perf_counter() - self._started, 4)
+                metrics.STARTUP_PHASE.labels("total").set(self.seconds)
+                self.ready = True
+                logger.info(f"Сервис готов за {self.seconds} с: {self.phases}")
+                return
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, steps: Callable[["Warmup"], Awaitable]):
+        """Запуск прогрева; steps(warmup) выполняет этапы через warmup.phase"""
+        self.ready = False
+        self.attempts = 0
+        self._started = time.perf_counter()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(steps))
+
+    async def stop(self):
+        """Остановка при завершении процесса; незаконченный прогрев прерывается"""
+        if self._task:
+            self._stopping.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "startup_seconds": self.seconds,
+            "phases": self.phases,
+            "error": self.error
+        }
+
+warmup = Warmup()
+
+class ReadinessMiddleware:
+    """ASGI-middleware, отвечающее 503 на запросы к API и WebSocket до окончания прогрева"""
+
+    def __init__(self, app, state: Warmup = warmup):
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send):
+        if self.state.ready or scope["type"] not in ("http", "websocket") \
+                or not scope["path"].startswith(GATED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            # 1013 Try Again Later
+            await send({"type": "websocket.close", "code": 1013})
+            return
+        body = json.dumps({"detail": "Сервис запускается"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, round(self.state.retry_interval))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
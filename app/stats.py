@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from layout import ALL_LOTS
+from database import MONGO_CURSOR_BATCH_SIZE
+import os
+import rollups
+
+# Длительность поддерживаемых диапазонов статистики
+TIME_RANGES = {
+    "1m": timedelta(minutes=1),
+    "10m": timedelta(minutes=10),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+
+# Максимальное число точек ряда; при превышении интервал укрупняется
+STATS_MAX_POINTS = int(os.getenv("STATS_MAX_POINTS", "10000"))
+
+# Формат подписи интервала
+LABEL_FORMATS = {
+    "10s": "%Y-%m-%d %H:%M:%S",
+    "1m": "%Y-%m-%d %H:%M",
+    "5m": "%Y-%m-%d %H:%M",
+    "15m": "%Y-%m-%d %H:%M",
+    "1h": "%Y-%m-%d %H:00",
+    "1d": "%Y-%m-%d",
+}
+
+def _ratio(total: str, count: str, places: int = 2) -> dict:
+    """Среднее по агрегату с нулем для пустых интервалов"""
+    return {"$cond": [
+        {"$gt": [{"$ifNull": [count, 0]}, 0]},
+        {"$round": [{"$divide": [total, count]}, places]},
+        0
+    ]}
+
+def _rounded(field: str, places: int = 2) -> dict:
+    return {"$round": [{"$ifNull": [field, 0]}, places]}
+
+# Поля ответа каждого вида статистики, вычисляемые из документов stats_rollups
+METRICS = {
+    "vehicles": {
+        "count": {"$ifNull": ["$load_count", 0]},
+        "occupied_spots": _ratio("$occupied_sum", "$load_count"),
+        "load_percentage": _ratio("$load_sum", "$load_count"),
+    },
+    "revenue": {
+        "revenue": _rounded("$revenue"),
+        "count": {"$ifNull": ["$departures", 0]},
+    },
+    "duration": {
+        "avg_duration": _ratio("$duration_sum", "$departures"),
+        "min_duration": _rounded("$duration_min"),
+        "max_duration": _rounded("$duration_max"),
+        "count": {"$ifNull": ["$departures", 0]},
+    },
+}
+
+def resolve_interval(time_range: str, interval: str) -> str:
+    """Самый мелкий интервал не мельче запрошенного, агрегаты которого хранятся
+    весь диапазон и дают не больше STATS_MAX_POINTS точек"""
+    span = TIME_RANGES[time_range].total_seconds()
+    candidates = [name for name, step in rollups.INTERVALS.items() if step >= rollups.INTERVALS[interval]]
+    for name in candidates:
+        retention = rollups.RETENTION_DAYS[name]
+        if (not retention or retention * 86400 >= span) and span / rollups.INTERVALS[name] <= STATS_MAX_POINTS:
+            return name
+    return candidates[-1]
+
+def time_bounds(time_range: str, interval: str, end_time: datetime = None):
+    """Границы запроса, выровненные по интервалам: [первый интервал, следующий за последним)"""
+    end_time = end_time or datetime.now()
+    step = timedelta(seconds=rollups.INTERVALS[interval])
+    start = rollups.bucket_start(end_time - TIME_RANGES[time_range], interval)
+    end = rollups.bucket_start(end_time, interval) + step
+    return start, end
+
+def build_pipeline(metric: str, interval: str, start: datetime, end: datetime,
+                   lot_id: str = ALL_LOTS) -> List[dict]:
+    """Группировка, заполнение пропусков и форматирование выполняются на стороне MongoDB"""
+    trunc = rollups.DATE_TRUNC[interval]
+    return [
+        {"$match": {"lot_id": lot_id, "interval": interval, "bucket": {"$gte": start, "$lt": end}}},
+        # Пустые интервалы досоздаются сервером, а не циклом в Python
+        {"$densify": {
+            "field": "bucket",
+            "range": {"step": trunc["binSize"], "unit": trunc["unit"], "bounds": [start, end]}
+        }},
+        {"$sort": {"bucket": 1}},
+        {"$project": {
+            "_id": 0,
+            "timestamp": {"$dateToString": {"format": LABEL_FORMATS[interval], "date": "$bucket"}},
+            **METRICS[metric]
+        }},
+    ]
+
+async def time_series(db, metric: str, time_range: str, interval: str,
+                      lot_id: str = ALL_LOTS) -> Tuple[str, List[dict]]:
+    """Временной ряд статистики парковки (или всех парковок) за диапазон.
+
+    Для длинных диапазонов интервал укрупняется до уровня агрегатов, которые
+    хранятся весь диапазон; возвращается фактический интервал и ряд.
+    """
+    interval = resolve_interval(time_range, interval)
+    start, end = time_bounds(time_range, interval)
+    cursor = await db.stats_rollups.aggregate(
+        build_pipeline(metric, interval, start, end, lot_id), batchSize=MONGO_CURSOR_BATCH_SIZE
+    )
+    return interval, await cursor.to_list()
@@ -0,0 +1,853 @@
+"""Хранилище мест, ТС, истории стоянок и истории загруженности.
+
+Заезды, выезды и пакеты событий записываются через parking_storage, а не
+напрямую в коллекции MongoDB. Реализация выбирается переменной
+STORAGE_BACKEND:
+
+    mongo   — MongoDB (по умолчанию), все возможности сервиса;
+    sqlite  — встроенная база SQLite в файле SQLITE_PATH (режим WAL),
+              для небольших парковок без отдельного сервера базы;
+    memory  — состояние только в памяти процесса (тесты, демонстрация),
+              теряется при перезапуске.
+
+Общая выручка и /api/stats (заезды по часам) читаются через хранилище и
+работают со всеми реализациями. Статистика по интервалам, агрегаты, журнал
+событий, брони, синхронизация экземпляров и выгрузки работают с MongoDB
+напрямую и доступны только при mongo: у встроенных хранилищ атрибут db
+равен None.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database import (get_db, connect_db, close_db, create_unique_indexes, run_in_transaction,
+                      MONGO_CURSOR_BATCH_SIZE)
+from occupancy import SPOT_FIELDS, VEHICLE_FIELDS
+import asyncio
+import copy
+import json
+import layout
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+# Файл базы SQLite
+SQLITE_PATH = os.getenv("SQLITE_PATH", "parking.db")
+# NORMAL в режиме WAL не ждет записи на диск при каждой фиксации (только при
+# контрольных точках): после сбоя питания теряются последние транзакции, но база цела
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+# Ошибки записи, по которым API возвращает 4xx
+class VehicleNotFound(LookupError):
+    pass
+
+class VehicleAlreadyPaid(Exception):
+    pass
+
+class VehicleAlreadyParked(Exception):
+    pass
+
+class StateConflict(Exception):
+    """Пакет не согласуется с хранилищем: его изменил параллельный запрос"""
+
+SPOTS_CHANGED = "Состояние мест изменилось во время обработки пакета"
+VEHICLE_REGISTERED = "Транспортное средство из пакета уже зарегистрировано параллельным запросом"
+
+# Изменение из пакета событий: ("arrive", запись ТС) или ("depart", запись ТС, запись истории)
+Change = Tuple
+
+class Storage(ABC):
+    """Операции хранилища, которые выполняются при заездах и выездах.
+
+    Хранилище без какой-либо из операций не создается (TypeError при создании).
+    """
+
+    name = ""
+    # База MongoDB для остальных возможностей сервиса
+    db = None
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def load_layout(self) -> List[dict]:
+        """Описание парковок: из файла PARKING_LAYOUT, сохраненное или по умолчанию"""
+
+    @abstractmethod
+    async def init_spots(self, spots: List[dict]):
+        """Добавление отсутствующих мест; существующие места не изменяются"""
+
+    @abstractmethod
+    async def update_lot(self, lot_id: str, fields: dict):
+        """Изменение полей описания парковки"""
+
+    @abstractmethod
+    async def fetch_state(self) -> Tuple[List[dict], List[dict], List[dict]]:
+        """Парковки, места (по номеру) и ТС на парковке для состояния в памяти"""
+
+    @abstractmethod
+    async def spot_exists(self, spot_id: int) -> bool:
+        """Есть ли место с таким номером"""
+
+    @abstractmethod
+    async def occupy(self, vehicle: dict) -> bool:
+        """Занятие свободного места и запись ТС; False, если место занято или не существует.
+
+        VehicleAlreadyParked, если у ТС уже есть активная запись (место при этом не занимается).
+        """
+
+    @abstractmethod
+    async def depart(self, vehicle_id: str, exit_time: datetime,
+                     close: Callable[[dict], dict]) -> Tuple[dict, dict]:
+        """Закрытие активной записи ТС, запись истории и освобождение места.
+
+        close(запись ТС) возвращает запись истории со стоимостью. Возвращает
+        запись ТС и запись истории; VehicleNotFound или VehicleAlreadyPaid,
+        если активной записи нет.
+        """
+
+    @abstractmethod
+    async def apply_batch(self, changes: List[Change]):
+        """Запись изменений пакета целиком или никак; StateConflict, если пакет устарел"""
+
+    @abstractmethod
+    async def insert_load(self, documents: List[dict]):
+        """Запись замеров загруженности"""
+
+    @abstractmethod
+    async def reset(self):
+        """Удаление мест и записей ТС (история сохраняется)"""
+
+    @abstractmethod
+    async def total_revenue(self) -> Dict[str, float]:
+        """Накопленная выручка по парковкам"""
+
+    @abstractmethod
+    async def arrivals_by_hour(self, start: datetime, lot_id: Optional[str] = None) -> List[dict]:
+        """Заезды с момента start по часу заезда: hour, vehicles, revenue (по возрастанию часа)"""
+
+class MongoStorage(Storage):
+    name = "mongo"
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        # Без явно переданной базы клиент создается при первом обращении, а не при импорте
+        if self._db is None:
+            self._db = get_db()
+        return self._db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+
+    async def connect(self):
+        """Проверка подключения и уникальные индексы; индексы выборок создаются при прогреве"""
+        await connect_db(self.db.client)
+        await create_unique_indexes(self.db)
+
+    async def close(self):
+        await close_db(self._db.client if self._db is not None else None)
+
+    async def load_layout(self) -> List[dict]:
+        return await layout.load_layout(self.db)
+
+    async def init_spots(self, spots: List[dict]):
+        if await self.db.spots.count_documents({}) < len(spots):
+            try:
+                # Одна неупорядоченная пакетная вставка; уже существующие места
+                # отсекаются уникальным индексом по spot_id
+                await self.db.spots.insert_many([dict(spot) for spot in spots], ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+
+        # Места, созданные до появления нескольких парковок, привязываем к парковке и зоне
+        if await self.db.spots.count_documents({"lot_id": {"$exists": False}}, limit=1):
+            await self.db.spots.bulk_write([
+                UpdateOne(
+                    {"spot_id": spot["spot_id"], "lot_id": {"$exists": False}},
+                    {"$set": {"lot_id": spot["lot_id"], "zone_id": spot["zone_id"]}}
+                ) for spot in spots
+            ], ordered=False)
+
+    async def update_lot(self, lot_id: str, fields: dict):
+        await self.db.lots.update_one({"lot_id": lot_id}, {"$set": fields})
+
+    async def fetch_state(self):
+        lots = await self.db.lots.find({}, {"_id": 0}).sort("_id", 1).to_list()
+        spots = await self.db.spots.find({}, SPOT_FIELDS).sort("spot_id", 1).batch_size(MONGO_CURSOR_BATCH_SIZE).to_list()
+        vehicles = await self.db.vehicles.find({"exit_time": None}, VEHICLE_FIELDS).batch_size(MONGO_CURSOR_BATCH_SIZE).to_list()
+        return lots, spots, vehicles
+
+    async def spot_exists(self, spot_id: int) -> bool:
+        return await self.db.spots.find_one({"spot_id": spot_id}, {"_id": 1}) is not None
+
+    @staticmethod
+    async def _run_writes(writes, session):
+        """Выполнение независимых записей: параллельно или последовательно внутри транзакции"""
+        if session is None:
+            await asyncio.gather(*writes)
+        else:
+            # Операции одной транзакции выполняются последовательно
+            for write in writes:
+                await write
+
+    async def occupy(self, vehicle: dict) -> bool:
+        async def occupy_spot(session):
+            # Занимаем место только если оно свободно, поэтому два одновременных
+            # заезда на одно место не могут пройти оба
+            spot = await self.db.spots.find_one_and_update(
+                {"spot_id": vehicle["spot_id"], "status": "free"},
+                {"$set": {"current_vehicle": vehicle["id"], "status": "occupied"}},
+                projection={"_id": 1},
+                session=session
+            )
+            if not spot:
+                return False
+
+            # Уникальный индекс по активным записям не даст поставить ТС дважды
+            try:
+                await self.db.vehicles.insert_one(vehicle, session=session)
+            except BaseException as e:
+                if session is None:
+                    # Без транзакции откатываем вручную при любой ошибке (сеть, таймаут, дубль)
+                    await self._undo_occupy(vehicle)
+                if isinstance(e, DuplicateKeyError):
+                    raise VehicleAlreadyParked(vehicle["id"])
+                raise
+            return True
+
+        return await run_in_transaction(occupy_spot)
+
+    async def _undo_occupy(self, vehicle: dict):
+        """Откат заезда без транзакции: запись ТС удаляется, если вставка все же прошла, место освобождается"""
+        try:
+            # insert_one проставляет _id до отправки, поэтому запись находится, даже если ответ не пришел
+            if "_id" in vehicle:
+                await self.db.vehicles.delete_one({"_id": vehicle["_id"]})
+            await self.db.spots.update_one(
+                {"spot_id": vehicle["spot_id"], "current_vehicle": vehicle["id"]},
+                {"$set": {"status": "free", "current_vehicle": None}}
+            )
+        except Exception as e:
+            logger.error(f"Не удалось откатить заезд {vehicle['id']}: {e}")
+
+    async def depart(self, vehicle_id: str, exit_time: datetime, close: Callable[[dict], dict]):
+        async def release_spot(session):
+            # Закрываем только активную запись: повторный выезд не пройдет
+            vehicle = await self.db.vehicles.find_one_and_update(
+                {"id": vehicle_id, "paid": False},
+                {"$set": {"exit_time": exit_time, "paid": True}},
+                session=session
+            )
+            if not vehicle:
+                if not await self.db.vehicles.find_one({"id": vehicle_id}, {"_id": 1}, session=session):
+                    raise VehicleNotFound(vehicle_id)
+                raise VehicleAlreadyPaid(vehicle_id)
+
+            history_entry = close(vehicle)
+            # Записи в разные коллекции независимы
+            await self._run_writes([
+                self.db.parking_history.insert_one(history_entry, session=session),
+                # Сохраняем стоимость в записи ТС
+                self.db.vehicles.update_one(
+                    {"_id": vehicle["_id"]},
+                    {"$set": {"cost": history_entry["cost"]}},
+                    session=session
+                ),
+                # Освобождаем место
+                self.db.spots.update_one(
+                    {"spot_id": vehicle["spot_id"], "current_vehicle": vehicle_id},
+                    {"$set": {"status": "free", "current_vehicle": None}},
+                    session=session
+                ),
+            ], session)
+            return vehicle, history_entry
+
+        return await run_in_transaction(release_spot)
+
+    async def apply_batch(self, changes: List[Change]):
+        # Для каждой записи — обратная операция, отфильтрованная по новому состоянию:
+        # без транзакции (MONGO_USE_TRANSACTIONS=false) примененная часть пакета откатывается ими
+        spot_ops, spot_undo, vehicle_ops, vehicle_undo, history_entries = [], [], [], [], []
+        for change in changes:
+            vehicle = change[1]
+            occupied = {"$set": {"current_vehicle": vehicle["id"], "status": "occupied"}}
+            free = {"$set": {"status": "free", "current_vehicle": None}}
+            if change[0] == "arrive":
+                spot_ops.append(({"spot_id": vehicle["spot_id"], "status": "free"}, occupied))
+                spot_undo.append(UpdateOne({"spot_id": vehicle["spot_id"], "current_vehicle": vehicle["id"]}, free))
+                vehicle_ops.append(InsertOne(vehicle))
+                vehicle_undo.append(DeleteOne({
+                    "id": vehicle["id"], "paid": False, "spot_id": vehicle["spot_id"],
+                    "entry_time": vehicle["entry_time"]
+                }))
+            else:
+                entry = change[2]
+                spot_ops.append(({"spot_id": vehicle["spot_id"], "current_vehicle": vehicle["id"]}, free))
+                spot_undo.append(UpdateOne({"spot_id": vehicle["spot_id"], "status": "free"}, occupied))
+                vehicle_ops.append(UpdateOne(
+                    {"id": vehicle["id"], "paid": False},
+                    {"$set": {"exit_time": entry["exit_time"], "cost": entry["cost"], "paid": True}}
+                ))
+                vehicle_undo.append(UpdateOne(
+                    {"id": vehicle["id"], "paid": True, "exit_time": entry["exit_time"]},
+                    {"$set": {"exit_time": None, "paid": False}, "$unset": {"cost": ""}}
+                ))
+                history_entries.append(entry)
+
+        async def write_batch(session):
+            if not spot_ops:
+                return
+            # Места обновляются условно; если параллельный запрос успел изменить
+            # одно из них, пакет не согласуется с базой
+            if session is not None:
+                spots_result = await self.db.spots.bulk_write(
+                    [UpdateOne(*op) for op in spot_ops], ordered=True, session=session
+                )
+                if spots_result.modified_count != len(spot_ops):
+                    raise StateConflict(SPOTS_CHANGED)
+                try:
+                    await self.db.vehicles.bulk_write(vehicle_ops, ordered=True, session=session)
+                except BulkWriteError:
+                    raise StateConflict(VEHICLE_REGISTERED)
+                if history_entries:
+                    await self.db.parking_history.insert_many(history_entries, session=session)
+                return
+
+            applied = await self._update_spots(spot_ops)
+            try:
+                if len(applied) != len(spot_ops):
+                    raise StateConflict(SPOTS_CHANGED)
+                try:
+                    await self.db.vehicles.bulk_write(vehicle_ops, ordered=True)
+                except BulkWriteError:
+                    raise StateConflict(VEHICLE_REGISTERED)
+                if history_entries:
+                    await self.db.parking_history.insert_many(history_entries)
+            except BaseException:
+                await self._undo_batch(
+                    [spot_undo[index] for index in applied], vehicle_undo,
+                    [entry["_id"] for entry in history_entries if "_id" in entry]
+                )
+                raise
+
+        await run_in_transaction(write_batch)
+
+    async def _update_spots(self, spot_ops: List[Tuple[dict, dict]]) -> List[int]:
+        """Условные обновления мест по одному; возвращает номера примененных.
+
+        Операции разных мест выполняются параллельно, одного места — по порядку
+        пакета; после первой не примененной операции места остальные не выполняются.
+        """
+        chains: Dict[int, List[int]] = {}
+        for index, (spot_filter, _) in enumerate(spot_ops):
+            chains.setdefault(spot_filter["spot_id"], []).append(index)
+        applied = []
+
+        async def run_chain(indexes: List[int]):
+            for index in indexes:
+                result = await self.db.spots.update_one(*spot_ops[index])
+                if not result.modified_count:
+                    return
+                applied.append(index)
+
+        await asyncio.gather(*(run_chain(indexes) for indexes in chains.values()))
+        return sorted(applied)
+
+    async def _undo_batch(self, spot_undo: list, vehicle_undo: list, history_ids: list):
+        """Откат пакета без транзакции в обратном порядке; не примененные операции ни с чем не совпадут"""
+        try:
+            if history_ids:
+                await self.db.parking_history.delete_many({"_id": {"$in": history_ids}})
+            await self.db.vehicles.bulk_write(vehicle_undo[::-1], ordered=True)
+            if spot_undo:
+                await self.db.spots.bulk_write(spot_undo[::-1], ordered=True)
+        except Exception as e:
+            logger.error(f"Не удалось откатить пакет событий: {e}")
+
+    async def insert_load(self, documents: List[dict]):
+        try:
+            await self.db.parking_load_history.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # 11000: замер уже записан предыдущей попыткой (insert_many проставил _id)
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    async def reset(self):
+        await self.db.vehicles.delete_many({})
+        await self.db.spots.delete_many({})
+
+    async def total_revenue(self) -> Dict[str, float]:
+        # Суточные агрегаты хранятся бессрочно, а сырая история может удаляться по TTL
+        pipeline = [
+            {"$match": {"interval": "1d", "lot_id": {"$ne": layout.ALL_LOTS}}},
+            {"$group": {
+                "_id": "$lot_id",
+                "total_revenue": {"$sum": {"$ifNull": ["$revenue", 0]}}
+            }}
+        ]
+        result = await (await self.db.stats_rollups.aggregate(pipeline)).to_list()
+        return {row["_id"]: row["total_revenue"] for row in result}
+
+    async def arrivals_by_hour(self, start: datetime, lot_id: Optional[str] = None) -> List[dict]:
+        pipeline = [
+            {"$match": {"entry_time": {"$gte": start}, **layout.lot_match(lot_id)}},
+            {"$group": {
+                "_id": {"$hour": "$entry_time"},
+                "vehicles": {"$sum": 1},
+                "revenue": {"$sum": "$cost"}
+            }},
+            {"$sort": {"_id": 1}}
+        ]
+        cursor = await self.db.vehicles.aggregate(pipeline, batchSize=MONGO_CURSOR_BATCH_SIZE)
+        return [{"hour": row["_id"], "vehicles": row["vehicles"], "revenue": row["revenue"]} async for row in cursor]
+
+class EmbeddedStorage(Storage):
+    """Общая часть встроенных хранилищ: описание парковок хранится вместе с местами"""
+
+    async def load_layout(self) -> List[dict]:
+        lots = layout.layout_file()
+        if lots is not None:
+            await self._save_lots(lots)
+            return lots
+        lots = await self._read_lots()
+        if lots:
+            layout.validate(lots)
+            return lots
+        await self._save_lots(layout.DEFAULT_LAYOUT)
+        return layout.DEFAULT_LAYOUT
+
+    @abstractmethod
+    async def _read_lots(self) -> List[dict]:
+        """Сохраненное описание парковок"""
+
+    @abstractmethod
+    async def _save_lots(self, lots: List[dict]):
+        """Сохранение описания парковок (существующие парковки заменяются)"""
+
+class MemoryStorage(EmbeddedStorage):
+    """Хранилище в памяти процесса.
+
+    Операции не ждут ввода-вывода и выполняются целиком между переключениями
+    цикла событий, поэтому атомарны без блокировок.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.lots: List[dict] = []
+        self.spots: Dict[int, dict] = {}
+        self.vehicles: List[dict] = []
+        # Активные записи по номеру ТС и номера всех ТС, когда-либо заезжавших
+        self.active: Dict[str, dict] = {}
+        self.known: set = set()
+        self.history: List[dict] = []
+        self.load_history: List[dict] = []
+
+    async def _read_lots(self) -> List[dict]:
+        return copy.deepcopy(self.lots)
+
+    async def _save_lots(self, lots: List[dict]):
+        saved = {lot["lot_id"]: i for i, lot in enumerate(self.lots)}
+        for lot in copy.deepcopy(lots):
+            if lot["lot_id"] in saved:
+                self.lots[saved[lot["lot_id"]]] = lot
+            else:
+                self.lots.append(lot)
+
+    async def init_spots(self, spots: List[dict]):
+        for spot in spots:
+            self.spots.setdefault(spot["spot_id"], dict(spot))
+
+    async def update_lot(self, lot_id: str, fields: dict):
+        for lot in self.lots:
+            if lot["lot_id"] == lot_id:
+                lot.update(copy.deepcopy(fields))
+
+    async def fetch_state(self):
+        spots = [
+            {field: spot.get(field) for field in SPOT_FIELDS if SPOT_FIELDS[field]}
+            for _, spot in sorted(self.spots.items())
+        ]
+        vehicles = [
+            {field: vehicle.get(field) for field in VEHICLE_FIELDS if VEHICLE_FIELDS[field]}
+            for vehicle in self.active.values()
+        ]
+        return copy.deepcopy(self.lots), spots, vehicles
+
+    async def spot_exists(self, spot_id: int) -> bool:
+        return spot_id in self.spots
+
+    def _arrive(self, vehicle: dict):
+        record = {k: v for k, v in vehicle.items() if k != "_id"}
+        spot = self.spots[vehicle["spot_id"]]
+        spot["status"], spot["current_vehicle"] = "occupied", vehicle["id"]
+        self.vehicles.append(record)
+        self.active[vehicle["id"]] = record
+        self.known.add(vehicle["id"])
+
+    def _depart(self, record: dict, entry: dict):
+        record.update({"exit_time": entry["exit_time"], "paid": True, "cost": entry["cost"]})
+        del self.active[record["id"]]
+        self.history.append(dict(entry))
+        spot = self.spots.get(record["spot_id"])
+        if spot is not None and spot["current_vehicle"] == record["id"]:
+            spot["status"], spot["current_vehicle"] = "free", None
+
+    async def occupy(self, vehicle: dict) -> bool:
+        spot = self.spots.get(vehicle["spot_id"])
+        if spot is None or spot["status"] != "free":
+            return False
+        if vehicle["id"] in self.active:
+            raise VehicleAlreadyParked(vehicle["id"])
+        self._arrive(vehicle)
+        return True
+
+    async def depart(self, vehicle_id: str, exit_time: datetime, close: Callable[[dict], dict]):
+        record = self.active.get(vehicle_id)
+        if record is None:
+            raise (VehicleAlreadyPaid if vehicle_id in self.known else VehicleNotFound)(vehicle_id)
+        vehicle = dict(record)
+        history_entry = close(vehicle)
+        self._depart(record, history_entry)
+        return vehicle, history_entry
+
+    async def apply_batch(self, changes: List[Change]):
+        # Сначала проверяем весь пакет по порядку, затем применяем
+        spots: Dict[int, Optional[str]] = {}
+        active: Dict[str, bool] = {}
+        for change in changes:
+            vehicle = change[1]
+            spot = self.spots.get(vehicle["spot_id"])
+            if spot is None:
+                raise StateConflict(SPOTS_CHANGED)
+            current = spots.get(vehicle["spot_id"], spot["current_vehicle"])
+            if change[0] == "arrive":
+                if current is not None:
+                    raise StateConflict(SPOTS_CHANGED)
+                if active.get(vehicle["id"], vehicle["id"] in self.active):
+                    raise StateConflict(VEHICLE_REGISTERED)
+                spots[vehicle["spot_id"]] = vehicle["id"]
+                active[vehicle["id"]] = True
+            else:
+                if current != vehicle["id"]:
+                    raise StateConflict(SPOTS_CHANGED)
+                spots[vehicle["spot_id"]] = None
+                active[vehicle["id"]] = False
+        for change in changes:
+            if change[0] == "arrive":
+                self._arrive(change[1])
+            else:
+                self._depart(self.active[change[1]["id"]], change[2])
+
+    async def insert_load(self, documents: List[dict]):
+        self.load_history += [dict(document) for document in documents]
+
+    async def reset(self):
+        self.spots.clear()
+        self.vehicles.clear()
+        self.active.clear()
+        self.known.clear()
+
+    async def total_revenue(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for entry in self.history:
+            lot_id = entry.get("lot_id") or layout.DEFAULT_LOT_ID
+            totals[lot_id] = totals.get(lot_id, 0) + (entry["cost"] or 0)
+        return totals
+
+    async def arrivals_by_hour(self, start: datetime, lot_id: Optional[str] = None) -> List[dict]:
+        hours: Dict[int, dict] = {}
+        for vehicle in self.vehicles:
+            if vehicle["entry_time"] < start \
+                    or lot_id is not None and (vehicle.get("lot_id") or layout.DEFAULT_LOT_ID) != lot_id:
+                continue
+            stat = hours.setdefault(vehicle["entry_time"].hour, {"vehicles": 0, "revenue": 0.0})
+            stat["vehicles"] += 1
+            stat["revenue"] += vehicle.get("cost") or 0
+        return [{"hour": hour, **stat} for hour, stat in sorted(hours.items())]
+
+def _ts(value: Optional[datetime]) -> Optional[str]:
+    """Время в SQLite: строка ISO, которая сравнивается так же, как время"""
+    return None if value is None else value.isoformat(timespec="microseconds")
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return None if value is None else datetime.fromisoformat(value)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lots (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    lot_id TEXT NOT NULL UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS spots (
+    spot_id INTEGER PRIMARY KEY,
+    lot_id TEXT,
+    zone_id TEXT,
+    spot_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    current_vehicle TEXT
+);
+CREATE TABLE IF NOT EXISTS vehicles (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    isEv INTEGER NOT NULL,
+    type TEXT,
+    entry_time TEXT NOT NULL,
+    exit_time TEXT,
+    spot_id INTEGER NOT NULL,
+    lot_id TEXT,
+    paid INTEGER NOT NULL,
+    cost REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS active_vehicle_id ON vehicles (id) WHERE paid = 0;
+CREATE INDEX IF NOT EXISTS vehicles_id ON vehicles (id, entry_time);
+CREATE TABLE IF NOT EXISTS parking_history (
+    vehicle_id TEXT NOT NULL,
+    vehicle_type TEXT,
+    spot_id INTEGER,
+    lot_id TEXT,
+    entry_time TEXT,
+    exit_time TEXT NOT NULL,
+    duration_minutes REAL,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS parking_history_exit_time ON parking_history (exit_time);
+CREATE TABLE IF NOT EXISTS parking_load_history (
+    timestamp TEXT NOT NULL,
+    lot_id TEXT,
+    occupied_spots REAL,
+    occupied_min INTEGER,
+    occupied_max INTEGER,
+    total_spots INTEGER,
+    load_percentage REAL,
+    samples INTEGER
+);
+CREATE INDEX IF NOT EXISTS parking_load_history_timestamp ON parking_load_history (timestamp);
+"""
+
+# Запросы — постоянные строки с параметрами: модуль sqlite3 подготавливает
+# каждый один раз и берет из кэша соединения при следующих вызовах
+OCCUPY_SPOT = "UPDATE spots SET status = 'occupied', current_vehicle = ? WHERE spot_id = ? AND status = 'free'"
+FREE_SPOT = "UPDATE spots SET status = 'free', current_vehicle = NULL WHERE spot_id = ? AND current_vehicle = ?"
+INSERT_VEHICLE = ("INSERT INTO vehicles (id, isEv, type, entry_time, exit_time, spot_id, lot_id, paid) "
+                  "VALUES (?, ?, ?, ?, NULL, ?, ?, 0)")
+SELECT_ACTIVE = ("SELECT pk, id, isEv, type, entry_time, exit_time, spot_id, lot_id, paid "
+                 "FROM vehicles WHERE id = ? AND paid = 0")
+SELECT_KNOWN = "SELECT 1 FROM vehicles WHERE id = ? LIMIT 1"
+CLOSE_VEHICLE = "UPDATE vehicles SET exit_time = ?, paid = 1, cost = ? WHERE id = ? AND paid = 0"
+INSERT_HISTORY = ("INSERT INTO parking_history (vehicle_id, vehicle_type, spot_id, lot_id, entry_time, exit_time, "
+                  "duration_minutes, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_LOAD = ("INSERT INTO parking_load_history (timestamp, lot_id, occupied_spots, occupied_min, occupied_max, "
+               "total_spots, load_percentage, samples) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+class SqliteStorage(EmbeddedStorage):
+    """Хранилище во встроенной базе SQLite.
+
+    Все запросы выполняются одним соединением в отдельном потоке, чтобы не
+    блокировать цикл событий; каждая операция — одна транзакция. Режим WAL
+    позволяет читать базу (например, для резервной копии) во время записи.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    async def connect(self):
+        # Повторный вызов (после неудачного прогрева) не открывает второе соединение
+        if self.conn is None:
+            await self._call(self._open)
+
+    async def close(self):
+        if self.conn is not None:
+            await self._call(self.conn.close)
+            self.conn = None
+
+    @staticmethod
+    def _vehicle(row: sqlite3.Row) -> dict:
+        return {
+            "id": row["id"], "isEv": bool(row["isEv"]), "type": row["type"],
+            "entry_time": _dt(row["entry_time"]), "exit_time": _dt(row["exit_time"]),
+            "spot_id": row["spot_id"], "lot_id": row["lot_id"], "paid": bool(row["paid"])
+        }
+
+    async def _read_lots(self) -> List[dict]:
+        def read():
+            return [json.loads(row["doc"]) for row in self.conn.execute("SELECT doc FROM lots ORDER BY position")]
+        return await self._call(read)
+
+    async def _save_lots(self, lots: List[dict]):
+        def save():
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO lots (lot_id, doc) VALUES (?, ?) ON CONFLICT (lot_id) DO UPDATE SET doc = excluded.doc",
+                    [(lot["lot_id"], json.dumps(lot, ensure_ascii=False)) for lot in lots]
+                )
+        await self._call(save)
+
+    async def init_spots(self, spots: List[dict]):
+        def insert():
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO spots (spot_id, lot_id, zone_id, spot_type, status, current_vehicle) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(s["spot_id"], s["lot_id"], s["zone_id"], s["spot_type"], s["status"], s["current_vehicle"])
+                     for s in spots]
+                )
+        await self._call(insert)
+
+    async def update_lot(self, lot_id: str, fields: dict):
+        def update():
+            with self.conn:
+                row = self.conn.execute("SELECT doc FROM lots WHERE lot_id = ?", (lot_id,)).fetchone()
+                if row is not None:
+                    lot = {**json.loads(row["doc"]), **fields}
+                    self.conn.execute("UPDATE lots SET doc = ? WHERE lot_id = ?",
+                                      (json.dumps(lot, ensure_ascii=False), lot_id))
+        await self._call(update)
+
+    async def fetch_state(self):
+        def fetch():
+            lots = [json.loads(row["doc"]) for row in self.conn.execute("SELECT doc FROM lots ORDER BY position")]
+            spots = [dict(row) for row in self.conn.execute(
+                "SELECT spot_id, lot_id, zone_id, spot_type, status, current_vehicle FROM spots ORDER BY spot_id"
+            )]
+            vehicles = [self._vehicle(row) for row in self.conn.execute(
+                "SELECT id, isEv, type, entry_time, exit_time, spot_id, lot_id, paid FROM vehicles WHERE paid = 0"
+            )]
+            return lots, spots, vehicles
+        return await self._call(fetch)
+
+    async def spot_exists(self, spot_id: int) -> bool:
+        def exists():
+            return self.conn.execute("SELECT 1 FROM spots WHERE spot_id = ?", (spot_id,)).fetchone() is not None
+        return await self._call(exists)
+
+    def _arrive(self, vehicle: dict) -> bool:
+        if not self.conn.execute(OCCUPY_SPOT, (vehicle["id"], vehicle["spot_id"])).rowcount:
+            return False
+        self.conn.execute(INSERT_VEHICLE, (
+            vehicle["id"], vehicle["isEv"], vehicle["type"], _ts(vehicle["entry_time"]),
+            vehicle["spot_id"], vehicle["lot_id"]
+        ))
+        return True
+
+    def _depart(self, vehicle_id: str, spot_id: int, entry: dict) -> bool:
+        """Закрытие записи ТС и запись истории; False, если место уже не за этим ТС"""
+        self.conn.execute(CLOSE_VEHICLE, (_ts(entry["exit_time"]), entry["cost"], vehicle_id))
+        self.conn.execute(INSERT_HISTORY, (
+            entry["vehicle_id"], entry["vehicle_type"], entry["spot_id"], entry["lot_id"],
+            _ts(entry["entry_time"]), _ts(entry["exit_time"]), entry["duration_minutes"], entry["cost"]
+        ))
+        return self.conn.execute(FREE_SPOT, (spot_id, vehicle_id)).rowcount > 0
+
+    async def occupy(self, vehicle: dict) -> bool:
+        def occupy_spot():
+            try:
+                # Транзакция откатывается при исключении, место остается свободным
+                with self.conn:
+                    return self._arrive(vehicle)
+            except sqlite3.IntegrityError:
+                raise VehicleAlreadyParked(vehicle["id"])
+        return await self._call(occupy_spot)
+
+    async def depart(self, vehicle_id: str, exit_time: datetime, close: Callable[[dict], dict]):
+        def release_spot():
+            with self.conn:
+                row = self.conn.execute(SELECT_ACTIVE, (vehicle_id,)).fetchone()
+                if row is None:
+                    if self.conn.execute(SELECT_KNOWN, (vehicle_id,)).fetchone() is None:
+                        raise VehicleNotFound(vehicle_id)
+                    raise VehicleAlreadyPaid(vehicle_id)
+                vehicle = self._vehicle(row)
+                history_entry = close(vehicle)
+                self._depart(vehicle_id, vehicle["spot_id"], history_entry)
+                return vehicle, history_entry
+        return await self._call(release_spot)
+
+    async def apply_batch(self, changes: List[Change]):
+        def write_batch():
+            with self.conn:
+                for change in changes:
+                    vehicle = change[1]
+                    if change[0] == "arrive":
+                        try:
+                            arrived = self._arrive(vehicle)
+                        except sqlite3.IntegrityError:
+                            raise StateConflict(VEHICLE_REGISTERED)
+                        if not arrived:
+                            raise StateConflict(SPOTS_CHANGED)
+                    elif not self._depart(vehicle["id"], vehicle["spot_id"], change[2]):
+                        raise StateConflict(SPOTS_CHANGED)
+        await self._call(write_batch)
+
+    async def insert_load(self, documents: List[dict]):
+        def insert():
+            with self.conn:
+                self.conn.executemany(INSERT_LOAD, [(
+                    _ts(d["timestamp"]), d["lot_id"], d["occupied_spots"], d["occupied_min"], d["occupied_max"],
+                    d["total_spots"], d["load_percentage"], d["samples"]
+                ) for d in documents])
+        await self._call(insert)
+
+    async def reset(self):
+        def delete():
+            with self.conn:
+                self.conn.execute("DELETE FROM vehicles")
+                self.conn.execute("DELETE FROM spots")
+        await self._call(delete)
+
+    async def total_revenue(self) -> Dict[str, float]:
+        def total():
+            return {row[0]: row[1] for row in self.conn.execute(
+                "SELECT COALESCE(lot_id, ?), TOTAL(cost) FROM parking_history GROUP BY 1", (layout.DEFAULT_LOT_ID,)
+            )}
+        return await self._call(total)
+
+    async def arrivals_by_hour(self, start: datetime, lot_id: Optional[str] = None) -> List[dict]:
+        def arrivals():
+            query = ("SELECT CAST(substr(entry_time, 12, 2) AS INTEGER) AS hour, COUNT(*) AS vehicles, "
+                     "TOTAL(cost) AS revenue FROM vehicles WHERE entry_time >= ?")
+            params = [_ts(start)]
+            if lot_id is not None:
+                query += " AND COALESCE(lot_id, ?) = ?"
+                params += [layout.DEFAULT_LOT_ID, lot_id]
+            return [dict(row) for row in self.conn.execute(query + " GROUP BY hour ORDER BY hour", params)]
+        return await self._call(arrivals)
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    if backend == "mongo":
+        return MongoStorage()
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_PATH)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND: {backend}")
+
+parking_storage = create_storage()
@@ -0,0 +1,156 @@
+from typing import Dict, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from occupancy import parking_state
+from cache import response_cache
+from revenue import revenue_counter
+from tariffs import tariff_book
+from reservations import reservation_book
+from storage import parking_storage
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Синхронизация состояния между экземплярами сервиса (воркерами uvicorn, контейнерами):
+# off — один экземпляр; changestream — поток изменений MongoDB (нужен replica set);
+# poll — периодическая сверка с базой; auto — поток изменений, а без replica set — сверка
+STATE_SYNC = os.getenv("STATE_SYNC", "off").lower()
+# Период сверки в режиме poll (секунды)
+STATE_SYNC_POLL_INTERVAL = float(os.getenv("STATE_SYNC_POLL_INTERVAL", "1"))
+# Задержка отложенных перезагрузок (секунды): выручка перечитывается из агрегатов,
+# которые обновляются вслед за записью истории
+STATE_SYNC_RELOAD_DELAY = 0.5
+
+WATCHED = ["spots", "vehicles", "parking_history", "lots", "reservations"]
+
+class StateSync:
+    """Фоновая синхронизация состояния в памяти с изменениями других экземпляров.
+
+    Каждый экземпляр сразу применяет свои записи (write-through), а чужие
+    получает из потока изменений: места и ТС применяются по одному
+    документу (повторное применение своих изменений ничего не меняет).
+    Выручка после чужих выездов перечитывается из суточных агрегатов с
+    небольшой задержкой — так выезд не учитывается дважды. Удаления (сброс)
+    и изменения парковок вызывают полную сверку, отложенную до паузы в
+    потоке, чтобы массовое удаление не перезагружало состояние на каждый
+    документ. Без replica set все сверяется с базой периодически.
+    """
+
+    def __init__(self, mode: str = STATE_SYNC, poll_interval: float = STATE_SYNC_POLL_INTERVAL):
+        if mode not in ("off", "changestream", "poll", "auto"):
+            raise ValueError(f"Неизвестный режим STATE_SYNC: {mode}")
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.db = None
+        # Отложенные перезагрузки ("state", "revenue") и их срок
+        self._pending: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def reconcile(self):
+        """Полная сверка состояния, броней, тарифов и выручки с базой"""
+        lots = parking_state.lots
+        changed = await parking_state.refresh(parking_storage)
+        await reservation_book.load(self.db)
+        if parking_state.lots is not lots:
+            tariff_book.load(parking_state.lots.values())
+        totals = dict(revenue_counter.totals)
+        await revenue_counter.load(self.db)
+        if changed or revenue_counter.totals != totals:
+            response_cache.clear()
+
+    def apply(self, change: dict):
+        """Применение одного события потока изменений"""
+        collection = change["ns"]["coll"]
+        doc = change.get("fullDocument")
+        if collection == "parking_history":
+            self._defer("revenue")
+        elif collection == "lots" or doc is None:
+            self._defer("state")
+        elif collection == "spots":
+            if doc["spot_id"] not in parking_state.spot_index:
+                self._defer("state")
+            parking_state.sync_spot(doc)
+        elif collection == "vehicles":
+            parking_state.sync_vehicle(doc)
+        elif collection == "reservations":
+            reservation_book.sync(doc)
+        response_cache.clear()
+
+    def _defer(self, what: str):
+        self._pending.setdefault(what, asyncio.get_running_loop().time() + STATE_SYNC_RELOAD_DELAY)
+
+    async def _flush(self, idle: bool):
+        """Отложенные перезагрузки по истечении задержки; полная сверка — и в паузе потока"""
+        now = asyncio.get_running_loop().time()
+        if "state" in self._pending and (idle or now >= self._pending["state"]):
+            self._pending.clear()
+            await self.reconcile()
+        elif "revenue" in self._pending and now >= self._pending["revenue"]:
+            del self._pending["revenue"]
+            await revenue_counter.load(self.db)
+            response_cache.clear()
+
+    async def _watch(self):
+        resume_token = None
+        while not self._stopping.is_set():
+            try:
+                async with await self.db.watch(
+                    [{"$match": {"ns.coll": {"$in": WATCHED}}}],
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=500,
+                ) as stream:
+                    if resume_token is None:
+                        # Изменения между загрузкой состояния и открытием потока
+                        await self.reconcile()
+                    logger.info("Синхронизация состояния через поток изменений MongoDB")
+                    while not self._stopping.is_set():
+                        change = await stream.try_next()
+                        if change is not None:
+                            resume_token = stream.resume_token
+                            self.apply(change)
+                        await self._flush(idle=change is None)
+            except OperationFailure as e:
+                # 40573: поток изменений недоступен без replica set
+                if e.code == 40573 and self.mode == "auto":
+                    logger.warning("Поток изменений недоступен, состояние сверяется с базой периодически")
+                    await self._poll()
+                    return
+                logger.error(f"Ошибка потока изменений: {e}")
+                # 286 ChangeStreamHistoryLost: продолжить с отметки нельзя, начинаем с полной сверки
+                if e.code == 286:
+                    resume_token = None
+            except PyMongoError as e:
+                logger.error(f"Ошибка потока изменений: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self):
+        while not self._stopping.is_set():
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Не удалось сверить состояние с базой: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, db):
+        if self.mode == "off":
+            return
+        self.db = db
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._poll() if self.mode == "poll" else self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+state_sync = StateSync()
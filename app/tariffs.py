@@ -0,0 +1,239 @@
+"""Расчет стоимости стоянки по тарифам парковок.
+
+Тариф парковки задается полем tariff в ее описании:
+
+    {
+        "rates": {"car": 1.5, "evCar": 2.5},
+        "periods": [{"start": "22:00", "end": "07:00", "rates": {"car": 0.5}}],
+        "grace_minutes": 10,
+        "daily_cap": {"car": 900}
+    }
+
+rates — руб/мин по умолчанию, periods — ставки по времени суток (период может
+переходить через полночь, не указанные в нем классы платят по умолчанию),
+grace_minutes — бесплатная стоянка не дольше заданного времени, daily_cap —
+максимум оплаты за календарные сутки. Без поля tariff действует DEFAULT_TARIFF.
+
+Стоимость истории считается векторно (NumPy) сразу для массива стоянок, при
+выезде — по тем же таблицам для одной стоянки. Запуск как скрипта
+пересчитывает историю:
+    python app/tariffs.py --lot-id main --start 2025-01-01 --dry-run
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+from database import MONGO_CURSOR_BATCH_SIZE
+from export import history_filter
+from layout import DEFAULT_LOT_ID, SPOT_TYPES, lot_match
+import numpy as np
+import rollups
+
+# Классы ТС в тарифе; индекс класса — признак электромобиля
+VEHICLE_CLASSES = ("car", "evCar")
+
+DEFAULT_TARIFF = {"rates": {"car": 1.5, "evCar": 2.5}}
+
+MINUTES_IN_DAY = 24 * 60
+MS_IN_DAY = MINUTES_IN_DAY * 60 * 1000
+# Время в базе хранится без часового пояса, поэтому миллисекунды отсчитываются от наивной эпохи
+EPOCH = datetime(1970, 1, 1)
+
+def _minute(value: str) -> int:
+    """Минута суток из строки "ЧЧ:ММ" """
+    try:
+        hours, minutes = map(int, value.split(":"))
+    except ValueError:
+        raise ValueError(f"Некорректное время в тарифе: {value}")
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > MINUTES_IN_DAY:
+        raise ValueError(f"Некорректное время в тарифе: {value}")
+    return hours * 60 + minutes
+
+def _rates(rates: dict) -> dict:
+    for vehicle_class, rate in rates.items():
+        if vehicle_class not in VEHICLE_CLASSES:
+            raise ValueError(f"Неизвестный класс ТС в тарифе: {vehicle_class}")
+        if rate < 0:
+            raise ValueError(f"Отрицательная ставка в тарифе: {vehicle_class}")
+    return rates
+
+class Tariff:
+    """Тариф парковки, подготовленный для векторного расчета.
+
+    Для каждого класса ТС хранится накопленная стоимость от полуночи до
+    каждой минуты суток: стоимость отрезка внутри суток — разность двух
+    значений, поэтому расчет не зависит от числа периодов.
+    """
+
+    def __init__(self, spec: Optional[dict] = None):
+        spec = spec or DEFAULT_TARIFF
+        base = _rates(spec["rates"])
+        missing = [vehicle_class for vehicle_class in VEHICLE_CLASSES if vehicle_class not in base]
+        if missing:
+            raise ValueError(f"В тарифе нет ставки для: {', '.join(missing)}")
+
+        per_minute = np.array([[base[vehicle_class]] * MINUTES_IN_DAY for vehicle_class in VEHICLE_CLASSES], dtype=float)
+        for period in spec.get("periods") or []:
+            start, end = _minute(period["start"]), _minute(period["end"])
+            minutes = np.arange(start, end) if start < end else np.r_[start:MINUTES_IN_DAY, 0:end]
+            for vehicle_class, rate in _rates(period["rates"]).items():
+                per_minute[VEHICLE_CLASSES.index(vehicle_class), minutes] = rate
+        # cumulative[class, m] — стоимость от полуночи до минуты m
+        self.cumulative = np.concatenate([np.zeros((len(VEHICLE_CLASSES), 1)), per_minute.cumsum(axis=1)], axis=1)
+
+        self.grace_minutes = float(spec.get("grace_minutes") or 0)
+        caps = _rates(spec.get("daily_cap") or {})
+        self.daily_cap = np.array([caps.get(vehicle_class, np.inf) for vehicle_class in VEHICLE_CLASSES])
+        self.spec = spec
+        # Те же таблицы списками для расчета одной стоянки при выезде
+        self._rows = self.cumulative.tolist()
+        self._caps = self.daily_cap.tolist()
+
+    def _until(self, classes: np.ndarray, minutes: np.ndarray) -> np.ndarray:
+        """Стоимость от полуночи до момента (минута суток с долями)"""
+        whole = np.minimum(minutes.astype(np.int64), MINUTES_IN_DAY - 1)
+        start = self.cumulative[classes, whole]
+        step = self.cumulative[classes, whole + 1] - start
+        return start + (minutes - whole) * step
+
+    def costs(self, is_ev: np.ndarray, entry_ms: np.ndarray, exit_ms: np.ndarray) -> np.ndarray:
+        """Стоимость массива стоянок; время — миллисекунды локального времени от эпохи"""
+        classes = is_ev.astype(np.int64)
+        entry_day, entry_rest = np.divmod(entry_ms, MS_IN_DAY)
+        exit_day, exit_rest = np.divmod(exit_ms, MS_IN_DAY)
+        head = self._until(classes, entry_rest / 60000)
+        tail = self._until(classes, exit_rest / 60000)
+        cap = self.daily_cap[classes]
+        day_total = self.cumulative[classes, -1]
+
+        # Каждые календарные сутки оплачиваются не больше daily_cap
+        cost = np.where(
+            entry_day == exit_day,
+            np.minimum(tail - head, cap),
+            np.minimum(day_total - head, cap) + np.minimum(tail, cap)
+            + np.maximum(exit_day - entry_day - 1, 0) * np.minimum(day_total, cap)
+        )
+        duration = (exit_ms - entry_ms) / 60000
+        return np.where(duration <= self.grace_minutes, 0.0, cost)
+
+    def cost(self, is_ev: bool, entry_time: datetime, exit_time: datetime) -> float:
+        """Стоимость одной стоянки по тем же таблицам без накладных расходов NumPy на массивы из одного элемента"""
+        if (exit_time - entry_time).total_seconds() / 60 <= self.grace_minutes:
+            return 0.0
+        row = self._rows[is_ev]
+        cap = self._caps[is_ev]
+        head = self._until_one(row, entry_time)
+        tail = self._until_one(row, exit_time)
+        days = (exit_time.date() - entry_time.date()).days
+        if days == 0:
+            return min(tail - head, cap)
+        return min(row[-1] - head, cap) + min(tail, cap) + (days - 1) * min(row[-1], cap)
+
+    @staticmethod
+    def _until_one(row: List[float], moment: datetime) -> float:
+        minutes = moment.hour * 60 + moment.minute + (moment.second + moment.microsecond / 1e6) / 60
+        whole = int(minutes)
+        return row[whole] + (minutes - whole) * (row[whole + 1] - row[whole])
+
+class TariffBook:
+    """Тарифы всех парковок"""
+
+    def __init__(self):
+        self.default = Tariff()
+        self.tariffs: Dict[str, Tariff] = {}
+
+    def load(self, lots: Iterable[dict]):
+        self.tariffs = {lot["lot_id"]: Tariff(lot.get("tariff")) for lot in lots}
+
+    def set(self, lot_id: str, spec: dict):
+        self.tariffs[lot_id] = Tariff(spec)
+
+    def get(self, lot_id: Optional[str]) -> Tariff:
+        return self.tariffs.get(lot_id or DEFAULT_LOT_ID, self.default)
+
+tariff_book = TariffBook()
+
+def history_query(lot_id: Optional[str] = None, start: Optional[datetime] = None,
+                  end: Optional[datetime] = None) -> dict:
+    """Стоянки парковки, завершенные в период [start, end)"""
+    return {**history_filter(start, end), **lot_match(lot_id)}
+
+async def reprice(db, book: TariffBook, query: dict, batch_size: int = MONGO_CURSOR_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Пересчет стоимости стоянок из parking_history по текущим тарифам.
+
+    История читается пачками; стоимость пачки считается векторно по
+    парковкам, измененные записи и поправки выручки в агрегатах
+    записываются пакетно. Класс ТС определяется по типу места.
+    """
+    spot_ev = {
+        spot["spot_id"]: SPOT_TYPES.get(spot["spot_type"], False)
+        async for spot in db.spots.find({}, {"_id": 0, "spot_id": 1, "spot_type": 1})
+    }
+    # Время отдается базой сразу в миллисекундах: разбор datetime в Python дороже самого расчета
+    cursor = db.parking_history.find(query, {
+        "_id": 1, "spot_id": 1, "lot_id": 1, "cost": 1,
+        "entry_ms": {"$toLong": "$entry_time"},
+        "exit_ms": {"$toLong": "$exit_time"}
+    }).batch_size(batch_size)
+    result = {"sessions": 0, "changed": 0, "revenue_delta": 0.0}
+
+    async def flush(batch: List[dict]):
+        count = len(batch)
+        lots = np.array([doc.get("lot_id") or DEFAULT_LOT_ID for doc in batch])
+        is_ev = np.fromiter((spot_ev.get(doc["spot_id"], False) for doc in batch), bool, count)
+        entry_ms = np.fromiter((doc["entry_ms"] for doc in batch), np.int64, count)
+        exit_ms = np.fromiter((doc["exit_ms"] for doc in batch), np.int64, count)
+        old = np.fromiter((doc.get("cost") or 0 for doc in batch), float, count)
+        costs = np.empty(count)
+        for lot_id in np.unique(lots):
+            mask = lots == lot_id
+            costs[mask] = book.get(str(lot_id)).costs(is_ev[mask], entry_ms[mask], exit_ms[mask])
+
+        history_ops, changes = [], []
+        for i in np.flatnonzero(np.abs(costs.round(2) - old) >= 0.005).tolist():
+            cost = round(float(costs[i]), 2)
+            history_ops.append(UpdateOne({"_id": batch[i]["_id"]}, {"$set": {"cost": cost}}))
+            changes.append((EPOCH + timedelta(milliseconds=int(exit_ms[i])), str(lots[i]), cost - float(old[i])))
+        result["sessions"] += count
+        result["changed"] += len(history_ops)
+        result["revenue_delta"] += sum(delta for _, _, delta in changes)
+        if history_ops and not dry_run:
+            await db.parking_history.bulk_write(history_ops, ordered=False)
+            await rollups.apply(db, rollups.revenue_ops(changes))
+
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    result["revenue_delta"] = round(result["revenue_delta"], 2)
+    return result
+
+async def _main(args):
+    from database import smart_parking_db, connect_db, close_db
+    await connect_db()
+    try:
+        book = TariffBook()
+        book.load(await smart_parking_db.lots.find({}, {"_id": 0}).to_list())
+        result = await reprice(
+            smart_parking_db, book, history_query(args.lot_id, args.start, args.end),
+            args.batch_size, args.dry_run
+        )
+        print(f"Стоянок: {result['sessions']}, изменено: {result['changed']}, "
+              f"изменение выручки: {result['revenue_delta']:+.2f}")
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lot-id")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Начало периода по времени выезда")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Конец периода (не включается)")
+    parser.add_argument("--batch-size", type=int, default=MONGO_CURSOR_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать изменения, не записывая их")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,84 @@
+"""Пропускная способность пакетной загрузки событий против одиночных запросов.
+
+Прогоняет одинаковый поток заездов/выездов через /api/vehicle/arrive и
+/api/vehicle/depart/{id}, а затем через /api/events/batch пакетами заданного
+размера, и печатает число событий в секунду для каждого способа.
+
+Пример:
+    python bench/batch.py --url http://localhost:8008 --events 2000 --batch-size 200
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+REGULAR_SPOTS = range(14)
+
+
+def event_stream(count: int, prefix: str):
+    """Заезды и выезды по кругу на обычных местах с метками времени в прошлом"""
+    start = datetime.now() - timedelta(hours=1)
+    events = []
+    for n in range(count // 2):
+        vehicle_id = f"{prefix}-{n}"
+        spot_id = REGULAR_SPOTS[n % len(REGULAR_SPOTS)]
+        arrived = start + timedelta(seconds=n)
+        events.append({
+            "event": "arrive",
+            "vehicle_id": vehicle_id,
+            "spot_id": spot_id,
+            "isEv": False,
+            "type": "car",
+            "timestamp": arrived.isoformat()
+        })
+        events.append({
+            "event": "depart",
+            "vehicle_id": vehicle_id,
+            "timestamp": (arrived + timedelta(minutes=5)).isoformat()
+        })
+    return events
+
+
+async def run_single(client: httpx.AsyncClient, events) -> int:
+    failed = 0
+    for event in events:
+        if event["event"] == "arrive":
+            body = {k: v for k, v in event.items() if k != "event"}
+            response = await client.post("/api/vehicle/arrive", json=body)
+        else:
+            response = await client.post(f"/api/vehicle/depart/{event['vehicle_id']}")
+        failed += response.status_code != 200
+    return failed
+
+
+async def run_batch(client: httpx.AsyncClient, events, batch_size: int) -> int:
+    failed = 0
+    for i in range(0, len(events), batch_size):
+        response = await client.post("/api/events/batch", json={"events": events[i:i + batch_size]})
+        response.raise_for_status()
+        failed += sum(r["status"] != "success" for r in response.json()["data"])
+    return failed
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        for name, run in (
+            ("single", lambda events: run_single(client, events)),
+            (f"batch/{args.batch_size}", lambda events: run_batch(client, events, args.batch_size)),
+        ):
+            await client.post("/api/reset")
+            events = event_stream(args.events, name.replace("/", "-"))
+            started = time.perf_counter()
+            failed = await run(events)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<12} {len(events) / elapsed:10.1f} events/s   {elapsed:7.2f} s   failed {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8008")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
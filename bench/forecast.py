@@ -0,0 +1,104 @@
+"""Обучение прогноза загруженности: цикл по документам против NumPy.
+
+Генерирует часовые агрегаты с суточным и недельным профилем и шумом для
+заданного числа парковок и обучает на них модель прогноза дважды: тем же
+алгоритмом в цикле Python по документам и векторной функцией forecast.fit.
+Перед замером проверяет, что часы без агрегатов (парковка закрыта ночью)
+прогнозируются с нулем выездов. База не нужна.
+
+Пример:
+    python bench/forecast.py --lots 1 10 100 --weeks 8
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from forecast import (  # noqa: E402
+    DEPARTURES, HOURS_IN_WEEK, LEVEL_ALPHA, LEVEL_DAMPING, LEVEL_WINDOW, SEASON_ALPHA, SERIES, build_history, fit
+)
+
+HORIZON = 48
+
+
+def history(hours: int) -> list:
+    """Загруженность по часам, около 10% часов пропущено (NaN)"""
+    values = []
+    for hour in range(hours):
+        day = 50 + 35 * math.sin(2 * math.pi * (hour % 24 - 6) / 24)
+        weekend = -20 if hour % HOURS_IN_WEEK >= 5 * 24 else 0
+        values.append(math.nan if random.random() < 0.1 else max(0.0, day + weekend + random.gauss(0, 5)))
+    return values
+
+
+def fit_loop(values: list, horizon: int) -> list:
+    """Та же модель с накоплением взвешенных сумм по одному значению"""
+    totals, weights = [0.0] * HOURS_IN_WEEK, [0.0] * HOURS_IN_WEEK
+    for hour, value in enumerate(values):
+        slot = hour % HOURS_IN_WEEK
+        totals[slot] *= 1 - SEASON_ALPHA
+        weights[slot] *= 1 - SEASON_ALPHA
+        if not math.isnan(value):
+            totals[slot] += value
+            weights[slot] += 1
+    profile = [total / weight if weight else None for total, weight in zip(totals, weights)]
+    known = [value for value in profile if value is not None]
+    fallback = sum(known) / len(known) if known else 0
+    profile = [fallback if value is None else value for value in profile]
+
+    total = weight = 0.0
+    for hour in range(max(0, len(values) - LEVEL_WINDOW), len(values)):
+        total *= 1 - LEVEL_ALPHA
+        weight *= 1 - LEVEL_ALPHA
+        if not math.isnan(values[hour]):
+            total += values[hour] - profile[hour % HOURS_IN_WEEK]
+            weight += 1
+    level = total / weight if weight else 0
+    return [
+        max(0, profile[(len(values) + ahead) % HOURS_IN_WEEK] + level * LEVEL_DAMPING ** (ahead + 1))
+        for ahead in range(horizon)
+    ]
+
+
+def check_dead_hours(weeks: int):
+    """Парковка открыта с 8 до 20: ночью агрегатов нет, прогноз выездов — около нуля"""
+    hours = weeks * HOURS_IN_WEEK
+    rows = [(0, hour, 50.0, 10.0, random.randint(5, 15)) for hour in range(hours) if 8 <= hour % 24 < 20]
+    predicted = fit(build_history(rows, 1, hours).reshape(-1, hours), 24).reshape(1, len(SERIES), 24)
+    night = [hour for hour in range(24) if not 8 <= hour < 20]
+    assert np.all(predicted[0, DEPARTURES, night] < 0.05), predicted[0, DEPARTURES, night]
+    assert np.all(predicted[0, DEPARTURES, 8:20] > 5)
+
+
+def main(args):
+    check_dead_hours(args.weeks)
+    hours = args.weeks * HOURS_IN_WEEK + 37
+    print(f"{'Парковок':>10}{'цикл':>12}{'NumPy':>12}{'ускорение':>12}")
+    for lots in args.lots:
+        series = [history(hours) for _ in range(lots)]
+
+        started = time.perf_counter()
+        expected = [fit_loop(values, HORIZON) for values in series]
+        loop = time.perf_counter() - started
+
+        started = time.perf_counter()
+        predicted = fit(np.array(series), HORIZON)
+        vectorized = time.perf_counter() - started
+
+        assert np.allclose(predicted, expected)
+        print(f"{lots:>10}{loop * 1000:>9.1f} ms{vectorized * 1000:>9.1f} ms{loop / vectorized:>11.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    main(args)
@@ -0,0 +1,141 @@
+"""Нагрузочный тест API парковки.
+
+Запускает несколько параллельных "шлагбаумов" (заезд, стоянка, выезд) и
+"дашбордов" (опрос /api/parking/status и /api/stats/*) и печатает
+пропускную способность и задержки p50/p95/p99 по эндпоинтам. Сервер
+запускается отдельно (--url) или внутри процесса бенчмарка (--in-process,
+база берется из MONGODB_URI). Результат можно сохранить в JSON и сравнить
+с предыдущим прогоном: рост p95 больше порога дает код выхода 1.
+
+Пример:
+    python bench/load.py --url http://localhost:8008 --gates 16 --dashboards 8 --duration 20 --save base.json
+    python bench/load.py --in-process --dwell 0.5 --poll 1 --compare base.json --threshold 15
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import time
+
+import httpx
+
+from report import Recorder, compare, load, print_summary, save
+
+STATS_ENDPOINTS = [
+    "/api/stats/vehicles?time_range=1d&interval=1m",
+    "/api/stats/revenue?time_range=1d&interval=5m",
+    "/api/stats/duration?time_range=1h&interval=1m",
+    "/api/stats/total-revenue",
+]
+
+
+async def timed(client: httpx.AsyncClient, recorder: Recorder, name: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    recorder.add(name, time.perf_counter() - started, response.status_code < 500)
+    return response
+
+
+async def pause(mean: float):
+    """Случайная пауза с экспоненциальным распределением (поток событий как пуассоновский)"""
+    if mean > 0:
+        await asyncio.sleep(random.expovariate(1 / mean))
+
+
+async def gate(client, recorder, spots, deadline, gate_id, args):
+    """Цикл заезд -> стоянка -> выезд на местах своей группы"""
+    n = 0
+    while time.perf_counter() < deadline:
+        spot = spots[n % len(spots)]
+        vehicle_id = f"bench-{gate_id}-{n}"
+        is_ev = spot["spot_type"] == "ev"
+        vehicle = {"vehicle_id": vehicle_id, "isEv": is_ev, "type": "evCar" if is_ev else "car"}
+        if args.auto:
+            response = await timed(client, recorder, "arrive/auto", "POST", "/api/vehicle/arrive/auto", json=vehicle)
+        else:
+            response = await timed(client, recorder, "arrive", "POST", "/api/vehicle/arrive",
+                                   json={**vehicle, "spot_id": spot["spot_id"]})
+        if response.status_code == 200:
+            await pause(args.dwell)
+            await timed(client, recorder, "depart", "POST", f"/api/vehicle/depart/{vehicle_id}")
+        await pause(args.gap)
+        n += 1
+
+
+async def dashboard(client, recorder, deadline, args):
+    while time.perf_counter() < deadline:
+        url = random.choice(STATS_ENDPOINTS)
+        await timed(client, recorder, url.split("?")[0], "GET", url)
+        await timed(client, recorder, "/api/parking/status", "GET", "/api/parking/status")
+        await pause(args.poll)
+
+
+@contextlib.asynccontextmanager
+async def open_client(args, limits: httpx.Limits):
+    """Клиент к серверу по URL или к приложению в этом же процессе"""
+    if not args.in_process:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+            yield client
+        return
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+    import main
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            await wait_ready(client, main.warmup)
+            yield client
+
+
+async def wait_ready(client: httpx.AsyncClient, warmup, timeout: float = 60):
+    """Ожидание окончания фонового прогрева: до него API отвечает 503"""
+    deadline = time.perf_counter() + timeout
+    while (await client.get("/readyz")).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Сервис не готов за {timeout} с: {warmup.status()['error']}")
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    random.seed(args.seed)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.gates + args.dashboards)
+    async with open_client(args, limits) as client:
+        await client.post("/api/reset")
+        spots = (await client.get("/api/parking/status")).json()["data"]
+        # Каждый шлагбаум работает со своим набором мест, чтобы не конфликтовать
+        spot_groups = [spots[g::args.gates] for g in range(args.gates)]
+        deadline = time.perf_counter() + args.duration
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(gate(client, recorder, group, deadline, g, args) for g, group in enumerate(spot_groups) if group),
+            *(dashboard(client, recorder, deadline, args) for _ in range(args.dashboards)),
+        )
+        summary = recorder.summary(time.perf_counter() - started)
+
+    print_summary(summary)
+    if args.save:
+        save(args.save, summary, {k: v for k, v in vars(args).items() if k not in ("save", "compare")})
+    if args.compare:
+        print()
+        if compare(load(args.compare), summary, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8008")
+    parser.add_argument("--in-process", action="store_true", help="запустить приложение внутри процесса бенчмарка")
+    parser.add_argument("--gates", type=int, default=16)
+    parser.add_argument("--dashboards", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--dwell", type=float, default=0.0, help="среднее время стоянки, с (0 — выезд сразу)")
+    parser.add_argument("--gap", type=float, default=0.0, help="средняя пауза между заездами шлагбаума, с")
+    parser.add_argument("--poll", type=float, default=0.0, help="средний интервал опроса дашборда, с")
+    parser.add_argument("--auto", action="store_true", help="заезды через /api/vehicle/arrive/auto")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненным результатом")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95 при сравнении, %%")
+    asyncio.run(main(parser.parse_args()))
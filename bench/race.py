@@ -0,0 +1,82 @@
+"""Стресс-тест гонок при заезде и выезде.
+
+Одновременно отправляет много заездов разных ТС на одно место и много
+заездов одного ТС на разные места, затем проверяет, что ни место, ни ТС
+не оказались заняты дважды, и что повторный выезд не оплачивается дважды.
+
+Пример:
+    python bench/race.py --url http://localhost:8008 --rounds 50 --concurrency 32
+"""
+import argparse
+import asyncio
+
+import httpx
+
+
+def arrival(vehicle_id: str, spot_id: int) -> dict:
+    return {"vehicle_id": vehicle_id, "spot_id": spot_id, "isEv": False, "type": "car"}
+
+
+async def same_spot(client: httpx.AsyncClient, round_no: int, concurrency: int) -> list:
+    """Разные ТС на одно место: должен пройти ровно один заезд"""
+    vehicle_ids = [f"race-{round_no}-{i}" for i in range(concurrency)]
+    responses = await asyncio.gather(*(
+        client.post("/api/vehicle/arrive", json=arrival(vehicle_id, 0)) for vehicle_id in vehicle_ids
+    ))
+    winners = [v for v, r in zip(vehicle_ids, responses) if r.status_code == 200]
+    errors = []
+    if len(winners) != 1:
+        errors.append(f"round {round_no}: {len(winners)} vehicles parked on spot 0")
+
+    # Одновременные выезды одного ТС: оплата должна пройти один раз
+    for winner_id in winners:
+        departures = await asyncio.gather(*(
+            client.post(f"/api/vehicle/depart/{winner_id}") for _ in range(concurrency)
+        ))
+        paid = [r for r in departures if r.status_code == 200]
+        if len(paid) != 1:
+            errors.append(f"round {round_no}: {winner_id} departed {len(paid)} times")
+    return errors
+
+
+async def same_vehicle(client: httpx.AsyncClient, round_no: int) -> list:
+    """Одно ТС на разные места: должен пройти ровно один заезд"""
+    vehicle_id = f"twin-{round_no}"
+    spots = range(1, 14)
+    responses = await asyncio.gather(*(
+        client.post("/api/vehicle/arrive", json=arrival(vehicle_id, spot_id)) for spot_id in spots
+    ))
+    errors = []
+    parked = sum(r.status_code == 200 for r in responses)
+    if parked != 1:
+        errors.append(f"round {round_no}: {vehicle_id} parked {parked} times")
+
+    status = (await client.get("/api/parking/status")).json()["data"]
+    occupied = [s for s in status if s["current_vehicle"] == vehicle_id]
+    if len(occupied) != parked:
+        errors.append(f"round {round_no}: {vehicle_id} holds {len(occupied)} spots")
+
+    await client.post(f"/api/vehicle/depart/{vehicle_id}")
+    return errors
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        await client.post("/api/reset")
+        errors = []
+        for round_no in range(args.rounds):
+            errors += await same_spot(client, round_no, args.concurrency)
+            errors += await same_vehicle(client, round_no)
+    for error in errors:
+        print(error)
+    print(f"{args.rounds} rounds, {len(errors)} violations")
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8008")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
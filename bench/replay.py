@@ -0,0 +1,123 @@
+"""Нагрузочный тест повтором записанного дня из журнала событий.
+
+Читает события за сутки из коллекции events и отправляет их запущенному
+серверу как заезды и выезды с исходными интервалами, ускоренными в
+--speed раз (сервер сам ставит текущее время). Выезды ТС, заехавших до
+начала суток, пропускаются; выезд отправляется только после ответа на
+заезд того же ТС. Печатает задержки по эндпоинтам и отставание отправки
+от расписания: если оно растет, сервер (или клиент) не успевает за
+ускорением. Результат можно сохранить и сравнить, как в bench/load.py.
+
+Пример:
+    python bench/replay.py --uri mongodb://localhost:27017/ --day 2025-03-01 --speed 60 --reset
+    python bench/replay.py --day 2025-03-01 --speed 600 --compare base.json --threshold 15
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from pymongo import AsyncMongoClient
+
+from report import Recorder, compare, load, percentile, print_summary, save
+
+
+async def read_day(args) -> list:
+    client = AsyncMongoClient(args.uri)
+    try:
+        start = args.day
+        cursor = client[args.db].events.find(
+            {"timestamp": {"$gte": start, "$lt": start + timedelta(days=1)}, "event": {"$in": ["arrive", "depart"]}},
+            {"_id": 0}
+        ).sort([("timestamp", 1), ("_id", 1)])
+        return await cursor.to_list()
+    finally:
+        await client.close()
+
+
+async def send(client, recorder, event: dict, lag: list, rejected: dict, due: float, previous):
+    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+    if previous is not None:
+        await previous
+    lag.append(time.perf_counter() - due)
+    started = time.perf_counter()
+    if event["event"] == "arrive":
+        name = "arrive"
+        response = await client.post("/api/vehicle/arrive", json={
+            "vehicle_id": event["vehicle_id"], "spot_id": event["spot_id"],
+            "isEv": event["isEv"], "type": event["type"]
+        })
+    else:
+        name = "depart"
+        response = await client.post(f"/api/vehicle/depart/{event['vehicle_id']}")
+    recorder.add(name, time.perf_counter() - started, response.status_code < 500)
+    if response.status_code != 200:
+        rejected[name] = rejected.get(name, 0) + 1
+
+
+async def main(args):
+    events = await read_day(args)
+    arrived = set()
+    schedule = []
+    for event in events:
+        if event["event"] == "arrive":
+            arrived.add(event["vehicle_id"])
+        elif event["vehicle_id"] not in arrived:
+            continue
+        schedule.append(event)
+    if not schedule:
+        print("Нет событий за эти сутки")
+        return
+    print(f"Событий: {len(schedule)}, длительность повтора: "
+          f"{(schedule[-1]['timestamp'] - schedule[0]['timestamp']).total_seconds() / args.speed:.0f} с")
+
+    recorder = Recorder()
+    lag, rejected = [], {}
+    limits = httpx.Limits(max_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        if args.reset:
+            await client.post("/api/reset")
+        first = schedule[0]["timestamp"]
+        started = time.perf_counter()
+        # Последняя отправка по каждому ТС: выезд ждет ответа на заезд
+        last_sent = {}
+        tasks = []
+        for event in schedule:
+            due = started + (event["timestamp"] - first).total_seconds() / args.speed
+            task = asyncio.create_task(send(client, recorder, event, lag, rejected, due, last_sent.get(event["vehicle_id"])))
+            last_sent[event["vehicle_id"]] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        summary = recorder.summary(time.perf_counter() - started)
+
+    print_summary(summary)
+    print(f"\nОтставание от расписания: p50 {percentile(lag, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(lag, 99) * 1000:.1f} ms, максимум {max(lag) * 1000:.1f} ms")
+    if rejected:
+        # Отказы 4xx: место занято или ТС уже на парковке (состояние сервера отличается от записанного)
+        print("Отклонено: " + ", ".join(f"{name} {count}" for name, count in rejected.items()))
+    if args.save:
+        save(args.save, summary, {k: str(v) for k, v in vars(args).items() if k not in ("save", "compare")})
+    if args.compare:
+        print()
+        if compare(load(args.compare), summary, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8008")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/", help="база с журналом событий")
+    parser.add_argument("--db", default="smart_parking")
+    parser.add_argument("--day", type=datetime.fromisoformat,
+                        default=datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time()),
+                        help="сутки для повтора (по умолчанию вчера)")
+    parser.add_argument("--speed", type=float, default=60.0, help="ускорение относительно реального времени")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--reset", action="store_true", help="сбросить места и ТС сервера перед повтором")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненным результатом")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95 при сравнении, %%")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""Сводка задержек бенчмарков и сравнение прогонов.
+
+Recorder накапливает задержки по эндпоинтам и считает p50/p95/p99 и
+пропускную способность. Результат прогона сохраняется в JSON, а два
+сохраненных прогона можно сравнить: рост p95 больше порога считается
+регрессией (код выхода 1).
+
+Пример:
+    python bench/report.py baseline.json current.json --threshold 15
+"""
+import argparse
+import json
+import sys
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+class Recorder:
+    """Накопление задержек по группам запросов"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name: str, elapsed: float, ok: bool):
+        self.samples.setdefault(name, []).append(elapsed)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration: float) -> dict:
+        """Итоги по эндпоинтам: число запросов, rps, перцентили и максимум в мс, ошибки"""
+        result = {}
+        for name, values in sorted(self.samples.items()):
+            result[name] = {
+                "requests": len(values),
+                "rps": round(len(values) / duration, 1),
+                **{f"p{p}": round(percentile(values, p) * 1000, 3) for p in PERCENTILES},
+                "max": round(max(values) * 1000, 3),
+                "errors": self.errors.get(name, 0),
+            }
+        return result
+
+
+def print_summary(summary: dict):
+    print(f"{'endpoint':<30}{'req':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, row in summary.items():
+        print(f"{name:<30}{row['requests']:>8}{row['rps']:>10.1f}{row['p50']:>10.2f}"
+              f"{row['p95']:>10.2f}{row['p99']:>10.2f}{row['max']:>10.2f}{row['errors']:>8}")
+
+
+def save(path: str, summary: dict, params: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "endpoints": summary}, f, ensure_ascii=False, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["endpoints"]
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """Печать изменений p50/p95/p99 и rps; True, если p95 какого-либо эндпоинта вырос больше порога (%)"""
+    regressed = False
+    print(f"{'endpoint':<30}{'p50 %':>10}{'p95 %':>10}{'p99 %':>10}{'rps %':>10}")
+    for name, row in current.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<30}{'new':>10}")
+            continue
+        changes = [
+            (row[key] - base[key]) / base[key] * 100 if base[key] else 0
+            for key in ("p50", "p95", "p99", "rps")
+        ]
+        flag = ""
+        if changes[1] > threshold:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"{name:<30}" + "".join(f"{change:>+10.1f}" for change in changes) + flag)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95, %%")
+    args = parser.parse_args()
+    sys.exit(1 if compare(load(args.baseline), load(args.current), args.threshold) else 0)
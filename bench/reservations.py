@@ -0,0 +1,142 @@
+"""Проверка пересечения брони: перебор броней места против SpotSchedule.
+
+Заполняет место заданным числом непересекающихся броней (по 1-4 часа с
+промежутками) и замеряет среднее время проверки, свободно ли место на
+случайный период: перебором всех броней места (как запрос к коллекции
+без индекса по интервалам) и двоичным поиском SpotSchedule. Затем на
+парковке из --spots мест, где часть мест занята, а у части есть брони,
+сравнивает поиск места, свободного на период (ближайший или будущий):
+перебором мест по порядку и ReservationBook.find_spot. База не нужна.
+
+Пример:
+    python bench/reservations.py --bookings 100 1000 10000 --ops 20000
+    python bench/reservations.py --spots 1000 10000 100000 --reserved 0.1 --occupied 0.8
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import layout  # noqa: E402
+from occupancy import parking_state  # noqa: E402
+from reservations import ReservationBook, SpotSchedule  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+START = datetime(2025, 1, 1)
+
+
+def build(bookings: int) -> list:
+    items, at = [], START
+    for n in range(bookings):
+        at += timedelta(minutes=random.randrange(0, 180))
+        end = at + timedelta(minutes=random.randrange(60, 240))
+        items.append({"reservation_id": str(n), "start": at, "end": end})
+        at = end
+    return items
+
+
+def queries(items: list, ops: int) -> list:
+    span = (items[-1]["end"] - START).total_seconds()
+    result = []
+    for _ in range(ops):
+        start = START + timedelta(seconds=random.uniform(0, span))
+        result.append((start, start + timedelta(minutes=random.randrange(30, 240))))
+    return result
+
+
+def scan(items: list, periods: list) -> tuple:
+    started = time.perf_counter()
+    free = sum(not any(r["start"] < end and r["end"] > start for r in items) for start, end in periods)
+    return (time.perf_counter() - started) / len(periods), free
+
+
+def schedule(items: list, periods: list) -> tuple:
+    spot = SpotSchedule()
+    for reservation in items:
+        spot.add(reservation)
+    started = time.perf_counter()
+    free = sum(not spot.overlapping(start, end) for start, end in periods)
+    return (time.perf_counter() - started) / len(periods), free
+
+
+def find_linear(book: ReservationBook, start: datetime, end: datetime):
+    """Прежний способ: места группы по порядку с проверкой брони каждого"""
+    for spot_id in parking_state.spots_in_order("regular"):
+        if book.reservable(spot_id, start, end):
+            return spot_id
+    return None
+
+
+async def load_spots(spots: int):
+    storage = MemoryStorage()
+    await storage.init_spots(layout.expand_spots(
+        [{"lot_id": "main", "name": "bench", "zones": [{"zone_id": "A", "spots": {"regular": spots}}]}]
+    ))
+    await parking_state.load(storage)
+
+
+def find_spots(spots: int, reserved: float, occupied: float, ops: int):
+    asyncio.run(load_spots(spots))
+    book = ReservationBook()
+    parking_state.listeners[:] = [book.spot_changed]
+    order = parking_state.spots_in_order("regular")
+    now = datetime.now()
+    # Первые по порядку места заняты, у случайной доли мест по несколько броней в ближайшие трое суток
+    for n, spot_id in enumerate(order[:int(spots * occupied)]):
+        parking_state.occupy(spot_id, {"id": f"parked-{n}", "spot_id": spot_id, "entry_time": now})
+    for n, spot_id in enumerate(random.sample(order, int(spots * reserved))):
+        for day in range(3):
+            at = now + timedelta(days=day, hours=random.uniform(0, 24))
+            book._add({"reservation_id": f"{n}-{day}", "spot_id": spot_id, "vehicle_id": f"bench-{n}",
+                       "start": at, "end": at + timedelta(hours=random.randrange(1, 4)), "status": "active"})
+    # Половина периодов начинается в ближайшие минуты (важна физическая занятость), половина — позже
+    periods = []
+    for n in range(ops):
+        at = now + (timedelta(minutes=5) if n % 2 else timedelta(hours=random.uniform(1, 72)))
+        periods.append((at, at + timedelta(hours=random.randrange(1, 4))))
+
+    subset = periods[:max(1, min(ops, 2_000_000 // spots))]
+    started = time.perf_counter()
+    expected = [find_linear(book, *period) for period in subset]
+    linear = (time.perf_counter() - started) / len(subset)
+    assert [book.find_spot("regular", *period) for period in subset] == expected
+    # Освобождение места возвращает его в поиск
+    parking_state.release(order[0], "parked-0")
+    assert book.find_spot("regular", *periods[1]) == find_linear(book, *periods[1])
+    started = time.perf_counter()
+    for period in periods:
+        book.find_spot("regular", *period)
+    indexed = (time.perf_counter() - started) / len(periods)
+    print(f"{spots:>8} spots     scan {linear * 1e6:10.2f} us  find_spot {indexed * 1e6:7.2f} us  x{linear / indexed:8.1f}")
+
+
+def main(args):
+    if args.spots:
+        for spots in args.spots:
+            random.seed(spots)
+            find_spots(spots, args.reserved, args.occupied, args.ops)
+        return
+    for bookings in args.bookings:
+        random.seed(bookings)
+        items = build(bookings)
+        periods = queries(items, args.ops)
+        # Перебор на большом числе броней медленный, поэтому для него меньше запросов
+        subset = periods[:max(1, min(args.ops, 20_000_000 // bookings))]
+        linear, expected = scan(items, subset)
+        assert schedule(items, subset)[1] == expected
+        indexed, _ = schedule(items, periods)
+        print(f"{bookings:>8} bookings  scan {linear * 1e6:10.2f} us  schedule {indexed * 1e6:8.2f} us  x{linear / indexed:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--spots", type=int, nargs="+", help="замерить поиск места на парковке из стольких мест")
+    parser.add_argument("--reserved", type=float, default=0.1, help="доля мест с бронями")
+    parser.add_argument("--occupied", type=float, default=0.8, help="доля занятых мест")
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+"""Сравнение задержки статистики: сырые агрегации против готовых агрегатов.
+
+Заполняет отдельную базу синтетическими замерами загруженности и выездами
+за сутки, строит по ним агрегаты (app/rollups.py) и замеряет время
+получения статистики обоими способами.
+
+Пример:
+    python bench/rollups.py --uri mongodb://localhost:27017/ --events 50000 --repeat 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import AsyncMongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import rollups  # noqa: E402
+
+
+async def seed(db, events: int, end_time: datetime):
+    """Синтетические события, равномерно распределенные по последним суткам"""
+    await db.parking_load_history.delete_many({})
+    await db.parking_history.delete_many({})
+    load, history = [], []
+    for _ in range(events):
+        ts = end_time - timedelta(seconds=random.uniform(0, 86400))
+        occupied = random.randint(0, 16)
+        load.append({
+            "timestamp": ts,
+            "occupied_spots": occupied,
+            "total_spots": 16,
+            "load_percentage": round(occupied / 16 * 100, 2)
+        })
+        duration = round(random.uniform(1, 240), 1)
+        history.append({
+            "vehicle_id": f"bench-{len(history)}",
+            "vehicle_type": "car",
+            "spot_id": random.randint(0, 13),
+            "entry_time": ts - timedelta(minutes=duration),
+            "exit_time": ts,
+            "duration_minutes": duration,
+            "cost": round(duration * 1.5, 2)
+        })
+    await db.parking_load_history.insert_many(load)
+    await db.parking_history.insert_many(history)
+    await db.parking_load_history.create_index("timestamp")
+    await db.parking_history.create_index("exit_time")
+
+
+async def raw_pipeline(db, start_time: datetime, end_time: datetime):
+    """Прежний способ: группировка по секундам и перегруппировка в Python"""
+    stats = await (await db.parking_load_history.aggregate([
+        {"$match": {"timestamp": {"$gte": start_time, "$lte": end_time}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$timestamp"}},
+            "count": {"$sum": 1},
+            "occupied_spots": {"$avg": "$occupied_spots"},
+            "load_percentage": {"$avg": "$load_percentage"}
+        }}
+    ])).to_list()
+    buckets = {}
+    for stat in stats:
+        dt = datetime.strptime(stat["_id"], "%Y-%m-%d %H:%M:%S")
+        key = rollups.bucket_start(dt, "1m")
+        bucket = buckets.setdefault(key, [0, 0, 0])
+        bucket[0] += stat["count"]
+        bucket[1] += stat["occupied_spots"]
+        bucket[2] += stat["load_percentage"]
+    return buckets
+
+
+async def measure(name, repeat, fn):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"{name:<10} median {samples[len(samples) // 2] * 1000:8.2f} ms   max {samples[-1] * 1000:8.2f} ms")
+
+
+async def main(args):
+    client = AsyncMongoClient(args.uri)
+    db = client[args.db]
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days=1)
+
+    await seed(db, args.events, end_time)
+    await rollups.create_indexes(db)
+    started = time.perf_counter()
+    await rollups.rebuild(db)
+    print(f"rebuild    {(time.perf_counter() - started) * 1000:8.2f} ms for {args.events} events")
+
+    await measure("raw", args.repeat, lambda: raw_pipeline(db, start_time, end_time))
+    await measure("rollups", args.repeat, lambda: rollups.read(db, start_time, end_time, "1m"))
+
+    await client.drop_database(args.db)
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--db", default="smart_parking_bench")
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
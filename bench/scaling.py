@@ -0,0 +1,85 @@
+"""Масштабирование чтения на несколько экземпляров сервиса.
+
+Для каждого URL по очереди несколько процессов-клиентов в течение
+заданного времени опрашивают /api/parking/status и /api/vehicles и
+печатают пропускную способность и задержки. Первый URL — база для
+сравнения (например, один экземпляр), остальные — балансировщик перед
+несколькими экземплярами: при почти линейном масштабировании rps растет
+пропорционально числу экземпляров. Клиентов нужно запускать на
+отдельной машине или с запасом ядер, иначе упором станет сам бенчмарк.
+
+Пример (docker compose --profile scale up --scale app=4):
+    python bench/scaling.py --urls http://localhost:8008 http://localhost:8080 --replicas 1 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+import httpx
+
+from report import Recorder
+
+ENDPOINTS = ["/api/parking/status", "/api/vehicles"]
+
+
+async def reader(client: httpx.AsyncClient, samples: list, deadline: float, offset: int):
+    n = offset
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(ENDPOINTS[n % len(ENDPOINTS)])
+        samples.append((time.perf_counter() - started, response.status_code < 500))
+        n += 1
+
+
+async def client_process(url: str, connections: int, duration: float) -> list:
+    samples = []
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(reader(client, samples, deadline, i) for i in range(connections)))
+    return samples
+
+
+def run_client(args_tuple) -> list:
+    return asyncio.run(client_process(*args_tuple))
+
+
+def measure(url: str, args) -> dict:
+    with multiprocessing.Pool(args.processes) as pool:
+        # Прогрев: соединения и кэши ответов экземпляров
+        pool.map(run_client, [(url, args.connections, 1.0)] * args.processes)
+        started = time.perf_counter()
+        results = pool.map(run_client, [(url, args.connections, args.duration)] * args.processes)
+        elapsed = time.perf_counter() - started
+    recorder = Recorder()
+    for samples in results:
+        for value, ok in samples:
+            recorder.add("read", value, ok)
+    return recorder.summary(elapsed)["read"]
+
+
+def main(args):
+    replicas = args.replicas or list(range(1, len(args.urls) + 1))
+    rows = []
+    for url, count in zip(args.urls, replicas):
+        row = measure(url, args)
+        rows.append((url, count, row))
+
+    base_rps = rows[0][2]["rps"]
+    print(f"{'url':<32}{'экз.':>6}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'ошибки':>8}{'ускорение':>11}{'эффект.':>9}")
+    for url, count, row in rows:
+        speedup = row["rps"] / base_rps if base_rps else 0
+        efficiency = speedup / (count / replicas[0]) * 100
+        print(f"{url:<32}{count:>6}{row['rps']:>10.0f}{row['p50']:>10.2f}{row['p99']:>10.2f}"
+              f"{row['errors']:>8}{speedup:>10.2f}x{efficiency:>8.0f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", nargs="+", default=["http://localhost:8008", "http://localhost:8080"])
+    parser.add_argument("--replicas", type=int, nargs="+", help="число экземпляров за каждым URL (по умолчанию 1, 2, ...)")
+    parser.add_argument("--processes", type=int, default=4, help="процессов-клиентов")
+    parser.add_argument("--connections", type=int, default=32, help="параллельных соединений в каждом процессе")
+    parser.add_argument("--duration", type=float, default=15.0)
+    main(parser.parse_args())
@@ -0,0 +1,84 @@
+"""Стоимость сериализации ответов статуса, списка ТС и статистики.
+
+Сравнивает путь FastAPI по умолчанию (jsonable_encoder + json.dumps, как
+делает JSONResponse), orjson без jsonable_encoder и готовое тело из кэша
+ParkingState для парковки заданного размера. База не нужна.
+
+Пример:
+    python bench/serialization.py --spots 10000 --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from occupancy import ParkingState  # noqa: E402
+
+
+def build_state(spots: int) -> ParkingState:
+    """Состояние парковки с занятыми 80% мест без обращения к базе"""
+    state = ParkingState()
+    now = datetime.now()
+    state.lots = {"main": {"lot_id": "main", "zones": [{"zone_id": "A"}]}}
+    state.spot_ids = list(range(spots))
+    state.spot_index = {spot_id: i for i, spot_id in enumerate(state.spot_ids)}
+    state.spot_lots = ["main"] * spots
+    state.spot_zones = ["A"] * spots
+    state.spot_types = ["ev" if i % 10 == 0 else "regular" for i in range(spots)]
+    state.occupied = bytearray(i % 5 != 0 for i in range(spots))
+    state.current_vehicle = [f"V{i}" if state.occupied[i] else None for i in range(spots)]
+    state.vehicles = {
+        f"V{i}": {
+            "id": f"V{i}", "isEv": state.spot_types[i] == "ev", "type": "car",
+            "entry_time": now - timedelta(minutes=i % 600), "exit_time": None,
+            "spot_id": i, "lot_id": "main", "paid": False
+        }
+        for i in range(spots) if state.occupied[i]
+    }
+    return state
+
+
+def stats_series(points: int) -> list:
+    return [
+        {"timestamp": f"2025-01-01 {i // 60 % 24:02d}:{i % 60:02d}", "count": i, "occupied_spots": 12.5, "load_percentage": 78.13}
+        for i in range(points)
+    ]
+
+
+def measure(name: str, repeat: int, func):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        size = len(func())
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+    print(f"  {name:<28}{elapsed:>10.2f} ms{size / 1024:>10.0f} KiB")
+
+
+def main(args):
+    state = build_state(args.spots)
+    series = stats_series(args.points)
+    default = lambda content: json.dumps(jsonable_encoder(content), ensure_ascii=False).encode()  # noqa: E731
+
+    for title, build, cached in [
+        ("/api/parking/status", lambda: {"status": "success", "data": state.spots()}, state.status_body),
+        ("/api/vehicles", lambda: {"status": "success", "data": state.active_vehicles()}, state.vehicles_body),
+        (f"/api/stats/* ({args.points} points)", lambda: {"status": "success", "data": series}, None),
+    ]:
+        print(title)
+        measure("jsonable_encoder + json", args.repeat, lambda: default(build()))
+        measure("orjson", args.repeat, lambda: orjson.dumps(build()))
+        if cached:
+            measure("cached body", args.repeat, cached)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--points", type=int, default=8640)
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+"""Стоянки в момент времени: выборка всей истории против индексного диапазона.
+
+Заполняет отдельную базу синтетической историей стоянок за --days суток,
+создает индексы сервиса и замеряет время ответа на «какие ТС стояли в
+момент ts» для случайных моментов: фильтрацией всей выборки
+exit_time > ts в Python (прежний способ) и первой страницей sessions.at.
+Затем замеряет первую страницу стоянок одного ТС (sessions.of_vehicle).
+
+Пример:
+    python bench/sessions.py --uri mongodb://localhost:27017/ --days 365 --per-day 2000 --repeat 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import sessions  # noqa: E402
+
+
+async def seed(db, days: int, per_day: int, end_time: datetime, vehicles: int):
+    await db.parking_history.drop()
+    start = end_time - timedelta(days=days)
+    batch = []
+    for n in range(days * per_day):
+        exit_time = start + timedelta(seconds=random.uniform(0, days * 86400))
+        duration = round(random.expovariate(1 / 90), 1)
+        batch.append({
+            "vehicle_id": f"bench-{random.randrange(vehicles)}",
+            "vehicle_type": "car",
+            "spot_id": random.randrange(100),
+            "lot_id": "main",
+            "entry_time": exit_time - timedelta(minutes=duration),
+            "exit_time": exit_time,
+            "duration_minutes": duration,
+            "cost": round(duration * 1.5, 2)
+        })
+        if len(batch) >= 10000:
+            await db.parking_history.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.parking_history.insert_many(batch, ordered=False)
+    # Те же индексы, что создает сервис (database.create_indexes)
+    await db.parking_history.create_index([("exit_time", ASCENDING)])
+    await db.parking_history.create_index([("exit_time", ASCENDING), ("_id", ASCENDING), ("entry_time", ASCENDING)])
+    await db.parking_history.create_index([("vehicle_id", ASCENDING), ("exit_time", DESCENDING), ("_id", DESCENDING)])
+    await db.parking_history.create_index([("duration_minutes", DESCENDING)])
+
+
+async def scan(db, ts: datetime) -> int:
+    """Прежний способ: все стоянки с выездом после ts и фильтр по заезду в Python"""
+    docs = await db.parking_history.find({"exit_time": {"$gt": ts}}, {"_id": 0}).to_list()
+    return len([doc for doc in docs if doc["entry_time"] <= ts])
+
+
+async def timed(call, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await call()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def main(args):
+    client = AsyncMongoClient(args.uri)
+    db = client[args.db]
+    end_time = datetime.now().replace(microsecond=0)
+    try:
+        if not args.no_seed:
+            print(f"Заполнение: {args.days * args.per_day} стоянок за {args.days} сут.")
+            await seed(db, args.days, args.per_day, end_time, args.vehicles)
+        random.seed(1)
+        # Моменты в первой половине периода: прежнему способу приходится читать больше половины истории
+        moments = [end_time - timedelta(days=random.uniform(args.days / 2, args.days)) for _ in range(args.repeat)]
+        for ts in moments[:3]:
+            page, _ = await sessions.at(db, ts, {}, limit=sessions.SESSIONS_MAX_PAGE_SIZE)
+            assert len(page) == await scan(db, ts)
+
+        it = iter(moments * 2)
+        scan_ms = await timed(lambda: scan(db, next(it)), args.repeat)
+        it = iter(moments * 2)
+        at_ms = await timed(lambda: sessions.at(db, next(it), {}), args.repeat)
+        vehicle_ms = await timed(lambda: sessions.of_vehicle(db, f"bench-{random.randrange(args.vehicles)}"), args.repeat)
+        print(f"в момент ts, выборка:   {scan_ms:10.2f} ms")
+        print(f"в момент ts, индекс:    {at_ms:10.2f} ms  x{scan_ms / at_ms:.0f}")
+        print(f"стоянки ТС, страница:   {vehicle_ms:10.2f} ms")
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="smart_parking_bench")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=2000)
+    parser.add_argument("--vehicles", type=int, default=20000, help="число разных ТС")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="использовать уже заполненную базу")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,100 @@
+"""Время старта сервиса: импорт, живость и готовность.
+
+--runs раз запускает сервис отдельным процессом uvicorn и замеряет время
+от запуска процесса до первого ответа 200 на /healthz (процесс принимает
+соединения) и на /readyz (хранилище подключено, индексы созданы,
+состояние загружено). Отдельно замеряется импорт модуля main: он не
+должен обращаться к базе. С --budget прогон завершается с кодом 1, если
+p95 готовности превышает бюджет (секунды), — проверка для CI наравне со
+сравнением с сохраненным прогоном.
+
+Пример:
+    python bench/startup.py --runs 10 --backend memory --budget 1
+    python bench/startup.py --runs 10 --backend mongo --save startup.json
+    python bench/startup.py --runs 10 --backend mongo --compare startup.json --threshold 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from report import Recorder, compare, load, print_summary, save
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def wait_for(client: httpx.Client, path: str, started: float, process, timeout: float) -> float:
+    """Время от запуска процесса до ответа 200 на path"""
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервис завершился с кодом {process.returncode}")
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"Нет ответа 200 на {path} за {timeout} с")
+
+
+def run_once(args, env: dict, recorder: Recorder):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], cwd=APP_DIR, env=env, check=True)
+    recorder.add("import main", time.perf_counter() - started, True)
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=1) as client:
+            recorder.add("healthz", wait_for(client, "/healthz", started, process, args.timeout), True)
+            recorder.add("readyz", wait_for(client, "/readyz", started, process, args.timeout), True)
+            return client.get("/readyz").json()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args):
+    env = {**os.environ, "STORAGE_BACKEND": args.backend}
+    if args.uri:
+        env["MONGODB_URI"] = args.uri
+    recorder = Recorder()
+    begin = time.perf_counter()
+    for _ in range(args.runs):
+        status = run_once(args, env, recorder)
+    summary = recorder.summary(time.perf_counter() - begin)
+
+    print_summary(summary)
+    print(f"этапы последнего старта, с: {status['phases']}")
+    if args.save:
+        save(args.save, summary, {k: str(v) for k, v in vars(args).items() if k not in ("save", "compare")})
+    failed = False
+    if args.compare:
+        print()
+        failed = compare(load(args.compare), summary, args.threshold)
+    if args.budget is not None:
+        ready = summary["readyz"]["p95"] / 1000
+        print(f"готовность p95 {ready:.3f} с, бюджет {args.budget} с")
+        failed = failed or ready > args.budget
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", default="mongo", choices=["mongo", "sqlite", "memory"], help="STORAGE_BACKEND сервиса")
+    parser.add_argument("--uri", help="MONGODB_URI сервиса")
+    parser.add_argument("--port", type=int, default=8018)
+    parser.add_argument("--timeout", type=float, default=60, help="наибольшее ожидание готовности, с")
+    parser.add_argument("--budget", type=float, help="допустимое время готовности (p95), с")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненным результатом")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95 при сравнении, %%")
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+"""Задержка записи заезда и выезда в разных хранилищах.
+
+Для каждого хранилища (app/storage.py) создает места и последовательно
+регистрирует --events заездов и выездов, замеряя время одной операции
+хранилища без HTTP. MongoDB замеряется, только если задан --uri (в
+отдельной базе --db, которая очищается), SQLite — во временном файле.
+
+Пример:
+    python bench/storage.py --events 20000
+    python bench/storage.py --events 20000 --uri mongodb://localhost:27017/ --save storage.json
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from report import Recorder, compare, load, print_summary, save
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import layout  # noqa: E402
+from storage import MemoryStorage, MongoStorage, SqliteStorage  # noqa: E402
+
+LOTS = [{"lot_id": "main", "name": "bench", "zones": [{"zone_id": "A", "spots": {"regular": 100}}]}]
+
+
+def close_session(vehicle: dict) -> dict:
+    exit_time = datetime.now()
+    duration = (exit_time - vehicle["entry_time"]).total_seconds() / 60
+    return {
+        "vehicle_id": vehicle["id"], "vehicle_type": vehicle["type"], "spot_id": vehicle["spot_id"],
+        "lot_id": vehicle["lot_id"], "entry_time": vehicle["entry_time"], "exit_time": exit_time,
+        "duration_minutes": round(duration, 1), "cost": round(duration * 1.5, 2)
+    }
+
+
+async def run(storage, name: str, events: int) -> dict:
+    recorder = Recorder()
+    await storage.connect()
+    try:
+        await storage.reset()
+        await storage.init_spots(layout.expand_spots(LOTS))
+        begin = time.perf_counter()
+        for n in range(events):
+            vehicle = {
+                "id": f"bench-{n}", "isEv": False, "type": "car", "entry_time": datetime.now(),
+                "exit_time": None, "spot_id": n % 100, "lot_id": "main", "paid": False
+            }
+            started = time.perf_counter()
+            ok = await storage.occupy(vehicle)
+            recorder.add(f"{name} arrive", time.perf_counter() - started, ok)
+            started = time.perf_counter()
+            await storage.depart(vehicle["id"], datetime.now(), close_session)
+            recorder.add(f"{name} depart", time.perf_counter() - started, True)
+        return recorder.summary(time.perf_counter() - begin)
+    finally:
+        await storage.close()
+
+
+async def main(args):
+    summary = await run(MemoryStorage(), "memory", args.events)
+    with tempfile.TemporaryDirectory() as directory:
+        summary.update(await run(SqliteStorage(os.path.join(directory, "bench.db")), "sqlite", args.events))
+    if args.uri:
+        from pymongo import AsyncMongoClient
+        db = AsyncMongoClient(args.uri)[args.db]
+        await db.client.drop_database(args.db)
+        summary.update(await run(MongoStorage(db), "mongo", args.events))
+
+    print_summary(summary)
+    if args.save:
+        save(args.save, summary, {k: str(v) for k, v in vars(args).items() if k not in ("save", "compare")})
+    if args.compare:
+        print()
+        if compare(load(args.compare), summary, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="заездов и выездов на хранилище")
+    parser.add_argument("--uri", help="MongoDB для сравнения (без него замеряются только встроенные хранилища)")
+    parser.add_argument("--db", default="smart_parking_bench")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненным результатом")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимый рост p95 при сравнении, %%")
+    asyncio.run(main(parser.parse_args()))
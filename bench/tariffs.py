@@ -0,0 +1,76 @@
+"""Пересчет стоимости стоянок: цикл по стоянкам против векторного расчета.
+
+Генерирует случайные стоянки (от минут до нескольких суток) и считает их
+стоимость по тарифу с ночной ставкой, бесплатным временем и суточным
+максимумом: по одной стоянке (как при выезде) и массивами NumPy (как при
+пересчете истории). База не нужна.
+
+Пример:
+    python bench/tariffs.py --sessions 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from tariffs import EPOCH, Tariff  # noqa: E402
+
+TARIFF = {
+    "rates": {"car": 1.5, "evCar": 2.5},
+    "periods": [{"start": "22:00", "end": "07:00", "rates": {"car": 0.5, "evCar": 1.0}}],
+    "grace_minutes": 10,
+    "daily_cap": {"car": 900, "evCar": 1500},
+}
+
+
+def sessions(count: int):
+    """Стоянки в виде документов истории: время и в datetime, и в миллисекундах, как его отдает база через $toLong"""
+    start = datetime(2025, 1, 1)
+    docs = []
+    for _ in range(count):
+        entry = start + timedelta(seconds=random.randrange(90 * 86400))
+        exit_ = entry + timedelta(seconds=random.choice((random.randrange(3600), random.randrange(3 * 86400))))
+        docs.append({
+            "is_ev": random.random() < 0.2,
+            "entry_time": entry, "exit_time": exit_,
+            "entry_ms": (entry - EPOCH) // timedelta(milliseconds=1),
+            "exit_ms": (exit_ - EPOCH) // timedelta(milliseconds=1),
+        })
+    return docs
+
+
+def main(args):
+    tariff = Tariff(TARIFF)
+    print(f"{'Стоянок':>10}{'по одной':>14}{'векторно':>14}{'ускорение':>12}")
+    for count in args.sessions:
+        docs = sessions(count)
+
+        started = time.perf_counter()
+        expected = [tariff.cost(doc["is_ev"], doc["entry_time"], doc["exit_time"]) for doc in docs]
+        loop = time.perf_counter() - started
+
+        # Сборка массивов из документов входит в замер: при пересчете она делается для каждой пачки
+        started = time.perf_counter()
+        costs = tariff.costs(
+            np.fromiter((doc["is_ev"] for doc in docs), bool, count),
+            np.fromiter((doc["entry_ms"] for doc in docs), np.int64, count),
+            np.fromiter((doc["exit_ms"] for doc in docs), np.int64, count),
+        )
+        vectorized = time.perf_counter() - started
+
+        assert np.allclose(costs, expected)
+        print(f"{count:>10}{loop * 1000:>11.0f} ms{vectorized * 1000:>11.0f} ms{loop / vectorized:>11.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    main(args)